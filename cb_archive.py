@@ -0,0 +1,217 @@
+# cb_archive.py
+# Titan SOP V100.0 — CB Snapshot Archive (CB 歷史快照庫)
+# 包含：依日期分區、只增不改的 CB 清單 / 普查結果存檔 (欄式 Parquet)、
+#       時間點查詢 (as_of) 與區間歷史 (history / series)
+# 每次上傳的標準化清單與每次普查結果各存一份，回測與趨勢檢視可重播
+# 「當時」的轉換價、已轉換比例與 CB 價格，不必再逐一重讀 Excel。
+#
+# 目錄結構：
+#   data/cb_archive/<kind>/date=YYYY-MM-DD/<擷取時間 epoch_ms>_<內容指紋前 16 碼>.parquet
+# kind = upload (load_cb_data_from_upload 輸出) / scan (scan_entire_portfolio 輸出)
+
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+import pandas as pd
+
+from config import DATA_DIR
+from fingerprint import frame_fingerprint
+
+# ── 可選依賴：有 pyarrow 用 Parquet (可只讀需要的欄)，否則退回 pickle ──────────
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    _HAS_PARQUET = True
+except ImportError:
+    _HAS_PARQUET = False
+
+CB_ARCHIVE_DIR = DATA_DIR / "cb_archive"
+ARCHIVE_KINDS = ("upload", "scan")
+_PART_RE = re.compile(r"^date=(\d{4}-\d{2}-\d{2})$")
+_FILE_RE = re.compile(r"^(\d+)_([0-9a-f]+)\.(parquet|pkl)$")
+# 存檔可能遇到的錯誤 (磁碟 / 權限、欄位型別無法轉成 Parquet)；呼叫端統一攔截並回報，不中斷主流程
+ARCHIVE_ERRORS = (OSError, pa.ArrowException) if _HAS_PARQUET else (OSError,)
+
+
+def _to_columnar(df: pd.DataFrame) -> pd.DataFrame:
+    """欄式格式只收單純型別：dict / list 等物件欄位轉成文字，欄名一律轉字串"""
+    out = df.copy()
+    out.columns = [str(c) for c in out.columns]
+    for col in out.columns:
+        if out[col].dtype == object:
+            vals = out[col]
+            if not vals.map(lambda v: v is None or isinstance(v, str)).all():
+                out[col] = vals.map(lambda v: None if v is None or (isinstance(v, float) and pd.isna(v)) else str(v))
+    return out.reset_index(drop=True)
+
+
+class CBArchive:
+    """
+    只增不改的 CB 快照庫。每筆快照一個檔案，寫入後不再修改；
+    同一日同一份內容 (指紋相同) 重複存檔會被略過，Streamlit 重跑不會灌爆磁碟。
+    """
+
+    def __init__(self, root: Path | str = CB_ARCHIVE_DIR):
+        self.root = Path(root)
+        self._lock = threading.Lock()
+
+    # ── 路徑 ─────────────────────────────────────────────────
+    def _kind_dir(self, kind: str) -> Path:
+        if kind not in ARCHIVE_KINDS:
+            raise ValueError(f"未知的快照種類: {kind}")
+        return self.root / kind
+
+    def _partition(self, kind: str, day: pd.Timestamp) -> Path:
+        return self._kind_dir(kind) / f"date={day:%Y-%m-%d}"
+
+    def _files(self, kind: str, start=None, end=None) -> Dict[pd.Timestamp, List[Path]]:
+        """{分區日期: 依擷取時間排序的快照檔}，只掃目錄名稱，不讀檔案內容"""
+        base = self._kind_dir(kind)
+        if not base.exists():
+            return {}
+        lo = pd.Timestamp(start).normalize() if start is not None else None
+        hi = pd.Timestamp(end).normalize() if end is not None else None
+        out = {}
+        for part in base.iterdir():
+            m = _PART_RE.match(part.name)
+            if not m or not part.is_dir():
+                continue
+            day = pd.Timestamp(m.group(1))
+            if (lo is not None and day < lo) or (hi is not None and day > hi):
+                continue
+            files = sorted((f for f in part.iterdir() if _FILE_RE.match(f.name)),
+                           key=lambda f: int(_FILE_RE.match(f.name).group(1)))
+            if files:
+                out[day] = files
+        return dict(sorted(out.items()))
+
+    @staticmethod
+    def _read(path: Path, columns: Iterable[str] | None = None) -> pd.DataFrame:
+        """讀單一快照；指定欄位時只讀存在的欄，較早快照沒有的欄補 NaN (清單欄位會隨時間增加)"""
+        cols = list(columns) if columns else None
+        if path.suffix == ".parquet":
+            have = set(pq.read_schema(path).names) if cols else None
+            df = pd.read_parquet(path, columns=[c for c in cols if c in have] if cols else None)
+        else:
+            df = pd.read_pickle(path)
+        return df.reindex(columns=cols) if cols else df
+
+    # ── 寫入 ─────────────────────────────────────────────────
+    def append(self, df: pd.DataFrame, kind: str = "upload", as_of=None) -> Path | None:
+        """
+        存入一份快照 (as_of 省略為今天)。同日已有相同內容者略過並回傳 None，
+        否則回傳新檔路徑。以暫存檔 + os.replace 寫入，讀取端不會看到半寫入的檔案。
+        """
+        if df is None or df.empty:
+            return None
+        day = pd.Timestamp(as_of if as_of is not None else pd.Timestamp.now()).normalize()
+        data = _to_columnar(df)
+        fp = frame_fingerprint(data)[:16]
+        part = self._partition(kind, day)
+        with self._lock:
+            if part.exists() and any((m := _FILE_RE.match(f.name)) and m.group(2) == fp
+                                     for f in part.iterdir()):
+                return None
+            part.mkdir(parents=True, exist_ok=True)
+            ext = "parquet" if _HAS_PARQUET else "pkl"
+            path = part / f"{time.time_ns() // 1_000_000}_{fp}.{ext}"
+            tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+            try:
+                if _HAS_PARQUET:
+                    data.to_parquet(tmp, index=False)
+                else:
+                    data.to_pickle(tmp)
+                os.replace(tmp, path)
+            finally:
+                tmp.unlink(missing_ok=True)   # 寫入失敗不留半成品，之後同內容可重試
+        return path
+
+    # ── 查詢 ─────────────────────────────────────────────────
+    def dates(self, kind: str = "upload") -> List[pd.Timestamp]:
+        """有快照的日期 (遞增)"""
+        return list(self._files(kind))
+
+    def as_of(self, when, kind: str = "upload", columns: Iterable[str] | None = None) -> pd.DataFrame:
+        """
+        時間點查詢：when 當日 (含) 以前最後一份快照，也就是「那天看得到的清單」。
+        查無時回傳空 DataFrame；attrs['as_of'] 為實際採用的快照日期。
+        """
+        files = self._files(kind, end=when)
+        if not files:
+            return pd.DataFrame()
+        day, paths = next(reversed(files.items()))
+        df = self._read(paths[-1], columns)
+        df.attrs['as_of'] = day
+        return df
+
+    def history(self, start=None, end=None, kind: str = "upload", codes: Iterable[str] | None = None,
+                columns: Iterable[str] | None = None) -> pd.DataFrame:
+        """
+        區間歷史 (long format)：每個有快照的日期取當日最後一份，加上 date 欄後串接。
+        可只讀部分欄位 / 部分代號；輸出可直接餵給 backtest.build_cb_panels。
+        """
+        cols = list(dict.fromkeys(["code", *columns])) if columns else None
+        want = sorted({str(c).strip() for c in codes}) if codes is not None else None
+        latest = {day: paths[-1] for day, paths in self._files(kind, start, end).items()}
+        if not latest:
+            return pd.DataFrame(columns=["date", *(cols or [])])
+        out = None
+        if _HAS_PARQUET and all(p.suffix == ".parquet" for p in latest.values()):
+            try:
+                out = self._scan_parquet(kind, list(latest.values()), cols, want)
+            except Exception:
+                out = None   # 各期欄位不一致等情況：退回逐檔讀取
+        if out is None:
+            parts = []
+            for day, path in latest.items():
+                df = self._read(path, cols)
+                if want is not None and 'code' in df.columns:
+                    df = df[df['code'].astype(str).str.strip().isin(want)]
+                parts.append(df.assign(date=day))
+            out = pd.concat(parts, ignore_index=True)
+        return out[["date", *[c for c in out.columns if c != "date"]]]
+
+    def _scan_parquet(self, kind: str, paths: List[Path], cols, want) -> pd.DataFrame:
+        """
+        多檔 Parquet 一次多執行緒掃描；date 取自 hive 分區目錄名，欄位投影與代號過濾在讀檔時完成。
+        各期欄位不同時以所有檔案的聯集 schema 讀取 (預設只看第一個檔)，缺欄補 NaN。
+        """
+        files = [str(p) for p in paths]
+        opts = dict(format="parquet", partitioning="hive", partition_base_dir=str(self._kind_dir(kind)))
+        first = ds.dataset(files, **opts)
+        schema = pa.unify_schemas([first.schema, *(f.physical_schema for f in first.get_fragments())],
+                                  promote_options="permissive")
+        dataset = ds.dataset(files, schema=schema, **opts)
+        flt = pc.field("code").isin(want) if want is not None else None
+        read = ["date", *[c for c in cols if c in schema.names]] if cols else None
+        out = dataset.to_table(columns=read, filter=flt).to_pandas()
+        if cols:
+            out = out.reindex(columns=["date", *cols])
+        out["date"] = pd.to_datetime(out["date"])
+        return out.sort_values("date", kind="stable").reset_index(drop=True)
+
+    def series(self, code: str, field: str, start=None, end=None, kind: str = "upload") -> pd.Series:
+        """單一 CB 某欄位的歷史走勢 (index=快照日期)，例如轉換價、已轉換比例、CB 收盤"""
+        h = self.history(start, end, kind, codes=[code], columns=[field])
+        if h.empty or field not in h.columns:
+            return pd.Series(dtype=float, name=field)
+        return h.set_index('date')[field].rename(field)
+
+
+_archive: CBArchive | None = None
+_archive_lock = threading.Lock()
+
+
+def get_cb_archive() -> CBArchive:
+    """行程內共用的 CBArchive (懶載入)"""
+    global _archive
+    with _archive_lock:
+        if _archive is None:
+            _archive = CBArchive()
+        return _archive
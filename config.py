@@ -173,6 +173,41 @@ class Config:
     # --- 6. 發債故事關鍵字 ---
     STORY_KEYWORDS = ["AI", "綠能", "軍工", "重電", "擴產", "政策", "從無到有", "新廠", "併購", "轉機"]
 
+    # --- 7. 本地日K 倉庫 (Price Store) ---
+    PRICE_STORE_TTL = 3600   # 秒；逾時才重新向 yfinance 下載
+    PRICE_STORE_OVERLAP_DAYS = 7   # 增量更新時回抓的重疊天數，用來吸收資料修正
+    PRICE_STORE_WORKERS = 8      # 批次下載的並行連線上限
+    EXCHANGE_MISS_TTL = 86400    # 秒；上市/上櫃皆查無的代號在此期間內不再重試
+
+    # --- 8. 全境獵殺 (Theater Hunter) ---
+    HUNT_CHUNK_SIZE = 100   # 每次批次下載的代號數
+    HUNT_WORKERS = 4        # 同時處理的批次數
+
+    # --- 9. 預先計算快照 (precompute.py) ---
+    SNAPSHOT_MAX_AGE = 43200   # 秒；超過即視為過期，UI 改回現場計算
+
+    # --- 10. 增量評分 (TitanStrategyEngine) ---
+    SCAN_TECH_TTL = 600        # 秒；個股 87/284 技術面在此時間內重掃直接沿用，不重抓日K
+    SCAN_QUAL_KEEP = 3000      # 質化欄位快取上限 (檔)；超過時淘汰最久未出現在掃描中的鍵
+
+    # --- 11. 參數最佳化 (optimizer.py) ---
+    OPT_SHORT_WINDOWS = tuple(range(20, 121, 5))    # 生命線候選 (現行 MA_LIFE_LINE 一律納入)
+    OPT_LONG_WINDOWS = tuple(range(150, 401, 10))   # 長期線候選 (現行 MA_LONG_TERM 一律納入)
+    OPT_BIAS_BANDS = (10, 15, 20, 25, 30)           # 格蘭碧乖離帶 ±%
+    OPT_BIAS_BAND_BASE = 20                         # 現行乖離帶 (買4 / 賣4 門檻)
+    OPT_WALK_FORWARD_SPLITS = 5
+
+    # --- 12. CB 組合回測 (CBPortfolioBacktester) ---
+    CB_BT_MAX_POSITIONS = 10      # 同時持有檔數上限 (每檔投入權益 1/N)
+    CB_BT_FEE_RATE = 0.001425     # 券商手續費 (買、賣各收一次)
+    CB_BT_TAX_RATE = 0.001        # 可轉債證交稅 (賣出)
+
+    # --- 13. 蒙地卡羅路徑 (montecarlo.py) ---
+    MC_PATHS = 20000              # 每次模擬路徑數
+    MC_BLOCK = 5                  # 區塊自助抽樣的區塊長度 (交易日)
+    MC_LOOKBACK = 756             # 估計報酬分配的回看天數 (約 3 年)
+    MC_SEED = 87                  # 固定種子：Streamlit 重跑時結果不跳動
+
 
 # ==========================================
 # [WAR_THEATERS] V100.0 - 2035 百倍股無限軍火庫
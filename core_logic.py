@@ -1,47 +1,36 @@
 # core_logic.py
 # Titan SOP V100.0 — Core Logic Engine
 # 包含：7D 幾何引擎、22 階泰坦信評系統、輔助計算函式
-# 所有 Tab 的共用後端邏輯集中於此
+# 所有 Tab 的共用後端邏輯集中於此 (純 Python，不依賴 Streamlit；快取由呼叫端注入)
 
 import numpy as np
 import pandas as pd
-import yfinance as yf
-import streamlit as st
-from scipy.stats import linregress
 from datetime import datetime
+from typing import MutableMapping
+from price_store import load_history
+from indicators import geometry_dict, geometry_table
 
 
 # ═══════════════════════════════════════════════════════════════
 #  [SLOT-6.1] 月K 下載引擎 (支援台股雙軌)
 # ═══════════════════════════════════════════════════════════════
 
-@st.cache_data(ttl=3600, show_spinner=False)
-def download_full_history(ticker: str, start: str = "1990-01-01") -> pd.DataFrame | None:
+def download_full_history(ticker: str, start: str = "1990-01-01",
+                          daily_cache: MutableMapping[str, pd.DataFrame] | None = None) -> pd.DataFrame | None:
     """
-    下載完整歷史月K線。支援台股上市(.TW)與上櫃(.TWO)自動切換。
-    同時將日K快取到 st.session_state.daily_price_data[ticker]。
+    讀取完整歷史月K線 (經由本地 Price Store)。支援台股上市(.TW)與上櫃(.TWO)自動切換。
+    daily_cache: 可選的 {ticker: 日K} 容器 (UI 傳入 st.session_state.daily_price_data)，
+                 有提供時順便寫入日K供圖表使用。
     """
     orig = ticker
-    if ticker.isdigit() and len(ticker) >= 4:
-        ticker = f"{ticker}.TW"
     try:
-        df = yf.download(ticker, start=start, progress=False, auto_adjust=True)
-        if df.empty and orig.isdigit() and len(orig) >= 4:
-            ticker = f"{orig}.TWO"
-            df = yf.download(ticker, start=start, progress=False, auto_adjust=True)
+        df = load_history(ticker, start=start)
         if df.empty:
             return None
 
-        if isinstance(df.columns, pd.MultiIndex):
-            df.columns = df.columns.get_level_values(0)
-
-        if not isinstance(df.index, pd.DatetimeIndex):
-            df.index = pd.to_datetime(df.index)
-
         # 快取日K
-        if 'daily_price_data' not in st.session_state:
-            st.session_state.daily_price_data = {}
-        st.session_state.daily_price_data[orig] = df
+        if daily_cache is not None:
+            daily_cache[orig] = df
 
         # 轉為月K
         try:
@@ -57,35 +46,17 @@ def download_full_history(ticker: str, start: str = "1990-01-01") -> pd.DataFram
 #  [SLOT-6.2] 幾何計算引擎
 # ═══════════════════════════════════════════════════════════════
 
-def _calc_geometry(df: pd.DataFrame, months: int) -> dict:
-    """計算指定月數窗口的對數線性回歸幾何指標"""
-    if df is None or df.empty:
-        return {'angle': 0.0, 'r2': 0.0, 'slope': 0.0}
-    sl = df.iloc[-months:] if len(df) >= months else df
-    if len(sl) < 3:
-        return {'angle': 0.0, 'r2': 0.0, 'slope': 0.0}
-    log_p = np.log(sl['Close'].values)
-    x = np.arange(len(log_p))
-    slope, _, rv, _, _ = linregress(x, log_p)
-    angle = float(np.clip(np.arctan(slope * 100) * (180 / np.pi), -90, 90))
-    return {'angle': round(angle, 2), 'r2': round(rv**2, 4), 'slope': round(slope, 6)}
-
-
-def compute_7d_geometry(ticker: str) -> dict | None:
+def compute_7d_geometry(ticker: str,
+                        daily_cache: MutableMapping[str, pd.DataFrame] | None = None) -> dict | None:
     """
     V90.2 核心：計算 7 維度完整幾何掃描
     Returns dict with keys: 35Y / 10Y / 5Y / 3Y / 1Y / 6M / 3M / acceleration / phoenix_signal
+    多標的排名請直接以月K面板呼叫 indicators.geometry_table (一次向量化完成)。
     """
-    df = download_full_history(ticker)
+    df = download_full_history(ticker, daily_cache=daily_cache)
     if df is None:
         return None
-
-    periods = {'35Y': 420, '10Y': 120, '5Y': 60, '3Y': 36, '1Y': 12, '6M': 6, '3M': 3}
-    results = {label: _calc_geometry(df, months) for label, months in periods.items()}
-
-    results['acceleration']   = round(results['3M']['angle'] - results['1Y']['angle'], 2)
-    results['phoenix_signal'] = (results['10Y']['angle'] < 0) and (results['6M']['angle'] > 25)
-    return results
+    return geometry_dict(geometry_table(df[['Close']]).iloc[0])
 
 
 # ═══════════════════════════════════════════════════════════════
@@ -1,26 +1,29 @@
 # data_engine.py
 # Titan SOP V100.0 — Data Engine
-# 包含：CB 清單解析、欄位標準化、yfinance 快取下載
+# 包含：CB 清單解析、欄位標準化、yfinance 快取下載 (日K 統一經由 price_store)
+# 純 Python 引擎層：不依賴 Streamlit，錯誤以回傳值交給呼叫端 (UI 自行 st.error)，
+# 可直接在排程或 ProcessPoolExecutor 的 worker 中執行。
 
-import re
-import streamlit as st
 import pandas as pd
 import numpy as np
 import yfinance as yf
 from datetime import datetime, timedelta
+from price_store import load_history, get_exchange_map
+from indicators import ma_snapshot
 
 
 # ═══════════════════════════════════════════════════════════════
 #  CB 清單上傳 & 解析
 # ═══════════════════════════════════════════════════════════════
 
-def load_cb_data_from_upload(uploaded_file) -> pd.DataFrame | None:
+def load_cb_data_from_upload(uploaded_file) -> tuple[pd.DataFrame | None, str | None]:
     """
-    解析上傳的 CB 清單 (Excel / CSV)。
+    解析上傳的 CB 清單 (Excel / CSV)，接受 Streamlit UploadedFile 或一般檔案物件。
     輸出標準化欄位：
       code, name, stock_code, close, underlying_price,
       conversion_price, converted_ratio, avg_volume,
       list_date, put_date, outstanding_balance, issue_amount
+    Returns: (df, None) 成功；(None, 錯誤訊息) 失敗
     """
     try:
         if uploaded_file.name.endswith('.xlsx') or uploaded_file.name.endswith('.xls'):
@@ -59,6 +62,7 @@ def load_cb_data_from_upload(uploaded_file) -> pd.DataFrame | None:
             elif any(k in col for k in ["發行餘額","流通餘額"]):            rename_map[col] = 'outstanding_balance'
             elif "發行總額" in col:                       rename_map[col] = 'issue_amount'
             elif any(k in cl for k in ["均量","成交量","avg_vol"]):         rename_map[col] = 'avg_volume'
+            elif any(k in col for k in ["市場別","上市櫃"]):                rename_map[col] = 'market'
 
         df.rename(columns=rename_map, inplace=True)
         df = df.loc[:, ~df.columns.duplicated()]
@@ -67,14 +71,20 @@ def load_cb_data_from_upload(uploaded_file) -> pd.DataFrame | None:
         required = ['code', 'name', 'stock_code', 'close']
         missing  = [c for c in required if c not in df.columns]
         if missing:
-            st.error(f"❌ 缺少必要欄位！請確認包含：{', '.join(missing)}")
-            return None
+            return None, f"❌ 缺少必要欄位！請確認包含：{', '.join(missing)}"
 
         # ── 欄位清洗 ─────────────────────────────────────────
         df['code']       = df['code'].astype(str).str.extract(r'(\d+)')
         df['stock_code'] = df['stock_code'].astype(str).str.extract(r'(\d+)')
         df.dropna(subset=['code', 'stock_code'], inplace=True)
 
+        # ── 市場別 → 上市/上櫃對照表 (之後下載標的日K只需打一個後綴) ──
+        if 'market' in df.columns:
+            mkt = df['market'].astype(str)
+            sfx = np.where(mkt.str.contains('櫃'), '.TWO',
+                           np.where(mkt.str.contains('市'), '.TW', ''))
+            get_exchange_map().seed(dict(zip(df['stock_code'], sfx)))
+
         # ── 補齊缺失欄位 ──────────────────────────────────────
         if 'conversion_price' not in df.columns:
             df['conversion_price'] = 0.0
@@ -105,45 +115,55 @@ def load_cb_data_from_upload(uploaded_file) -> pd.DataFrame | None:
         df['conversion_price']= pd.to_numeric(df['conversion_price'], errors='coerce').fillna(0)
         df['converted_ratio'] = pd.to_numeric(df['converted_ratio'], errors='coerce').fillna(0)
 
-        return df.reset_index(drop=True)
+        return df.reset_index(drop=True), None
 
     except Exception as e:
-        st.error(f"檔案讀取失敗: {e}")
-        return None
+        return None, f"檔案讀取失敗: {e}"
+
+
+def normalize_census_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    普查前的欄位標準化 (Tab 2 與排程 precompute.py 共用，確保兩邊輸入一致)：
+      中文欄名 → code / name / price / conv_price / stock_code / conv_rate ...
+      餘額比例 → 已轉換率、數值與日期欄位型別安全
+    """
+    work_df = df.copy()
+    rename_map = {
+        '代號': 'code', '名稱': 'name', '可轉債市價': 'price',
+        '轉換價格': 'conv_price', '轉換標的': 'stock_code',
+        '已轉換比例': 'conv_rate', '轉換價值': 'conv_value',
+        '發行日': 'issue_date', '賣回日': 'put_date',
+        '餘額比例': 'balance_ratio'
+    }
+    work_df.rename(columns=lambda c: rename_map.get(c.strip(), c.strip()), inplace=True)
+
+    # 餘額比例 → 已轉換率
+    if 'balance_ratio' in work_df.columns:
+        bal = pd.to_numeric(work_df['balance_ratio'], errors='coerce').fillna(100.0)
+        work_df['conv_rate'] = 100.0 - bal
+
+    # 型別安全
+    for col in ['price', 'conv_rate', 'conv_price', 'conv_value']:
+        work_df[col] = pd.to_numeric(work_df.get(col, pd.Series(dtype=float)), errors='coerce').fillna(0.0)
+
+    # 日期欄位
+    for dcol in ['issue_date', 'put_date', 'list_date']:
+        if dcol in work_df.columns:
+            work_df[dcol] = pd.to_datetime(work_df[dcol], errors='coerce')
+    if 'issue_date' not in work_df.columns and 'list_date' in work_df.columns:
+        work_df['issue_date'] = work_df['list_date']
+    return work_df
 
 
 # ═══════════════════════════════════════════════════════════════
-#  yfinance 快取工具函式
+#  yfinance 工具函式 (快取由 Price Store 負責)
 # ═══════════════════════════════════════════════════════════════
 
-@st.cache_data(ttl=300, show_spinner=False)
 def get_stock_daily(ticker: str, period: str = "1y") -> pd.DataFrame:
-    """下載日K線，支援台股雙軌，回傳標準 OHLCV DataFrame"""
-    orig = ticker
-    cands = []
-    if re.match(r'^[0-9]', ticker) and 4 <= len(ticker) <= 6:
-        cands = [f"{ticker}.TW", f"{ticker}.TWO"]
-    elif re.match(r'^[0-9]', ticker) and len(ticker) == 5:
-        # 可能是可轉債代號 → 取前4碼轉股票
-        base = ticker[:4]
-        cands = [f"{base}.TW", f"{base}.TWO"]
-    else:
-        cands = [ticker.upper()]
-
-    for c in cands:
-        try:
-            df = yf.download(c, period=period, progress=False, auto_adjust=True)
-            if not df.empty:
-                if isinstance(df.columns, pd.MultiIndex):
-                    df.columns = df.columns.get_level_values(0)
-                df.index = pd.to_datetime(df.index)
-                return df
-        except Exception:
-            continue
-    return pd.DataFrame()
-
-
-@st.cache_data(ttl=300, show_spinner=False)
+    """讀取日K線 (經由本地 Price Store)，支援台股雙軌，回傳標準 OHLCV DataFrame"""
+    return load_history(ticker, period=period)
+
+
 def get_latest_price(ticker: str) -> float:
     """取得最新收盤價，失敗回傳 0.0"""
     try:
@@ -153,7 +173,6 @@ def get_latest_price(ticker: str) -> float:
         return 0.0
 
 
-@st.cache_data(ttl=300, show_spinner=False)
 def enrich_cb_row(row: dict) -> dict:
     """
     用 yfinance 補充單一 CB 行的即時數據：
@@ -169,11 +188,10 @@ def enrich_cb_row(row: dict) -> dict:
         df = get_stock_daily(stock_code, period="2y")
         if df.empty: return row
 
-        df['MA87']  = df['Close'].rolling(87).mean()
-        df['MA284'] = df['Close'].rolling(284).mean()
-        cp   = float(df['Close'].iloc[-1])
-        m87  = float(df['MA87'].iloc[-1])  if not pd.isna(df['MA87'].iloc[-1])  else 0
-        m284 = float(df['MA284'].iloc[-1]) if not pd.isna(df['MA284'].iloc[-1]) else 0
+        snap = ma_snapshot(df[['Close']]).iloc[0]
+        cp   = float(snap['price'])
+        m87  = float(snap['ma87'])  if not pd.isna(snap['ma87'])  else 0
+        m284 = float(snap['ma284']) if not pd.isna(snap['ma284']) else 0
 
         row['stock_price']   = cp
         row['ma87']          = m87
@@ -193,13 +211,12 @@ def enrich_cb_row(row: dict) -> dict:
 
 
 # ═══════════════════════════════════════════════════════════════
-#  宏觀市場快取
+#  宏觀市場快照
 # ═══════════════════════════════════════════════════════════════
 
-@st.cache_data(ttl=600, show_spinner=False)
 def get_macro_snapshot() -> dict:
     """
-    快取：^TWII (台灣加權)、^GSPC (S&P500)、GC=F (黃金)
+    即時報價 (UI 端需要快取時自行包 st.cache_data)：^TWII (台灣加權)、^GSPC (S&P500)、GC=F (黃金)
     回傳 {symbol: {price, change_pct}} dict
     """
     syms   = ['^TWII', '^GSPC', '^TNX', 'GC=F', 'CL=F', 'USDTWD=X']
@@ -6,11 +6,46 @@
 # 2. [沈睡甦醒] 新增上市滿一年的「第二波攻擊日」計算。
 # 3. [行事曆事件] 自動計算當年度的融券回補與除權息旺季。
 
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 from config import Config
 from typing import List, Dict
 
+EVENT_COLUMNS = ["row", "code", "date", "type", "event", "desc"]
+
+# 每檔 CB 的時間套利事件：(type, event, desc, 基準日 list/put, 位移天數)
+BOND_EVENT_SPECS = [
+    ("IPO", "🔔 蜜月期滿 (Listing+90)",
+     "上市滿3個月(敲鑼打鼓期)，留意解禁後的賣壓或主力拉抬方向。",
+     "list", Config.LISTING_HONEYMOON_DAYS),
+    ("Awakening", "⏰ 沈睡甦醒 (Listing+365)",
+     "鄭思翰法則：新債若首季未動，滿一週年常有「甦醒行情」。",
+     "list", Config.LISTING_DORMANT_DAYS),
+    ("PutBack", "🚀 避稅行情啟動 (Put-180)",
+     "進入賣回日前半年。若股價低於轉換價，公司派易拉抬以避免債券持有人執行賣回。",
+     "put", -Config.PUT_AVOID_TAX_DAYS),
+    ("Risk", "⚠️ 賣回基準日 (Put Date)",
+     "投資人可選擇以保本價賣回給公司的日子。此日前股價若未拉過轉換價，需提防違約風險。",
+     "put", 0),
+]
+
+
+def _parse_dates(values, n: int) -> pd.Series:
+    """整欄日期字串 → datetime64 (正規化到日)；無法解析者為 NaT。None 代表整欄缺漏。"""
+    if values is None:
+        return pd.Series(pd.NaT, index=range(n), dtype='datetime64[ns]')
+    raw = pd.Series(list(values), dtype=object)
+    parsed = pd.to_datetime(raw, errors='coerce')
+    # 同欄混用不同格式時，第一次依首筆推斷格式會把其他格式判成 NaT，這些再逐筆補解析一次
+    retry = parsed.isna() & raw.notna() & (raw.astype(str).str.strip() != '')
+    if retry.any():
+        parsed[retry] = pd.to_datetime(raw[retry], errors='coerce', format='mixed')
+    if getattr(parsed.dt, 'tz', None) is not None:
+        parsed = parsed.dt.tz_localize(None)
+    return parsed.dt.normalize().astype('datetime64[ns]')
+
+
 class CalendarAgent:
     
     def _get_current_year_events(self) -> List[Dict]:
@@ -36,55 +71,75 @@ class CalendarAgent:
         
         return events
 
+    def build_event_table(self, codes, listing_dates, put_dates, include_calendar: bool = True) -> pd.DataFrame:
+        """
+        [Columnar] 整份 CB 清單的時間套利事件一次算完，回傳整齊的事件表：
+          row   - 對應輸入的第幾列 (0-based)
+          code  - CB 代號
+          date  - datetime64 (已正規化到日)
+          type  - IPO / Awakening / PutBack / Risk / Calendar
+          event / desc - 顯示文字
+        上市日或賣回日無法解析的列不產生任何事件。依 (row, date) 排序。
+        """
+        codes = pd.Series(list(codes), dtype=object).astype(str)
+        n = len(codes)
+        l_date = _parse_dates(listing_dates, n)
+        p_date = _parse_dates(put_dates, n)
+        valid = (l_date.notna() & p_date.notna()).to_numpy()
+        rows = np.flatnonzero(valid)
+
+        parts = []
+        bases = {"list": l_date.to_numpy()[valid], "put": p_date.to_numpy()[valid]}
+        specs = list(BOND_EVENT_SPECS)
+        if include_calendar:
+            specs += [(t, e, d, None, dt) for t, e, d, dt in self._calendar_specs()]
+        for order, (etype, event, desc, base, offset) in enumerate(specs):
+            if base is None:
+                dates = np.full(len(rows), np.datetime64(offset, 'ns'))
+            else:
+                dates = bases[base] + np.timedelta64(offset, 'D')
+            parts.append(pd.DataFrame({
+                "row": rows, "code": codes.to_numpy()[rows], "date": dates,
+                "type": etype, "event": event, "desc": desc, "_order": order,
+            }))
+
+        table = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=EVENT_COLUMNS + ["_order"])
+        table = table.sort_values(["row", "date", "_order"], kind="stable").drop(columns="_order")
+        return table.reset_index(drop=True)[EVENT_COLUMNS]
+
+    def _calendar_specs(self) -> List[tuple]:
+        """當年度固定行事曆事件 (type, event, desc, 日期)"""
+        return [(e["type"], e["event"], e["desc"], e["date"]) for e in self._get_current_year_events()]
+
+    @staticmethod
+    def events_between(table: pd.DataFrame, start, end) -> pd.DataFrame:
+        """事件表中 start <= date <= end 的事件 (含兩端)"""
+        start, end = pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize()
+        return table[(table["date"] >= start) & (table["date"] <= end)]
+
+    @staticmethod
+    def rows_with_upcoming(table: pd.DataFrame, n_rows: int, event_type: str, today=None) -> np.ndarray:
+        """長度 n_rows 的布林陣列：該列是否有今天 (含) 之後的 event_type 事件"""
+        today = pd.Timestamp(today or datetime.now()).normalize()
+        hit = table.loc[(table["type"] == event_type) & (table["date"] >= today), "row"].to_numpy()
+        out = np.zeros(n_rows, dtype=bool)
+        out[hit] = True
+        return out
+
+    @staticmethod
+    def events_by_row(table: pd.DataFrame, n_rows: int) -> List[List[Dict]]:
+        """事件表 → 每列一個 list[dict] (date 為 'YYYY-MM-DD' 字串，相容 calculate_time_traps 格式)"""
+        out: List[List[Dict]] = [[] for _ in range(n_rows)]
+        if table.empty:
+            return out
+        records = table.assign(date=table["date"].dt.strftime('%Y-%m-%d'))[["row", "date", "event", "desc", "type"]]
+        for r, d, e, desc, t in records.itertuples(index=False, name=None):
+            out[r].append({"date": d, "event": e, "desc": desc, "type": t})
+        return out
+
     def calculate_time_traps(self, stock_code: str, listing_date_str: str, put_date_str: str) -> List[Dict]:
         """
         計算該檔 CB 的所有時間套利陷阱
         """
-        events = []
-        fmt = '%Y-%m-%d'
-        
-        try:
-            l_date = pd.to_datetime(listing_date_str, errors='coerce')
-            p_date = pd.to_datetime(put_date_str, errors='coerce')
-            if pd.isna(l_date) or pd.isna(p_date):
-                return []
-        except:
-            return [] 
-            
-        honeymoon_end = l_date + timedelta(days=Config.LISTING_HONEYMOON_DAYS)
-        events.append({
-            "date": honeymoon_end.strftime(fmt),
-            "event": "🔔 蜜月期滿 (Listing+90)",
-            "desc": "上市滿3個月(敲鑼打鼓期)，留意解禁後的賣壓或主力拉抬方向。",
-            "type": "IPO"
-        })
-        
-        awakening_date = l_date + timedelta(days=Config.LISTING_DORMANT_DAYS)
-        events.append({
-            "date": awakening_date.strftime(fmt),
-            "event": "⏰ 沈睡甦醒 (Listing+365)",
-            "desc": "鄭思翰法則：新債若首季未動，滿一週年常有「甦醒行情」。",
-            "type": "Awakening"
-        })
-        
-        tax_rally_start = p_date - timedelta(days=Config.PUT_AVOID_TAX_DAYS)
-        events.append({
-            "date": tax_rally_start.strftime(fmt),
-            "event": "🚀 避稅行情啟動 (Put-180)",
-            "desc": "進入賣回日前半年。若股價低於轉換價，公司派易拉抬以避免債券持有人執行賣回。",
-            "type": "PutBack"
-        })
-        
-        events.append({
-            "date": p_date.strftime(fmt),
-            "event": "⚠️ 賣回基準日 (Put Date)",
-            "desc": "投資人可選擇以保本價賣回給公司的日子。此日前股價若未拉過轉換價，需提防違約風險。",
-            "type": "Risk"
-        })
-        
-        calendar_evts = self._get_current_year_events()
-        events.extend(calendar_evts)
-        
-        events.sort(key=lambda x: x['date'])
-        
-        return events
\ No newline at end of file
+        table = self.build_event_table([stock_code], [listing_date_str], [put_date_str])
+        return self.events_by_row(table, 1)[0]
\ No newline at end of file
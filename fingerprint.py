@@ -0,0 +1,52 @@
+# fingerprint.py
+# Titan SOP V100.0 — Content Fingerprint (內容指紋)
+# 包含：DataFrame 逐欄緩衝區雜湊、多參數組合指紋
+# 供 st.cache_data 快取鍵、snapshot_store 來源比對共用：
+# 內容一改指紋就變，且不必為了當快取鍵把整張表 to_json 再 read_json 回來。
+
+import hashlib
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+
+def _column_digest(s: pd.Series) -> bytes:
+    """單欄內容雜湊 (pandas 固定金鑰的向量化雜湊，跨行程穩定)"""
+    try:
+        return pd.util.hash_pandas_object(s, index=False).to_numpy().tobytes()
+    except TypeError:
+        # dict / list 等不可雜湊的儲存格：只有這一欄退回 repr 文字
+        return pd.util.hash_pandas_object(s.map(repr), index=False).to_numpy().tobytes()
+
+
+def frame_fingerprint(df: pd.DataFrame | pd.Series | None) -> str:
+    """
+    DataFrame 內容指紋 (SHA-1)：欄名 + dtype + index + 逐欄資料緩衝區。
+    空表 / None 回傳 'empty'。同內容不同物件得到相同指紋。
+    """
+    if df is None or df.empty:
+        return "empty"
+    if isinstance(df, pd.Series):
+        df = df.to_frame()
+    h = hashlib.sha1(f"{df.shape}|".encode('utf-8'))
+    h.update("|".join(f"{c}:{t}" for c, t in zip(map(str, df.columns), map(str, df.dtypes))).encode('utf-8'))
+    h.update(_column_digest(df.index.to_series()))
+    for i in range(df.shape[1]):
+        h.update(_column_digest(df.iloc[:, i]))
+    return h.hexdigest()
+
+
+def fingerprint(*parts: Any) -> str:
+    """多個參數 (DataFrame / Series / ndarray / 一般值) 組合成一個快取鍵"""
+    h = hashlib.sha1()
+    for p in parts:
+        if isinstance(p, (pd.DataFrame, pd.Series)):
+            h.update(frame_fingerprint(p).encode('utf-8'))
+        elif isinstance(p, np.ndarray):
+            h.update(f"{p.dtype}{p.shape}".encode('utf-8'))
+            h.update(np.ascontiguousarray(p).tobytes())
+        else:
+            h.update(repr(p).encode('utf-8'))
+        h.update(b"\x1f")
+    return h.hexdigest()
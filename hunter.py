@@ -0,0 +1,93 @@
+# hunter.py
+# Titan SOP V100.0 — Theater Hunter (全境獵殺引擎)
+# 包含：WAR_THEATERS 分塊批次下載 (執行緒池)、月K 7D 幾何批次計算、
+#       Phoenix / Awakening / Rocket 型態判定、逐塊串流回報與中途取消
+# 不依賴 Streamlit，UI 與排程 (CLI) 共用。
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterator, List
+
+import pandas as pd
+
+from config import Config
+from indicators import build_price_panel, geometry_table
+from price_store import FULL_HISTORY_START, load_history_many
+
+HUNT_COLUMNS = ["代號", "現價", "35Y角度", "10Y角度", "3M角度", "G力", "型態"]
+
+
+class TheaterHunter:
+    """
+    戰區掃描器。代號清單切成 chunk_size 一塊，每塊一次批次下載全歷史日K，
+    由 workers 條執行緒同時處理；每完成一塊就回報該塊的命中標的。
+    """
+
+    def __init__(self, chunk_size: int = Config.HUNT_CHUNK_SIZE, workers: int = Config.HUNT_WORKERS):
+        self.chunk_size = max(1, chunk_size)
+        self.workers = max(1, workers)
+
+    # ── 型態判定 ─────────────────────────────────────────────
+    @staticmethod
+    def classify(geo: pd.Series) -> str | None:
+        """7D 幾何一列 (geometry_table 格式) → 型態標籤；不符合回傳 None"""
+        if geo['10Y_angle'] < 10 and geo['3M_angle'] > 45:          return "🔥 Phoenix"
+        if abs(geo['35Y_angle']) < 15 and geo['acceleration'] > 20:  return "🦁 Awakening"
+        if geo['3M_angle'] > 60:                                     return "🚀 Rocket"
+        return None
+
+    # ── 單塊處理 ─────────────────────────────────────────────
+    def _scan_chunk(self, tickers: List[str], cancel: threading.Event | None) -> pd.DataFrame:
+        if cancel is not None and cancel.is_set():
+            return pd.DataFrame(columns=HUNT_COLUMNS)
+        frames = load_history_many(tickers, start=FULL_HISTORY_START)
+        monthly: Dict[str, pd.DataFrame] = {}
+        for t, df in frames.items():
+            monthly[t] = df[['Close']].resample('ME').last().dropna()
+        geo = geometry_table(build_price_panel(monthly))
+
+        rows = []
+        for t, g in geo.iterrows():
+            mt = self.classify(g)
+            if mt:
+                rows.append({
+                    "代號": t, "現價": float(frames[t]['Close'].iloc[-1]),
+                    "35Y角度": g['35Y_angle'], "10Y角度": g['10Y_angle'], "3M角度": g['3M_angle'],
+                    "G力": g['acceleration'], "型態": mt
+                })
+        return pd.DataFrame(rows, columns=HUNT_COLUMNS)
+
+    # ── 公開 API ─────────────────────────────────────────────
+    def iter_hunt(self, tickers: List[str],
+                  cancel: threading.Event | None = None) -> Iterator[tuple[int, int, pd.DataFrame]]:
+        """
+        串流掃描：每完成一塊 yield (已完成檔數, 總檔數, 該塊命中)。
+        cancel 被設定後不再啟動新塊，已在下載中的塊完成後即停止 (供另一執行緒控制的呼叫端)。
+        呼叫端中途放棄迭代 (如 Streamlit rerun 中斷腳本) 時，finally 也會取消尚未開始的塊。
+        """
+        tickers = list(dict.fromkeys(tickers))
+        total = len(tickers)
+        chunks = [tickers[i:i + self.chunk_size] for i in range(0, total, self.chunk_size)]
+        done = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self._scan_chunk, c, cancel): len(c) for c in chunks}
+            try:
+                for fut in as_completed(futures):
+                    if cancel is not None and cancel.is_set():
+                        break
+                    done += futures[fut]
+                    try:
+                        hits = fut.result()
+                    except Exception:
+                        hits = pd.DataFrame(columns=HUNT_COLUMNS)
+                    yield done, total, hits
+            finally:
+                for fut in futures:
+                    fut.cancel()
+
+    def hunt(self, tickers: List[str], cancel: threading.Event | None = None) -> pd.DataFrame:
+        """阻塞式掃描，回傳全部命中標的"""
+        parts = [hits for _, _, hits in self.iter_hunt(tickers, cancel) if not hits.empty]
+        if not parts:
+            return pd.DataFrame(columns=HUNT_COLUMNS)
+        return pd.concat(parts, ignore_index=True)
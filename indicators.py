@@ -0,0 +1,265 @@
+# indicators.py
+# Titan SOP V100.0 — Indicator Engine (多標的均線向量化引擎)
+# 包含：價格面板 (日期 × 標的) 組裝、2-D 滾動均線、87/284 生命線快照
+#       (乖離、突破、創高、多空持續天數、扣抵值)、未來扣抵排程 / 均線守價、7D 幾何批次回歸
+# 一次 NumPy 運算涵蓋整個面板，取代逐檔 rolling().mean() 管線。
+# 各標的交易日不同 (台/美股混合) 時，面板中的 NaN 會先依欄位壓縮，
+# 均線一律以「該標的自己的 K 棒」計算，結果與逐檔 rolling 相同。
+
+from typing import Dict, Iterable
+
+import numpy as np
+import pandas as pd
+
+from config import Config
+
+
+# ═══════════════════════════════════════════════════════════════
+#  面板組裝 & 基礎運算
+# ═══════════════════════════════════════════════════════════════
+
+def build_price_panel(frames: Dict[str, pd.DataFrame], field: str = 'Close') -> pd.DataFrame:
+    """{ticker: OHLCV} → 對齊日期的價格面板 (index=日期, columns=ticker)"""
+    cols = {t: df[field] for t, df in frames.items()
+            if df is not None and not df.empty and field in df.columns}
+    if not cols:
+        return pd.DataFrame()
+    return pd.DataFrame(cols).sort_index()
+
+
+def _compact(values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """把每欄的有效值穩定地推到底部 (NaN 在上)，回傳 (壓縮陣列, 原列索引)"""
+    order = np.argsort(~np.isnan(values), axis=0, kind='stable')
+    return np.take_along_axis(values, order, axis=0), order
+
+
+def rolling_mean_2d(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    沿 axis=0 的滾動平均 (前綴和差分)。視窗內含 NaN 或不足 window 筆時回傳 NaN，
+    與 pandas rolling(window).mean() 預設行為一致。
+    """
+    v = np.asarray(values, dtype=float)
+    if v.ndim == 1:
+        return rolling_mean_2d(v[:, None], window)[:, 0]
+    out = np.full(v.shape, np.nan)
+    if window <= 0 or len(v) < window:
+        return out
+    ok = ~np.isnan(v)
+    zero = np.zeros((1, v.shape[1]))
+    cs = np.vstack([zero, np.cumsum(np.where(ok, v, 0.0), axis=0)])
+    cn = np.vstack([zero, np.cumsum(ok, axis=0)])
+    s = cs[window:] - cs[:-window]
+    n = cn[window:] - cn[:-window]
+    out[window - 1:] = np.where(n == window, s / window, np.nan)
+    return out
+
+
+def ma_panel(panel: pd.DataFrame,
+             windows: Iterable[int] = (Config.MA_LIFE_LINE, Config.MA_LONG_TERM)) -> Dict[int, pd.DataFrame]:
+    """整個面板的均線序列 {window: DataFrame}，形狀與 panel 相同"""
+    if panel.empty:
+        return {w: panel.copy() for w in windows}
+    raw = panel.to_numpy(dtype=float)
+    packed, order = _compact(raw)
+    out = {}
+    for w in windows:
+        res = np.full(raw.shape, np.nan)
+        np.put_along_axis(res, order, rolling_mean_2d(packed, w), axis=0)
+        out[w] = pd.DataFrame(res, index=panel.index, columns=panel.columns)
+    return out
+
+
+def attach_ma(df: pd.DataFrame,
+              windows: Iterable[int] = (Config.MA_LIFE_LINE, Config.MA_LONG_TERM),
+              field: str = 'Close') -> pd.DataFrame:
+    """單檔 OHLCV 就地加上 MA{w} 欄位 (繪圖/回測用)，回傳同一個 DataFrame"""
+    mas = ma_panel(df[[field]], windows)
+    for w, m in mas.items():
+        df[f'MA{w}'] = m[field].to_numpy()
+    return df
+
+
+# ═══════════════════════════════════════════════════════════════
+#  87/284 生命線快照
+# ═══════════════════════════════════════════════════════════════
+
+def ma_snapshot(close: pd.DataFrame, high: pd.DataFrame | None = None,
+                breakout_lookback: int = 5, high_lookback: int = 3) -> pd.DataFrame:
+    """
+    整個收盤價面板最後一根 K 棒的生命線狀態，一列一檔 (index=ticker)：
+      price / ma87 / ma284      - 現價與均線
+      bias87 / bias284          - 乖離率 (%)
+      is_bullish / trend_days   - 87MA > 284MA 與該狀態已持續的天數
+      is_recent_breakout        - 今收站上 87MA 且 N 日前仍在其下
+      is_making_high            - 今收 ≥ 近 3 日最高價 (需提供 high 面板)
+      deduct87 / deduct284      - 下一交易日將被扣抵的收盤價
+      n_obs                     - 有效 K 棒數
+    資料不足的欄位為 NaN。
+    """
+    short, long_ = Config.MA_LIFE_LINE, Config.MA_LONG_TERM
+    cols = ['price', 'ma87', 'ma284', 'bias87', 'bias284', 'is_bullish', 'trend_days',
+            'is_recent_breakout', 'is_making_high', 'deduct87', 'deduct284', 'n_obs']
+    if close.empty:
+        return pd.DataFrame(columns=cols)
+
+    c, _ = _compact(close.to_numpy(dtype=float))
+    n_obs = (~np.isnan(c)).sum(axis=0)
+    m_s = rolling_mean_2d(c, short)
+    m_l = rolling_mean_2d(c, long_)
+    price, ma_s, ma_l = c[-1], m_s[-1], m_l[-1]
+
+    def _back(k: int) -> np.ndarray:
+        return c[-k] if len(c) >= k else np.full(c.shape[1], np.nan)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        bias_s = (price - ma_s) / ma_s * 100
+        bias_l = (price - ma_l) / ma_l * 100
+
+        # 多空持續天數：由最後一根往回數，87/284 相對位置不變且均線皆有效的連續天數
+        both = ~np.isnan(m_s) & ~np.isnan(m_l)
+        bull = (m_s > m_l) & both
+        same = (bull == bull[-1]) & both
+        trend_days = np.cumprod(same[::-1], axis=0).sum(axis=0)
+
+        breakout = (price > ma_s) & (_back(breakout_lookback) < ma_s)
+
+        if high is not None and not high.empty:
+            h, _ = _compact(high.reindex(columns=close.columns).to_numpy(dtype=float))
+            making_high = price >= np.fmax.reduce(h[-high_lookback:], axis=0)
+        else:
+            making_high = np.zeros(c.shape[1], dtype=bool)
+
+    return pd.DataFrame({
+        'price': price, 'ma87': ma_s, 'ma284': ma_l,
+        'bias87': bias_s, 'bias284': bias_l,
+        'is_bullish': bull[-1], 'trend_days': trend_days.astype(int),
+        'is_recent_breakout': breakout, 'is_making_high': making_high,
+        'deduct87': np.where(n_obs >= short, _back(short), np.nan),
+        'deduct284': np.where(n_obs >= long_, _back(long_), np.nan),
+        'n_obs': n_obs,
+    }, index=close.columns)[cols]
+
+
+# ═══════════════════════════════════════════════════════════════
+#  扣抵值預測 (未來 N 日扣抵排程 & 均線守價)
+# ═══════════════════════════════════════════════════════════════
+
+def deduction_forecast(close, horizon: int = 60, window: int = Config.MA_LIFE_LINE) -> Dict[str, np.ndarray]:
+    """
+    未來第 1..horizon 個交易日的 window 日均線扣抵預測。close 可為單檔序列 (n,)
+    或收盤價面板 (T, N)；面板各欄以自己的 K 棒計算，輸出形狀 (horizon,) / (horizon, N)：
+      deduct    - 當日將被扣抵的收盤價；收盤高於它，均線當日就上彎
+      hold_price- 第 1..h 日扣抵值的平均；此後收盤都守在它之上，第 h 日均線不低於今日
+      ma_flat   - 收盤價持平於現價時第 h 日的均線
+    扣抵日超出現有歷史 (h > window) 時取決於未來路徑，與有效 K 棒不足 window 者一律為 NaN。
+    全部由一次前綴和取得，不逐日 shift / rolling。
+    """
+    raw = np.asarray(close, dtype=float)
+    if raw.ndim == 1:
+        out = deduction_forecast(raw[:, None], horizon, window)
+        return {k: v[:, 0] for k, v in out.items()}
+    c, _ = _compact(raw)
+    n_obs = (~np.isnan(c)).sum(axis=0)
+    h = np.arange(1, horizon + 1)
+    deduct = np.full((horizon, c.shape[1]), np.nan)
+    known = h <= min(window, len(c))
+    deduct[known] = c[len(c) - window + h[known] - 1]
+    deduct[:, n_obs < window] = np.nan
+
+    price = c[-1]
+    ma_now = c[-window:].mean(axis=0) if len(c) >= window else np.full(c.shape[1], np.nan)
+    run = np.cumsum(deduct, axis=0)
+    return {
+        'deduct': deduct,
+        'hold_price': run / h[:, None],
+        'ma_flat': ma_now + (h[:, None] * price - run) / window,
+    }
+
+
+def deduction_frame(close: pd.Series, horizon: int = 60, window: int = Config.MA_LIFE_LINE) -> pd.DataFrame:
+    """單檔扣抵預測表 (index=未來營業日)：Deduction_Value / Hold_Price / MA_Flat"""
+    close = close.dropna()
+    if len(close) < window:
+        return pd.DataFrame()
+    f = deduction_forecast(close.to_numpy(dtype=float), horizon, window)
+    dates = pd.bdate_range(start=close.index[-1] + pd.Timedelta(days=1), periods=horizon, name='Date')
+    return pd.DataFrame({'Deduction_Value': f['deduct'], 'Hold_Price': f['hold_price'],
+                         'MA_Flat': f['ma_flat']}, index=dates)
+
+
+# ═══════════════════════════════════════════════════════════════
+#  7D 幾何 (月K 對數線性回歸，批次版)
+# ═══════════════════════════════════════════════════════════════
+
+GEOMETRY_PERIODS = {'35Y': 420, '10Y': 120, '5Y': 60, '3Y': 36, '1Y': 12, '6M': 6, '3M': 3}
+
+
+def geometry_table(monthly_close: pd.DataFrame,
+                   periods: Dict[str, int] = GEOMETRY_PERIODS) -> pd.DataFrame:
+    """
+    整個月K收盤面板的 7D 幾何，一列一檔 (index=ticker)。
+    每個窗口取最後 min(月數, 有效月數) 根做 log(Close) 對 0..n-1 的最小平方回歸，
+    以前綴和 (Σy, Σxy, Σy²) 閉式求解，結果與逐檔 linregress 相同：
+      {label}_slope / {label}_angle / {label}_r2、acceleration、phoenix_signal
+    有效月數不足 3 的窗口回傳 0。
+    """
+    cols = [f"{lb}_{k}" for lb in periods for k in ('angle', 'r2', 'slope')]
+    cols += ['acceleration', 'phoenix_signal']
+    if monthly_close.empty:
+        return pd.DataFrame(columns=cols)
+
+    raw = monthly_close.to_numpy(dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        logp = np.log(np.where(raw > 0, raw, np.nan))
+    y, _ = _compact(logp)
+    rows, n_tk = y.shape
+    n_obs = (~np.isnan(y)).sum(axis=0)
+
+    # 以最後一個月為基準置中，降低前綴和相減的浮點誤差
+    yc = np.where(np.isnan(y), 0.0, y - y[-1])
+    r = np.arange(rows, dtype=float)[:, None]
+    zero = np.zeros((1, n_tk))
+    p_y  = np.vstack([zero, np.cumsum(yc, axis=0)])
+    p_ry = np.vstack([zero, np.cumsum(r * yc, axis=0)])
+    p_yy = np.vstack([zero, np.cumsum(yc * yc, axis=0)])
+    col_idx = np.arange(n_tk)
+
+    out = {}
+    for label, months in periods.items():
+        n = np.minimum(months, n_obs).astype(float)
+        start = rows - n.astype(int)
+        sy  = p_y[rows]  - p_y[start, col_idx]
+        sry = p_ry[rows] - p_ry[start, col_idx]
+        syy = p_yy[rows] - p_yy[start, col_idx]
+        sxy = sry - start * sy                       # x = 列號 - 窗口起點
+        sx  = n * (n - 1) / 2
+        sxx = (n - 1) * n * (2 * n - 1) / 6
+
+        ok = n >= 3
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ssx = sxx - sx * sx / n
+            ssxy = sxy - sx * sy / n
+            ssy = np.maximum(syy - sy * sy / n, 0.0)
+            slope = np.where(ok, ssxy / ssx, 0.0)
+            r2 = np.where(ok & (ssy > 0), ssxy * ssxy / (ssx * ssy), 0.0)
+        angle = np.clip(np.degrees(np.arctan(slope * 100)), -90, 90)
+
+        out[f"{label}_angle"] = np.round(angle, 2)
+        out[f"{label}_r2"]    = np.round(np.clip(r2, 0.0, 1.0), 4)
+        out[f"{label}_slope"] = np.round(slope, 6)
+
+    table = pd.DataFrame(out, index=monthly_close.columns)
+    if '3M' in periods and '1Y' in periods:
+        table['acceleration'] = (table['3M_angle'] - table['1Y_angle']).round(2)
+    if '10Y' in periods and '6M' in periods:
+        table['phoenix_signal'] = (table['10Y_angle'] < 0) & (table['6M_angle'] > 25)
+    return table.reindex(columns=cols)
+
+
+def geometry_dict(row: pd.Series, periods: Dict[str, int] = GEOMETRY_PERIODS) -> dict:
+    """geometry_table 的一列 → 信評系統使用的巢狀 dict 格式"""
+    geo = {lb: {'angle': float(row[f"{lb}_angle"]), 'r2': float(row[f"{lb}_r2"]),
+                'slope': float(row[f"{lb}_slope"])} for lb in periods}
+    geo['acceleration']   = float(row['acceleration'])
+    geo['phoenix_signal'] = bool(row['phoenix_signal'])
+    return geo
@@ -6,6 +6,7 @@ import streamlit as st
 import pandas as pd
 from utils_ui import inject_css, create_glowing_title, render_sidebar_utilities
 from data_engine import load_cb_data_from_upload
+from cb_archive import ARCHIVE_ERRORS, get_cb_archive
 
 # [PHASE 1] Import with error handling
 try:
@@ -70,10 +71,16 @@ def render():
         
         if uploaded_file:
             with st.spinner("正在載入數據..."):
-                df = load_cb_data_from_upload(uploaded_file)
+                df, load_err = load_cb_data_from_upload(uploaded_file)
+                if load_err:
+                    st.error(load_err)
                 
                 if df is not None and not df.empty:
                     st.session_state.df = df
+                    try:
+                        get_cb_archive().append(df, "upload")   # 同日同內容自動略過
+                    except ARCHIVE_ERRORS as e:
+                        st.warning(f"⚠️ CB 清單存檔失敗: {e}")
                     st.success(f"✅ 載入 {len(df)} 筆 CB")
                     st.metric("總數量", len(df))
                     if 'close' in df.columns:
@@ -247,9 +254,10 @@ def render_tab6_placeholder():
     ticker_input = st.text_input("輸入掃描標的", placeholder="例如：2330", key="tab6_ticker")
     
     if ticker_input and st.button("📐 計算 7D 幾何"):
-        from core_logic import compute_7d_geometry, titan_rating_system
+        from core_logic import titan_rating_system
+        from utils_ui import cached_7d_geometry
         
-        geo_data = compute_7d_geometry(ticker_input)
+        geo_data = cached_7d_geometry(ticker_input)
         rating = titan_rating_system(geo_data)
         
         st.write(f"**評級**: {rating[0]} - {rating[1]}")
@@ -8,11 +8,12 @@
 
 import numpy as np
 import pandas as pd
-import yfinance as yf
 from config import Config
 from knowledge_base import TitanKnowledgeBase
+from price_store import get_price_store, period_to_start
+from indicators import deduction_forecast, deduction_frame, ma_panel, ma_snapshot
 from typing import Dict, List, Tuple
-from datetime import datetime, timedelta
+from datetime import datetime
 import re
 
 # 內建台股熱門股名稱與產業對照表 (Metadata Injection)
@@ -126,9 +127,31 @@ STOCK_METADATA = {
     "8358.TW": {"name": "金居", "industry": "PCB/銅箔"}, "8933.TW": {"name": "愛山林", "industry": "營建"}
 }
 
+# 宏觀訊號共用快照：各訊號所需最長窗口 (加權指數技術面 2y)
+MARKET_SNAPSHOT_PERIOD = "2y"
+# 主流股榜單 (1.5 / 1.6) 與選股明細共用的日K 期間
+LEADER_PERIOD = "2y"
+
+
 class MacroRiskEngine:
     def __init__(self):
-        self.cache_data = {}
+        self.store = get_price_store()
+
+    # ── 共用市場快照 ─────────────────────────────────────────
+    def get_market_snapshot(self) -> Dict[str, pd.DataFrame]:
+        """
+        VIX、加權指數與高價權值股池一次批次取得 (最長所需窗口)，
+        供 VIX / 加權技術面 / PTT 空頭比例 / 高價股多空溫度計共用，
+        各訊號再依自己的期間切片。經 Price Store 快取，同一次刷新內重複呼叫不會再連網。
+        """
+        symbols = [Config.TICKER_VIX, Config.TICKER_TSE] + list(Config.HIGH_PRICED_SEED_POOL)
+        return self.store.get_many(symbols, period=MARKET_SNAPSHOT_PERIOD)
+
+    @staticmethod
+    def _slice_period(df: pd.DataFrame, period: str) -> pd.DataFrame:
+        if df is None or df.empty:
+            return pd.DataFrame()
+        return df[df.index >= period_to_start(period)]
 
     def _safe_get_close(self, df: pd.DataFrame) -> pd.Series:
         if df.empty: return pd.Series(dtype=float)
@@ -155,13 +178,14 @@ class MacroRiskEngine:
         elif bias > -20: return f"📉 回測{ma_type} (買2)"
         else: return f"❄️ {ma_type}乖離超跌 (買4)"
 
-    def _analyze_tse_technicals(self) -> Dict:
+    def _analyze_tse_technicals(self, snapshot: Dict[str, pd.DataFrame] | None = None) -> Dict:
         res = {
             "name": "台股加權指數", "price": 0, "momentum": "N/A", "magic_ma": "N/A",
             "deduct_slope": [], "granville": "N/A"
         }
         try:
-            df = yf.download(Config.TICKER_TSE, period="2y", progress=False)
+            snapshot = snapshot if snapshot is not None else self.get_market_snapshot()
+            df = self._slice_period(snapshot.get(Config.TICKER_TSE), "2y")
             if df.empty:
                 res["magic_ma"] = "❌ 數據斷線"
                 return res
@@ -180,8 +204,9 @@ class MacroRiskEngine:
             elif high_3d < prev_high_5d: res["momentum"] = "📉 趨勢趨緩"
             else: res["momentum"] = "⏳ 區間盤整"
 
-            ma87_series = close.rolling(Config.MA_LIFE_LINE).mean()
-            ma284_series = close.rolling(Config.MA_LONG_TERM).mean()
+            mas = ma_panel(close.to_frame('Close'))
+            ma87_series = mas[Config.MA_LIFE_LINE]['Close']
+            ma284_series = mas[Config.MA_LONG_TERM]['Close']
             ma87 = ma87_series.iloc[-1]
             ma284 = ma284_series.iloc[-1]
             if ma87 > ma284: res["magic_ma"] = "🔥 中期多頭"
@@ -193,7 +218,7 @@ class MacroRiskEngine:
             for window, name, series in [(Config.MA_LIFE_LINE, "87MA", ma87_series), (Config.MA_LONG_TERM, "284MA", ma284_series)]:
                 if len(close) < window: continue
                 slope = self._calculate_slope(series, 10)
-                deduct_price = close.iloc[-window]
+                deduct_price = deduction_forecast(close.to_numpy(dtype=float), 1, window)['deduct'][0]
                 deduct_status = "🔥 扣低助漲" if price > deduct_price else "❄️ 扣高助跌"
                 slopes.append(f"{name}: {slope:.2f}° ({deduct_status})")
             res["deduct_slope"] = slopes
@@ -204,37 +229,16 @@ class MacroRiskEngine:
             return res
 
     def get_single_stock_data(self, ticker: str, period: str = "2y") -> pd.DataFrame:
-        if ticker in self.cache_data and (datetime.now() - self.cache_data[ticker]['timestamp']).total_seconds() < 600:
-            return self.cache_data[ticker]['data']
-        
         try:
-            df = yf.download(ticker, period=period, progress=False)
-            if df.empty:
-                return pd.DataFrame()
-            self.cache_data[ticker] = {'timestamp': datetime.now(), 'data': df}
-            return df
+            return self.store.get(ticker, period=period)
         except Exception:
             return pd.DataFrame()
 
     def calculate_ma_deduction_forecast(self, df: pd.DataFrame, ma_period: int = 87, forecast_days: int = 60) -> pd.DataFrame:
+        """未來 forecast_days 個營業日的扣抵值 / 均線守價 / 持平均線 (見 indicators.deduction_frame)"""
         if df.empty or len(df) < ma_period:
             return pd.DataFrame()
-
-        close_prices = self._safe_get_close(df)
-        
-        deduction_series = close_prices.shift(ma_period - 1).iloc[-(forecast_days + len(close_prices) - (ma_period -1)):]
-        
-        if deduction_series.empty:
-            return pd.DataFrame()
-
-        future_dates = pd.bdate_range(start=df.index[-1] + timedelta(days=1), periods=len(deduction_series))
-        
-        forecast_df = pd.DataFrame({
-            'Date': future_dates,
-            'Deduction_Value': deduction_series.values
-        }).set_index('Date')
-        
-        return forecast_df
+        return deduction_frame(self._safe_get_close(df), forecast_days, ma_period)
 
     def calculate_adam_projection(self, df: pd.DataFrame, lookback_days: int = 20) -> pd.DataFrame:
         if df.empty or len(df) < lookback_days:
@@ -261,6 +265,10 @@ class MacroRiskEngine:
         return projection_df
 
     def _get_leader_analysis(self, tickers: List[str], sort_key: str, top_n: int) -> pd.DataFrame:
+        """
+        主流股榜單：只回傳一列一檔的精簡特徵表 (排序值、趨勢、扣抵、乖離等純量)，
+        不夾帶日K / 扣抵 / 亞當投影 DataFrame；選定個股後再以 get_leader_detail 從本地倉庫重建。
+        """
         # [V78.4 Fix] VIP 股王救援機制與去重
         unique_tickers = sorted(list(set(tickers)))
         
@@ -268,44 +276,36 @@ class MacroRiskEngine:
         # 包括: 信驊, 世芯, 力旺, 大立光, 緯穎, 創意, 川湖, 祥碩, 嘉澤
         VIP_KINGS = ["5274.TW", "3661.TW", "3529.TW", "3008.TW", "6669.TW", "3443.TW", "2059.TW", "5269.TW", "3533.TW"]
 
-        # 1. 批次下載 (Batch Download)
+        # 1. 批次下載 (經 price_store：有效期內不重複連網，選股明細也從同一份快取切片)
         try:
-            data = yf.download(unique_tickers, period="2y", progress=False, group_by='ticker', threads=True)
-            if data.empty:
-                data = pd.DataFrame() # 初始化為空，等待救援
+            data = self.store.get_many(unique_tickers, period=LEADER_PERIOD)
         except Exception:
-            data = pd.DataFrame()
+            data = {}
 
         leader_list = []
         
         # 2. 處理批次數據
         processed_tickers = set()
-        if not data.empty:
-            for ticker in unique_tickers:
-                try:
-                    if len(unique_tickers) > 1:
-                        if ticker not in data.columns.levels[0]: continue
-                        stock_df = data[ticker]
-                    else:
-                        stock_df = data
-
-                    if stock_df.empty or stock_df['Close'].isnull().all(): continue
-                    
-                    close_prices = self._safe_get_close(stock_df)
-                    if close_prices.empty: continue
-                    last_close = close_prices.iloc[-1]
-                    if pd.isna(last_close): continue
-
-                    value = 0
-                    if sort_key == 'turnover':
-                        last_volume = stock_df['Volume'].ffill().iloc[-1]
-                        value = last_close * last_volume if not pd.isna(last_volume) else 0
-                    elif sort_key == 'price':
-                        value = last_close
-                    
-                    leader_list.append({"ticker": ticker, "value": value, "df": stock_df})
-                    processed_tickers.add(ticker)
-                except Exception: continue
+        for ticker in unique_tickers:
+            try:
+                stock_df = data.get(ticker, pd.DataFrame())
+                if stock_df.empty or stock_df['Close'].isnull().all(): continue
+                
+                close_prices = self._safe_get_close(stock_df)
+                if close_prices.empty: continue
+                last_close = close_prices.iloc[-1]
+                if pd.isna(last_close): continue
+
+                value = 0
+                if sort_key == 'turnover':
+                    last_volume = stock_df['Volume'].ffill().iloc[-1]
+                    value = last_close * last_volume if not pd.isna(last_volume) else 0
+                elif sort_key == 'price':
+                    value = last_close
+                
+                leader_list.append({"ticker": ticker, "value": value, "close": close_prices})
+                processed_tickers.add(ticker)
+            except Exception: continue
 
         # 3. [V78.4 New] VIP 股王救援行動 (Rescue Protocol)
         # 如果是針對價格排序 (Window 16)，且關鍵股王不在已處理名單中，強制單獨下載
@@ -314,12 +314,12 @@ class MacroRiskEngine:
                 if vip in unique_tickers and vip not in processed_tickers:
                     try:
                         # 強制單獨下載救援
-                        rescue_df = yf.download(vip, period="2y", progress=False)
+                        rescue_df = self.store.get(vip, period=LEADER_PERIOD)
                         if not rescue_df.empty and not rescue_df['Close'].isnull().all():
                             close_prices = self._safe_get_close(rescue_df)
                             if not close_prices.empty:
                                 last_close = close_prices.iloc[-1]
-                                leader_list.append({"ticker": vip, "value": last_close, "df": rescue_df})
+                                leader_list.append({"ticker": vip, "value": last_close, "close": close_prices})
                     except Exception:
                         pass # 救援失敗則放棄
 
@@ -330,34 +330,32 @@ class MacroRiskEngine:
         sorted_leaders = sorted(leader_list, key=lambda x: x['value'], reverse=True)
         top_leaders = sorted_leaders[:top_n]
 
+        # Top N 一次向量化計算 87/284 生命線與 20 日守價
+        closes = {l['ticker']: l['close'] for l in top_leaders}
+        panel = pd.DataFrame(closes)
+        mas = ma_panel(panel, windows=(Config.MA_LIFE_LINE,))
+        snap = ma_snapshot(panel)
+        hold20 = deduction_forecast(panel.to_numpy(dtype=float), 20, Config.MA_LIFE_LINE)['hold_price'][-1]
+
         results = []
         for i, leader in enumerate(top_leaders):
             try:
                 ticker = leader['ticker']
-                stock_df = leader['df'] # 直接使用已保存的 DataFrame (無論是批次還是救援的)
-                
-                close_prices = self._safe_get_close(stock_df)
+                close_prices = closes[ticker]
                 if len(close_prices) < Config.MA_LONG_TERM: continue
 
                 metadata = STOCK_METADATA.get(ticker, {"name": re.sub(r'\.TW$', '', ticker), "industry": "N/A"})
                 current_price = close_prices.iloc[-1]
-                
-                ma87_series = close_prices.rolling(Config.MA_LIFE_LINE).mean()
-                ma284_series = close_prices.rolling(Config.MA_LONG_TERM).mean()
-                ma87 = ma87_series.iloc[-1]
-                ma284 = ma284_series.iloc[-1]
+                tech = snap.loc[ticker]
+                ma87 = tech['ma87']
 
-                is_bullish = ma87_series > ma284_series
-                trend_status = "中期多頭 (黃金交叉)" if is_bullish.iloc[-1] else "中期空頭 (死亡交叉)"
-                
-                try:
-                    trend_groups = is_bullish.ne(is_bullish.shift()).cumsum()
-                    trend_days = trend_groups.groupby(trend_groups).cumcount().iloc[-1] + 1
-                except: trend_days = 0
+                trend_status = "中期多頭 (黃金交叉)" if tech['is_bullish'] else "中期空頭 (死亡交叉)"
+                trend_days = tech['trend_days']
 
+                ma87_series = mas[Config.MA_LIFE_LINE][ticker].reindex(close_prices.index)
                 ma87_slope = self._calculate_slope(ma87_series, 20)
                 
-                deduction_price = close_prices.iloc[-Config.MA_LIFE_LINE]
+                deduction_price = tech['deduct87']
                 deduction_signal = "📈 助漲 (扣低)" if current_price > deduction_price else "📉 壓力 (扣高)"
 
                 results.append({
@@ -372,9 +370,11 @@ class MacroRiskEngine:
                     "ma87_slope": ma87_slope,
                     "deduction_signal": deduction_signal,
                     "ma87": ma87,
-                    "stock_df": stock_df,
-                    "deduction_df": self.calculate_ma_deduction_forecast(stock_df, ma_period=Config.MA_LIFE_LINE, forecast_days=60),
-                    "adam_df": self.calculate_adam_projection(stock_df, lookback_days=20)
+                    "ma284": tech['ma284'],
+                    "bias87": tech['bias87'],
+                    "is_recent_breakout": bool(tech['is_recent_breakout']),
+                    "deduct87": deduction_price,
+                    "hold87_20d": hold20[panel.columns.get_loc(ticker)],
                 })
             except Exception: continue
         
@@ -386,37 +386,48 @@ class MacroRiskEngine:
             
         return final_df
 
+    def get_leader_detail(self, ticker: str, forecast_days: int = 60) -> Dict[str, pd.DataFrame]:
+        """
+        榜單選定個股的明細 (懶計算)：stock_df / deduction_df / adam_df。
+        日K 由 price_store 的本地快取切片，只在使用者點選時才建立，不進榜單快取。
+        """
+        stock_df = self.get_single_stock_data(ticker, period=LEADER_PERIOD)
+        if stock_df.empty:
+            return {"stock_df": stock_df, "deduction_df": pd.DataFrame(), "adam_df": pd.DataFrame()}
+        return {
+            "stock_df": stock_df,
+            "deduction_df": self.calculate_ma_deduction_forecast(stock_df, ma_period=Config.MA_LIFE_LINE,
+                                                                 forecast_days=forecast_days),
+            "adam_df": self.calculate_adam_projection(stock_df, lookback_days=20),
+        }
+
     def get_dynamic_turnover_leaders(self, top_n: int = 100) -> pd.DataFrame:
         return self._get_leader_analysis(Config.TITAN_WIDE_POOL, 'turnover', top_n)
 
     def get_high_price_leaders(self, top_n: int = 50) -> pd.DataFrame:
         return self._get_leader_analysis(Config.HIGH_PRICED_SEED_POOL, 'price', top_n)
 
-    def calculate_ptt_bearish_ratio(self, cb_df: pd.DataFrame = None) -> float:
-        tickers = Config.HIGH_PRICED_SEED_POOL
-        
-        try:
-            data = yf.download(tickers, period="150d", progress=False, group_by='ticker', threads=True)
-            if data.empty or data.isnull().all().all():
-                raise ValueError("Primary yfinance download failed")
-        except Exception:
+    def calculate_ptt_bearish_ratio(self, cb_df: pd.DataFrame = None,
+                                    snapshot: Dict[str, pd.DataFrame] | None = None) -> float:
+        snapshot = snapshot if snapshot is not None else self.get_market_snapshot()
+        tickers = [t for t in Config.HIGH_PRICED_SEED_POOL if t in snapshot]
+        data = {t: self._slice_period(snapshot[t], "150d") for t in tickers}
+
+        if not tickers:
+            # 種子池取不到時退回 CB 清單標的
             if cb_df is None or cb_df.empty or 'stock_code' not in cb_df.columns:
                 return -1.0
             
             unique_codes = cb_df['stock_code'].dropna().unique()
             tickers = [f"{code}.TW" for code in unique_codes]
             if not tickers: return -1.0
-            
-            try:
-                data = yf.download(tickers, period="150d", progress=False, group_by='ticker', threads=True)
-            except Exception:
-                return -1.0
+            data = self.store.get_many(tickers, period="150d")
 
         bearish_count = 0
         valid_stocks = 0
         for ticker in tickers:
             try:
-                stock_df = data[ticker] if len(tickers) > 1 and ticker in data.columns.levels[0] else data
+                stock_df = data.get(ticker, pd.DataFrame())
                 if stock_df.empty or len(stock_df) < Config.MA_SLOPE_60D: continue
                 
                 close = self._safe_get_close(stock_df)
@@ -455,20 +466,21 @@ class MacroRiskEngine:
         
         return distribution_data
 
-    def analyze_high_50_sentiment(self) -> Dict:
+    def analyze_high_50_sentiment(self, snapshot: Dict[str, pd.DataFrame] | None = None) -> Dict:
         tickers = Config.HIGH_PRICED_SEED_POOL
         bull_count = 0
         bear_count = 0
         total_analyzed = 0
         
         try:
-            data = yf.download(tickers, period="1y", progress=False, group_by='ticker', threads=True)
-            if data.empty:
+            snapshot = snapshot if snapshot is not None else self.get_market_snapshot()
+            data = {t: self._slice_period(snapshot.get(t), "1y") for t in tickers}
+            if not any(not d.empty for d in data.values()):
                 return {"error": "無法下載高價權值股數據。"}
 
             for ticker in tickers:
                 try:
-                    stock_df = data[ticker] if len(tickers) > 1 and ticker in data.columns.levels[0] else data
+                    stock_df = data[ticker]
                     if stock_df.empty or len(stock_df) < Config.MA_LIFE_LINE:
                         continue
 
@@ -566,9 +578,10 @@ class MacroRiskEngine:
 
     def check_market_status(self, cb_df: pd.DataFrame = None) -> Dict:
         signals = []
+        snapshot = self.get_market_snapshot()   # 一次取得，以下各訊號共用
 
         try:
-            vix = float(self._safe_get_close(yf.download(Config.TICKER_VIX, period="5d", progress=False)).iloc[-1])
+            vix = float(self._safe_get_close(snapshot[Config.TICKER_VIX]).iloc[-1])
         except: vix = 15.0
         if vix > Config.VIX_PANIC: signals.append("GREEN")
 
@@ -576,10 +589,10 @@ class MacroRiskEngine:
         if price_dist["pr90"] > Config.PR90_OVERHEAT: signals.append("RED")
         elif price_dist["pr90"] < Config.PR75_OPPORTUNITY and price_dist["pr90"] > 0: signals.append("GREEN")
 
-        tse_analysis = self._analyze_tse_technicals()
+        tse_analysis = self._analyze_tse_technicals(snapshot)
         if "空頭" in tse_analysis["magic_ma"]: signals.append("RED")
 
-        ptt_ratio = self.calculate_ptt_bearish_ratio(cb_df)
+        ptt_ratio = self.calculate_ptt_bearish_ratio(cb_df, snapshot)
         if ptt_ratio > 50: signals.append("RED")
 
         final = "YELLOW_LIGHT"
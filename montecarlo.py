@@ -0,0 +1,132 @@
+# montecarlo.py
+# Titan SOP V100.0 — Monte Carlo Path Engine (量子路徑蒙地卡羅)
+# 包含：GBM / 區塊自助抽樣 (block bootstrap) 路徑模擬、沿路徑推進 87/284MA 與扣抵值、
+#       黃金/死亡交叉與跌破 87MA 的機率、分位數機率錐
+# 所有路徑以 (路徑數, 天數) 的 NumPy 矩陣一次計算；不依賴 Streamlit。
+
+from typing import Dict, Sequence
+
+import numpy as np
+
+from config import Config
+from indicators import deduction_forecast
+
+MC_METHODS = ("gbm", "bootstrap")
+MC_QUANTILES = (5, 25, 50, 75, 95)
+
+
+# ═══════════════════════════════════════════════════════════════
+#  路徑模擬
+# ═══════════════════════════════════════════════════════════════
+
+def _log_returns(close: np.ndarray, lookback: int) -> np.ndarray:
+    c = np.asarray(close, dtype=float)
+    c = c[~np.isnan(c)][-(lookback + 1):]
+    return np.diff(np.log(c))
+
+
+def simulate_paths(close: np.ndarray, horizon: int, n_paths: int | None = None, method: str = "gbm",
+                   drift_pct: float | None = None, block: int | None = None,
+                   lookback: int | None = None, seed: int | None = None) -> np.ndarray:
+    """
+    由歷史收盤價模擬未來 horizon 天的價格路徑，回傳 (n_paths, horizon)。
+      gbm       - 幾何布朗運動：σ 取近 lookback 日對數報酬標準差
+      bootstrap - 區塊自助抽樣：隨機抽連續 block 天的歷史對數報酬接續，保留波動叢聚與肥尾
+    drift_pct 為假設的每日動能 (%)；省略時沿用歷史平均報酬。
+    """
+    if method not in MC_METHODS:
+        raise ValueError(f"未知的模擬方式: {method}")
+    n_paths = n_paths or Config.MC_PATHS
+    block = block or Config.MC_BLOCK
+    r = _log_returns(close, lookback or Config.MC_LOOKBACK)
+    if len(r) < max(2, block):
+        raise ValueError("歷史資料不足，無法估計報酬分配")
+    mu = np.log1p(drift_pct / 100) if drift_pct is not None else r.mean()
+    rng = np.random.default_rng(Config.MC_SEED if seed is None else seed)
+
+    if method == "gbm":
+        sigma = r.std(ddof=1)
+        steps = (mu - 0.5 * sigma ** 2) + sigma * rng.standard_normal((n_paths, horizon))
+        if drift_pct is not None:
+            steps += 0.5 * sigma ** 2   # 指定動能為「中位數路徑」的每日漲幅
+    else:
+        n_blocks = -(-horizon // block)
+        starts = rng.integers(0, len(r) - block + 1, size=(n_paths, n_blocks))
+        steps = r[(starts[:, :, None] + np.arange(block)).reshape(n_paths, -1)[:, :horizon]]
+        steps = steps - r.mean() + mu
+    last = float(np.asarray(close, dtype=float)[~np.isnan(close)][-1])
+    return last * np.exp(np.cumsum(steps, axis=1))
+
+
+# ═══════════════════════════════════════════════════════════════
+#  路徑上的均線
+# ═══════════════════════════════════════════════════════════════
+
+def carry_ma(close: np.ndarray, paths: np.ndarray, window: int) -> np.ndarray:
+    """
+    歷史 + 模擬路徑接續後，未來第 h 天的 window 日均線，形狀同 paths (可為 1-D 單一路徑)。
+    歷史部分的尾段和與路徑前綴和各算一次，不逐日 rolling。
+    """
+    c = np.asarray(close, dtype=float)
+    c = c[~np.isnan(c)]
+    p = np.atleast_2d(np.asarray(paths, dtype=float))
+    horizon = p.shape[1]
+    if len(c) + 1 < window:
+        out = np.full(p.shape, np.nan)
+        return out if np.ndim(paths) > 1 else out[0]
+    h = np.arange(1, horizon + 1)
+    k = np.clip(window - h, 0, None)                                   # 仍留在窗口內的歷史天數
+    tail = np.concatenate([[0.0], np.cumsum(c[::-1][:window])])[k]      # 最後 k 根歷史收盤和
+    pc = np.hstack([np.zeros((p.shape[0], 1)), np.cumsum(p, axis=1)])
+    path_sum = pc[:, h] - pc[:, np.clip(h - window, 0, None)]
+    out = (tail[None, :] + path_sum) / window
+    return out if np.ndim(paths) > 1 else out[0]
+
+
+# ═══════════════════════════════════════════════════════════════
+#  交叉 / 跌破機率
+# ═══════════════════════════════════════════════════════════════
+
+def ma_path_forecast(close: np.ndarray, horizon: int = 20, n_paths: int | None = None,
+                     method: str = "gbm", drift_pct: float | None = None,
+                     quantiles: Sequence[int] = MC_QUANTILES, seed: int | None = None) -> Dict:
+    """
+    一次批次模擬並彙整：
+      quantiles / ma87_median / ma284_median   - 每日價格分位數 {q: (horizon,)} 與均線中位數
+      deduct87 / deduct284                     - 扣抵值排程 (indicators.deduction_forecast)
+      p_golden / p_death                       - 期間內出現 87/284 黃金 / 死亡交叉的機率
+      p_break87                                - 期間內任一日收盤跌破 87MA 的機率
+      p_above87_end                            - 期末收盤仍在 87MA 之上的機率
+      first_cross_day                          - 有交叉的路徑中，首次交叉天數的中位數 (無則 NaN)
+      ma87_now / ma284_now / n_paths / method
+    """
+    c = np.asarray(close, dtype=float)
+    c = c[~np.isnan(c)]
+    short, long_ = Config.MA_LIFE_LINE, Config.MA_LONG_TERM
+    paths = simulate_paths(c, horizon, n_paths, method, drift_pct, seed=seed)
+    ma_s, ma_l = carry_ma(c, paths, short), carry_ma(c, paths, long_)
+    ma_s_now = c[-short:].mean() if len(c) >= short else np.nan
+    ma_l_now = c[-long_:].mean() if len(c) >= long_ else np.nan
+
+    with np.errstate(invalid='ignore'):
+        gap = np.hstack([np.full((len(paths), 1), ma_s_now - ma_l_now), ma_s - ma_l])
+        golden = (gap[:, :-1] <= 0) & (gap[:, 1:] > 0)
+        death = (gap[:, :-1] >= 0) & (gap[:, 1:] < 0)
+        below = paths < ma_s
+    cross = golden | death
+    has_cross = cross.any(axis=1)
+    first = np.argmax(cross, axis=1) + 1
+    qs = np.percentile(paths, list(quantiles), axis=0)            # 一次排序取所有分位
+    return {
+        "method": method, "n_paths": len(paths),
+        "quantiles": dict(zip(quantiles, qs)),
+        "ma87_median": np.median(ma_s, axis=0), "ma284_median": np.median(ma_l, axis=0),
+        "deduct87": deduction_forecast(c, horizon, short)['deduct'],
+        "deduct284": deduction_forecast(c, horizon, long_)['deduct'],
+        "p_golden": float(golden.any(axis=1).mean()),
+        "p_death": float(death.any(axis=1).mean()),
+        "p_break87": float(below.any(axis=1).mean()),
+        "p_above87_end": float((paths[:, -1] > ma_s[:, -1]).mean()),
+        "first_cross_day": float(np.median(first[has_cross])) if has_cross.any() else np.nan,
+        "ma87_now": ma_s_now, "ma284_now": ma_l_now,
+    }
@@ -0,0 +1,220 @@
+# optimizer.py
+# Titan SOP V100.0 — Parameter Optimizer (87/284 參數最佳化)
+# 包含：前綴和均線表、(生命線, 長期線, 格蘭碧乖離帶) 網格 / 隨機搜尋、
+#       Walk-Forward 樣本外穩定度、多標的 ProcessPoolExecutor 平行
+# 不依賴 Streamlit；進出場狀態機沿用 backtest.run_state_machine。
+#
+# 規則 (與 SOP 87/284 + 格蘭碧判讀同構，參數化後可搜尋)：
+#   進場：短均 > 長均 (多頭排列) 且 收盤站上短均 且 乖離 < 乖離帶 (未過熱，買1/買2)
+#   出場：收盤跌破短均 (生命線停損) 或 乖離 > 乖離帶 (賣4 過熱)
+# 訊號只用到當根以前的資料，整段只需回測一次，再依切段計算樣本內 / 樣本外績效。
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.stats import spearmanr
+
+from backtest import run_state_machine
+from config import Config
+
+OBJECTIVES = ("sharpe", "cagr")
+
+
+# ═══════════════════════════════════════════════════════════════
+#  參數空間 & 均線表
+# ═══════════════════════════════════════════════════════════════
+
+def param_grid(shorts: Sequence[int] | None = None, longs: Sequence[int] | None = None,
+               bands: Sequence[float] | None = None, method: str = "grid",
+               n_iter: int = 500, seed: int = 0) -> pd.DataFrame:
+    """
+    候選參數組合 (short, long, band)，只保留 short < long；現行 Config 參數一律納入作為基準。
+    method='random' 時自全網格不重複抽樣 n_iter 組 (基準組保證在內)。
+    """
+    shorts = sorted(set(shorts or Config.OPT_SHORT_WINDOWS) | {Config.MA_LIFE_LINE})
+    longs = sorted(set(longs or Config.OPT_LONG_WINDOWS) | {Config.MA_LONG_TERM})
+    bands = sorted(set(bands or Config.OPT_BIAS_BANDS) | {Config.OPT_BIAS_BAND_BASE})
+    s, l, b = (a.ravel() for a in np.meshgrid(shorts, longs, bands, indexing='ij'))
+    grid = pd.DataFrame({"short": s, "long": l, "band": b.astype(float)})
+    grid = grid[grid["short"] < grid["long"]].reset_index(drop=True)
+    if method == "random" and n_iter < len(grid):
+        base = _baseline_mask(grid)
+        rng = np.random.default_rng(seed)
+        pick = rng.choice(np.flatnonzero(~base), size=n_iter - 1, replace=False)
+        grid = grid.iloc[np.sort(np.concatenate([np.flatnonzero(base), pick]))].reset_index(drop=True)
+    elif method not in ("grid", "random"):
+        raise ValueError(f"未知的搜尋方式: {method}")
+    return grid
+
+
+def _baseline_mask(grid: pd.DataFrame) -> np.ndarray:
+    return ((grid["short"] == Config.MA_LIFE_LINE) & (grid["long"] == Config.MA_LONG_TERM)
+            & (grid["band"] == Config.OPT_BIAS_BAND_BASE)).to_numpy()
+
+
+def ma_table(close: np.ndarray, windows: Sequence[int]) -> Dict[int, np.ndarray]:
+    """一次前綴和，取出所有窗口的簡單均線 (不足窗口為 NaN)"""
+    close = np.asarray(close, dtype=float)
+    cs = np.concatenate([[0.0], np.cumsum(close)])
+    out = {}
+    for w in dict.fromkeys(int(x) for x in windows):
+        ma = np.full(len(close), np.nan)
+        if 0 < w <= len(close):
+            ma[w - 1:] = (cs[w:] - cs[:-w]) / w
+        out[w] = ma
+    return out
+
+
+# ═══════════════════════════════════════════════════════════════
+#  向量化評估
+# ═══════════════════════════════════════════════════════════════
+
+def _combo_returns(close: np.ndarray, mas: Dict[int, np.ndarray], short: int,
+                   longs: np.ndarray, bands: np.ndarray) -> np.ndarray:
+    """同一條短均的 k 組 (long, band) 一次算出每日策略報酬 (T, k)"""
+    ma_s = mas[short]
+    ma_l = np.column_stack([mas[int(w)] for w in longs])
+    with np.errstate(invalid='ignore'):
+        bias = (close - ma_s) / ma_s * 100
+        entry = (ma_s[:, None] > ma_l) & (close > ma_s)[:, None] & (bias[:, None] < bands[None, :])
+        exit_ = (close < ma_s)[:, None] | (bias[:, None] > bands[None, :])
+    pos = run_state_machine(entry, exit_, start=1)
+    pct = np.zeros(len(close))
+    pct[1:] = close[1:] / close[:-1] - 1
+    ret = np.zeros(pos.shape)
+    ret[1:] = pos[:-1] * pct[1:, None]
+    return ret
+
+
+def _segment_metrics(ret: np.ndarray, segments: Dict[str, Tuple[int, int]]) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    報酬矩陣 (T, k) 各段 [lo, hi) 的 CAGR / MDD / Sharpe。
+    對數權益與報酬平方的前綴和只算一次；同起點的段 (錨定式樣本內) 共用一次滾動高點。
+    """
+    r = np.ascontiguousarray(ret.T)                                  # (k, T)：沿時間軸連續存放
+    zero = np.zeros((r.shape[0], 1))
+    log_eq = np.hstack([zero, np.cumsum(np.log1p(r), axis=1)])      # log_eq[:, i] = 第 i 根之前的累積
+    s1 = np.hstack([zero, np.cumsum(r, axis=1)])
+    s2 = np.hstack([zero, np.cumsum(r ** 2, axis=1)])
+
+    worst: Dict[Tuple[int, int], np.ndarray] = {}
+    for lo in {lo for lo, _ in segments.values()}:
+        end = max(hi for l, hi in segments.values() if l == lo)
+        run = log_eq[:, lo:end + 1]
+        dd = np.minimum.accumulate(run - np.maximum.accumulate(run, axis=1), axis=1)
+        for l, hi in segments.values():
+            if l == lo:
+                worst[(lo, hi)] = dd[:, hi - lo]
+
+    out = {}
+    for name, (lo, hi) in segments.items():
+        n = max(hi - lo, 1)
+        mean = (s1[:, hi] - s1[:, lo]) / n
+        var = ((s2[:, hi] - s2[:, lo]) - n * mean ** 2) / max(n - 1, 1)
+        std = np.sqrt(np.maximum(var, 0))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sharpe = np.where(std > 1e-12, (mean * 252 - 0.02) / (std * np.sqrt(252)), 0.0)
+        out[name] = {
+            "cagr": np.exp((log_eq[:, hi] - log_eq[:, lo]) * 252 / n) - 1,
+            "max_drawdown": np.exp(worst[(lo, hi)]) - 1,
+            "sharpe": sharpe,
+        }
+    return out
+
+
+def walk_forward_splits(n: int, warmup: int, n_splits: int) -> List[Tuple[int, int, int]]:
+    """
+    錨定式 (expanding) 切段：暖機後的區間等分成 n_splits + 1 塊，
+    第 k 折以前 k+1 塊為樣本內、第 k+2 塊為樣本外。回傳 [(train_lo, train_hi, test_hi)]。
+    """
+    if n - warmup < 2 * (n_splits + 1):
+        return []
+    edges = np.linspace(warmup, n, n_splits + 2).astype(int)
+    return [(int(edges[0]), int(edges[k + 1]), int(edges[k + 2])) for k in range(n_splits)]
+
+
+def optimize_ticker(close: np.ndarray, grid: pd.DataFrame, index=None,
+                    n_splits: int | None = None, objective: str = "sharpe") -> Dict:
+    """
+    單一標的對所有參數組合回測。回傳：
+      results     : grid + 全期間 / 各折樣本內外 CAGR / MDD / Sharpe
+      walk_forward: 每折樣本內最佳參數、其樣本外成績、基準參數樣本外成績、樣本內外排名相關
+      stability   : 樣本外平均成績、勝過基準比例、樣本外為正比例、平均排名相關
+    """
+    if objective not in OBJECTIVES:
+        raise ValueError(f"未知的最佳化目標: {objective}")
+    close = np.asarray(close, dtype=float)
+    n = len(close)
+    n_splits = Config.OPT_WALK_FORWARD_SPLITS if n_splits is None else n_splits
+    splits = walk_forward_splits(n, int(grid["long"].max()), n_splits)
+    mas = ma_table(close, np.concatenate([grid["short"].unique(), grid["long"].unique()]))
+
+    metrics: Dict[str, np.ndarray] = {}
+    segments = {"all": (1, n)}
+    for k, (lo, mid, hi) in enumerate(splits):
+        segments[f"is{k}"], segments[f"oos{k}"] = (lo, mid), (mid, hi)
+    for short, rows in grid.groupby("short").indices.items():
+        ret = _combo_returns(close, mas, int(short), grid["long"].to_numpy()[rows],
+                             grid["band"].to_numpy()[rows])
+        for seg, vals in _segment_metrics(ret, segments).items():
+            for key, val in vals.items():
+                metrics.setdefault(f"{seg}_{key}", np.full(len(grid), np.nan))[rows] = val
+
+    results = grid.copy()
+    for key in ("cagr", "max_drawdown", "sharpe"):
+        results[key] = metrics[f"all_{key}"]
+
+    base = np.flatnonzero(_baseline_mask(grid))
+    idx = np.asarray(index) if index is not None else np.arange(n)
+    folds = []
+    for k, (lo, mid, hi) in enumerate(splits):
+        is_score, oos_score = metrics[f"is{k}_{objective}"], metrics[f"oos{k}_{objective}"]
+        best = int(np.nanargmax(is_score))
+        rho = spearmanr(is_score, oos_score).statistic if len(grid) > 2 else np.nan
+        folds.append({
+            "fold": k, "train_start": idx[lo], "train_end": idx[mid - 1], "test_end": idx[hi - 1],
+            "short": int(grid.at[best, "short"]), "long": int(grid.at[best, "long"]),
+            "band": float(grid.at[best, "band"]),
+            "is_score": is_score[best], "oos_score": oos_score[best],
+            "oos_cagr": metrics[f"oos{k}_cagr"][best],
+            "oos_max_drawdown": metrics[f"oos{k}_max_drawdown"][best],
+            "baseline_oos_score": oos_score[base[0]] if base.size else np.nan,
+            "rank_corr": rho,
+        })
+    wf = pd.DataFrame(folds)
+    stability = {}
+    if not wf.empty:
+        stability = {
+            "objective": objective,
+            "mean_oos_score": float(wf["oos_score"].mean()),
+            "oos_positive_ratio": float((wf["oos_score"] > 0).mean()),
+            "beat_baseline_ratio": float((wf["oos_score"] > wf["baseline_oos_score"]).mean()),
+            "mean_rank_corr": float(wf["rank_corr"].mean()),
+            "distinct_params": int(wf[["short", "long", "band"]].drop_duplicates().shape[0]),
+        }
+    return {"results": results, "walk_forward": wf, "stability": stability}
+
+
+def _optimize_job(args):
+    ticker, close, index, grid, n_splits, objective = args
+    return ticker, optimize_ticker(close, grid, index, n_splits, objective)
+
+
+def optimize_many(frames: Dict[str, pd.DataFrame], grid: pd.DataFrame | None = None,
+                  n_splits: int | None = None, objective: str = "sharpe",
+                  workers: int | None = None) -> Dict[str, Dict]:
+    """
+    多標的最佳化：每檔一個工作，交給 ProcessPoolExecutor 平行 (workers=1 或單檔時直接在本行程執行)。
+    回傳 {ticker: optimize_ticker 結果}。
+    """
+    grid = param_grid() if grid is None else grid
+    jobs = [(t, df['Close'].to_numpy(dtype=float), df.index.to_numpy(), grid, n_splits, objective)
+            for t, df in frames.items() if df is not None and len(df) > int(grid["long"].max())]
+    workers = workers or min(len(jobs), os.cpu_count() or 1)
+    if workers <= 1 or len(jobs) <= 1:
+        return dict(map(_optimize_job, jobs))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return dict(pool.map(_optimize_job, jobs))
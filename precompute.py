@@ -0,0 +1,113 @@
+# precompute.py
+# Titan SOP V100.0 — Headless Pre-compute (盤前排程)
+# 包含：不經 Streamlit 執行宏觀風控、成交重心 / 高價權值 Top N、全境獵殺、
+#       CB 普查評分，結果寫入 snapshot_store，UI 在快照夠新時直接讀取；
+#       CB 清單與普查結果另存入 cb_archive 歷史快照庫
+#
+# 用法：
+#   python precompute.py --cb data/cb_list.xlsx                      # 全部工作
+#   python precompute.py --jobs leaders hunt --theaters TW_SILICON_ISLAND
+# 排程範例 (crontab，週一至週五 07:30 開盤前)：
+#   30 7 * * 1-5 cd /path/to/titan && python precompute.py --cb data/cb_list.xlsx >> logs/precompute.log 2>&1
+
+import argparse
+import sys
+import time
+from typing import List
+
+import pandas as pd
+
+from cb_archive import ARCHIVE_ERRORS, get_cb_archive
+from config import WAR_THEATERS
+from fingerprint import frame_fingerprint
+from snapshot_store import get_snapshot_store
+
+JOBS = ["market", "leaders", "hunt", "scan"]
+
+
+def _load_cb(path: str) -> pd.DataFrame | None:
+    """以與 UI 上傳相同的解析流程讀取 CB 清單，確保快照指紋一致"""
+    from data_engine import load_cb_data_from_upload
+    with open(path, 'rb') as f:
+        df, err = load_cb_data_from_upload(f)
+    if err:
+        print(err, file=sys.stderr)
+    return df
+
+
+def run_market(cb_df: pd.DataFrame) -> None:
+    from macro_risk import MacroRiskEngine
+    result = MacroRiskEngine().check_market_status(cb_df=cb_df)
+    get_snapshot_store().save("market_status", result, source=frame_fingerprint(cb_df))
+    print(f"🚦 宏觀風控：{result['signal']} (VIX {result['vix']:.2f})")
+
+
+def run_leaders() -> None:
+    from macro_risk import MacroRiskEngine
+    macro = MacroRiskEngine()
+    store = get_snapshot_store()
+    store.save("turnover_leaders_100", macro.get_dynamic_turnover_leaders(top_n=100))
+    store.save("high_price_leaders_50", macro.get_high_price_leaders(top_n=50))
+    print("💹 成交重心 Top 100 / 👑 高價權值 Top 50 完成")
+
+
+def run_hunt(theaters: List[str]) -> None:
+    from hunter import TheaterHunter
+    hunter = TheaterHunter()
+    for name in theaters:
+        hits = hunter.hunt(WAR_THEATERS[name])
+        get_snapshot_store().save(f"hunt_{name}", hits)
+        print(f"🚀 {name}: {len(WAR_THEATERS[name])} 檔，命中 {len(hits)}")
+
+
+def run_scan(cb_df: pd.DataFrame) -> None:
+    from data_engine import normalize_census_frame
+    from strategy import TitanStrategyEngine
+    work_df = normalize_census_frame(cb_df)
+    scan_df = TitanStrategyEngine().scan_entire_portfolio(work_df)
+    get_snapshot_store().save("cb_scan", scan_df, source=frame_fingerprint(work_df))
+    try:
+        get_cb_archive().append(scan_df, "scan")
+    except ARCHIVE_ERRORS as e:
+        print(f"⚠️ CB 普查結果存檔失敗: {e}", file=sys.stderr)
+    print(f"🎯 CB 普查評分：{len(scan_df)} 檔")
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Titan SOP 盤前預先計算 (寫入 data/snapshots)")
+    parser.add_argument("--cb", help="CB 清單路徑 (Excel/CSV)；market / scan 需要")
+    parser.add_argument("--jobs", nargs="+", choices=JOBS, default=JOBS, help="要執行的工作 (預設全部)")
+    parser.add_argument("--theaters", nargs="+", choices=list(WAR_THEATERS), default=list(WAR_THEATERS),
+                        help="hunt 掃描的戰區 (預設全部)")
+    args = parser.parse_args(argv)
+
+    cb_df = _load_cb(args.cb) if args.cb else None
+    if args.cb and (cb_df is None or cb_df.empty):
+        print(f"❌ 無法解析 CB 清單: {args.cb}", file=sys.stderr)
+        return 1
+    if cb_df is not None:
+        try:
+            get_cb_archive().append(cb_df, "upload")
+        except ARCHIVE_ERRORS as e:
+            print(f"⚠️ CB 清單存檔失敗: {e}", file=sys.stderr)
+
+    failed = 0
+    for job in args.jobs:
+        if job in ("market", "scan") and cb_df is None:
+            print(f"⏭️ 略過 {job} (未指定 --cb)")
+            continue
+        t0 = time.time()
+        try:
+            if job == "market":    run_market(cb_df)
+            elif job == "leaders": run_leaders()
+            elif job == "hunt":    run_hunt(args.theaters)
+            elif job == "scan":    run_scan(cb_df)
+            print(f"   ⏱️ {job} 耗時 {time.time() - t0:.1f}s")
+        except Exception as e:
+            failed += 1
+            print(f"❌ {job} 失敗: {e}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,460 @@
+# price_store.py
+# Titan SOP V100.0 — Price Store (本地日K 倉庫)
+# 包含：每檔一個欄式檔案的 OHLCV 儲存 (依 symbol + 還原模式分鍵)、
+#       單檔/批次讀取、期間切片、台股雙軌代號候選、上市/上櫃對照表
+# 所有 yfinance 日K 下載統一經由此處：同一檔在有效期內只打一次網路，
+# 各模組再依自己需要的 period / start 從本地切片。
+
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List
+
+import pandas as pd
+import yfinance as yf
+
+from config import Config, DATA_DIR
+
+# ── 可選依賴：有 pyarrow 用 Parquet，否則退回 pickle ──────────────────────────
+try:
+    import pyarrow  # noqa: F401
+    _HAS_PARQUET = True
+except ImportError:
+    _HAS_PARQUET = False
+
+PRICE_STORE_DIR   = DATA_DIR / "price_store"
+OHLCV_COLS        = ['Open', 'High', 'Low', 'Close', 'Volume']
+EXCHANGE_MAP_PATH = PRICE_STORE_DIR / "exchange_map.json"
+FULL_HISTORY_START = "1990-01-01"
+_MEM_CAP          = 512      # 行程內記憶體層最多保留的檔數 (LRU)
+_REVISION_TOL     = 0.005    # 增量重疊區收盤價容許誤差，超過視為還原權值改寫
+
+
+# ═══════════════════════════════════════════════════════════════
+#  代號 & 期間工具
+# ═══════════════════════════════════════════════════════════════
+
+TW_SUFFIXES = ('.TW', '.TWO')
+
+
+def is_tw_code(ticker: str) -> bool:
+    """是否為未帶後綴的台股代號 (數字開頭、4~6 碼)"""
+    t = str(ticker).strip()
+    return bool(re.match(r'^[0-9]', t)) and '.' not in t and 4 <= len(t) <= 6
+
+
+def yahoo_candidates(ticker: str) -> List[str]:
+    """台股純數字代號 → [.TW, .TWO] 雙軌候選；其餘代號原樣 (大寫) 回傳"""
+    t = str(ticker).strip()
+    if is_tw_code(t):
+        return [f"{t}{sfx}" for sfx in TW_SUFFIXES]
+    return [t.upper()]
+
+
+def period_to_start(period: str | None) -> pd.Timestamp:
+    """yfinance period 字串 (5d / 1mo / 2y / ytd / max) → 起始日"""
+    today = pd.Timestamp.today().normalize()
+    if not period or period == "max":
+        return pd.Timestamp(FULL_HISTORY_START)
+    if period == "ytd":
+        return pd.Timestamp(year=today.year, month=1, day=1)
+    m = re.match(r'^(\d+)(d|wk|mo|y)$', period)
+    if not m:
+        return pd.Timestamp(FULL_HISTORY_START)
+    n, unit = int(m.group(1)), m.group(2)
+    if unit == 'd':  return today - pd.Timedelta(days=n)
+    if unit == 'wk': return today - pd.Timedelta(weeks=n)
+    if unit == 'mo': return today - pd.DateOffset(months=n)
+    return today - pd.DateOffset(years=n)
+
+
+def normalize_ohlcv(df: pd.DataFrame) -> pd.DataFrame:
+    """攤平 MultiIndex 欄位、統一 tz-naive DatetimeIndex、只保留 OHLCV"""
+    if df is None or df.empty:
+        return pd.DataFrame(columns=OHLCV_COLS)
+    df = df.copy()
+    if isinstance(df.columns, pd.MultiIndex):
+        lvl = next((i for i in range(df.columns.nlevels)
+                    if 'Close' in df.columns.get_level_values(i)), 0)
+        df.columns = df.columns.get_level_values(lvl)
+    df = df.loc[:, ~df.columns.duplicated()]
+    df = df[[c for c in OHLCV_COLS if c in df.columns]]
+    df.index = pd.to_datetime(df.index)
+    if df.index.tz is not None:
+        df.index = df.index.tz_localize(None)
+    df.index.name = 'Date'
+    if 'Close' in df.columns:
+        df = df[df['Close'].notna()]
+    return df[~df.index.duplicated(keep='last')].sort_index()
+
+
+def split_batch(raw: pd.DataFrame, symbols: List[str]) -> Dict[str, pd.DataFrame]:
+    """拆解 yf.download(group_by='ticker') 的批次結果 → {symbol: OHLCV}"""
+    out = {}
+    if raw is None or raw.empty:
+        return out
+    if not isinstance(raw.columns, pd.MultiIndex):
+        if len(symbols) == 1:
+            out[symbols[0]] = normalize_ohlcv(raw)
+        return out
+    for lvl in range(raw.columns.nlevels):
+        present = set(raw.columns.get_level_values(lvl))
+        if any(s in present for s in symbols):
+            for s in symbols:
+                if s in present:
+                    out[s] = normalize_ohlcv(raw.xs(s, axis=1, level=lvl))
+            break
+    return out
+
+
+# ═══════════════════════════════════════════════════════════════
+#  Price Store 本體
+# ═══════════════════════════════════════════════════════════════
+
+class PriceStore:
+    """
+    本地日K 倉庫。每個 (symbol, 還原模式) 一個欄式檔案，旁附 .json 中繼資料：
+      since      - 該檔下載時涵蓋的起始日 (判斷是否需往前補資料)
+      fetched_at - 最後一次下載的 epoch 秒 (判斷是否過期)
+    讀取順序：行程內記憶體 → 磁碟 → 網路 (過期者只增量補抓)。
+    """
+
+    def __init__(self, root: Path | str = PRICE_STORE_DIR, ttl: int = Config.PRICE_STORE_TTL):
+        self.root = Path(root)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._mem: OrderedDict = OrderedDict()   # (symbol, adj) → (meta, df)
+
+    # ── 路徑與序列化 ─────────────────────────────────────────
+    def _dir(self, auto_adjust: bool) -> Path:
+        return self.root / ("adj" if auto_adjust else "raw")
+
+    def path_for(self, symbol: str, auto_adjust: bool = True) -> Path:
+        safe = re.sub(r'[^\w.\-^=]', '_', symbol.upper())
+        ext  = ".parquet" if _HAS_PARQUET else ".pkl"
+        return self._dir(auto_adjust) / f"{safe}{ext}"
+
+    def _meta_path(self, symbol: str, auto_adjust: bool) -> Path:
+        return self.path_for(symbol, auto_adjust).with_suffix(".json")
+
+    def _atomic_write(self, path: Path, writer) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        writer(tmp)
+        os.replace(tmp, path)
+
+    def read(self, symbol: str, auto_adjust: bool = True) -> tuple[dict, pd.DataFrame | None]:
+        """讀取 (中繼資料, 日K)；不存在時回傳 ({}, None)"""
+        key = (symbol.upper(), auto_adjust)
+        with self._lock:
+            if key in self._mem:
+                self._mem.move_to_end(key)
+                return self._mem[key]
+        path, meta_path = self.path_for(symbol, auto_adjust), self._meta_path(symbol, auto_adjust)
+        if not path.exists() or not meta_path.exists():
+            return {}, None
+        try:
+            meta = json.loads(meta_path.read_text(encoding='utf-8'))
+            df = pd.read_parquet(path) if _HAS_PARQUET else pd.read_pickle(path)
+        except Exception:
+            return {}, None
+        self._remember(key, meta, df)
+        return meta, df
+
+    def write(self, symbol: str, df: pd.DataFrame, since: str, auto_adjust: bool = True) -> None:
+        meta = {"symbol": symbol.upper(), "since": str(since)[:10], "fetched_at": time.time()}
+        if _HAS_PARQUET:
+            self._atomic_write(self.path_for(symbol, auto_adjust), lambda p: df.to_parquet(p))
+        else:
+            self._atomic_write(self.path_for(symbol, auto_adjust), lambda p: df.to_pickle(p))
+        self._atomic_write(self._meta_path(symbol, auto_adjust),
+                           lambda p: p.write_text(json.dumps(meta), encoding='utf-8'))
+        self._remember((symbol.upper(), auto_adjust), meta, df)
+
+    def _remember(self, key: tuple, meta: dict, df: pd.DataFrame) -> None:
+        with self._lock:
+            self._mem[key] = (meta, df)
+            self._mem.move_to_end(key)
+            while len(self._mem) > _MEM_CAP:
+                self._mem.popitem(last=False)
+
+    # ── 狀態判斷 ─────────────────────────────────────────────
+    def _is_fresh(self, meta: dict) -> bool:
+        return bool(meta) and (time.time() - meta.get("fetched_at", 0)) < self.ttl
+
+    def _covers(self, meta: dict, start: pd.Timestamp) -> bool:
+        return bool(meta) and pd.Timestamp(meta.get("since", "2999-01-01")) <= start
+
+    def _needs_fetch(self, symbol: str, start: pd.Timestamp, auto_adjust: bool) -> bool:
+        meta, df = self.read(symbol, auto_adjust)
+        return df is None or not self._is_fresh(meta) or not self._covers(meta, start)
+
+    # ── 網路下載 ─────────────────────────────────────────────
+    def _download(self, symbols: List[str], start: str, auto_adjust: bool) -> Dict[str, pd.DataFrame]:
+        """一次 yf.download 取回多檔，拆成 {symbol: OHLCV}"""
+        try:
+            if len(symbols) == 1:
+                raw = yf.download(symbols[0], start=start, progress=False, auto_adjust=auto_adjust)
+            else:
+                raw = yf.download(symbols, start=start, progress=False, auto_adjust=auto_adjust,
+                                  group_by='ticker', threads=Config.PRICE_STORE_WORKERS)
+        except Exception:
+            return {}
+        return split_batch(raw, symbols)
+
+    def _fetch_full(self, symbols: List[str], start: pd.Timestamp, auto_adjust: bool) -> None:
+        """整段下載 (首次建檔 / 需往前補資料 / 偵測到還原權值變動)"""
+        # 已有資料時沿用原涵蓋起點，避免越抓越短
+        for s in symbols:
+            meta, _ = self.read(s, auto_adjust)
+            if meta:
+                start = min(start, pd.Timestamp(meta["since"]))
+        start_str = start.strftime('%Y-%m-%d')
+        for s, df in self._download(symbols, start_str, auto_adjust).items():
+            if not df.empty:
+                self.write(s, df, start_str, auto_adjust)
+
+    def _fetch_delta(self, symbols: List[str], auto_adjust: bool) -> None:
+        """
+        增量更新：只抓最後一筆日期往前 overlap 天之後的K棒並接回。
+        重疊區收盤價若與本地不符 (除權息/分割使還原價整段改寫)，改走整段下載。
+        """
+        stored = {s: self.read(s, auto_adjust) for s in symbols}
+        # 依最後K棒日期分組，每組一次批次請求 (每日刷新時通常只有一組)
+        groups: Dict[pd.Timestamp, List[str]] = {}
+        for s, (_, df) in stored.items():
+            groups.setdefault(df.index[-1], []).append(s)
+        fresh = {}
+        for last, syms in groups.items():
+            cut = last - pd.Timedelta(days=Config.PRICE_STORE_OVERLAP_DAYS)
+            fresh.update(self._download(syms, cut.strftime('%Y-%m-%d'), auto_adjust))
+
+        revised = []
+        for s, (meta, old) in stored.items():
+            new = fresh.get(s)
+            if new is None or new.empty:
+                # 無新K棒 (休市 / 暫時失敗)：僅更新時間戳，有效期內不重打
+                self.write(s, old, meta["since"], auto_adjust)
+                continue
+            common = old.index.intersection(new.index)
+            if len(common):
+                drift = (new.loc[common, 'Close'] / old.loc[common, 'Close'] - 1).abs().max()
+                if drift > _REVISION_TOL:
+                    revised.append(s)
+                    continue
+            merged = pd.concat([old[old.index < new.index[0]], new])
+            self.write(s, merged, meta["since"], auto_adjust)
+
+        if revised:
+            since = min(pd.Timestamp(stored[s][0]["since"]) for s in revised)
+            self._fetch_full(revised, since, auto_adjust)
+
+    def refresh(self, symbols: List[str], start: pd.Timestamp | None = None,
+                auto_adjust: bool = True) -> None:
+        """
+        更新指定代號 (不論是否過期)。已有且涵蓋 start 的走增量，其餘整段下載。
+        每日批次刷新股票池時直接呼叫，只會搬運最後幾天的K棒。
+        """
+        start = start if start is not None else period_to_start("max")
+        full, delta = [], []
+        for s in dict.fromkeys(x.upper() for x in symbols):
+            meta, df = self.read(s, auto_adjust)
+            if df is None or df.empty or not self._covers(meta, start):
+                full.append(s)
+            else:
+                delta.append(s)
+        if full:
+            self._fetch_full(full, start, auto_adjust)
+        if delta:
+            self._fetch_delta(delta, auto_adjust)
+
+    # ── 公開讀取 API ─────────────────────────────────────────
+    def get(self, symbol: str, period: str | None = None, start: str | None = None,
+            auto_adjust: bool = True) -> pd.DataFrame:
+        """取得單檔日K (已切片)。查無資料回傳空 DataFrame"""
+        return self.get_many([symbol], period=period, start=start,
+                             auto_adjust=auto_adjust).get(symbol, pd.DataFrame())
+
+    def get_many(self, symbols: List[str], period: str | None = None, start: str | None = None,
+                 auto_adjust: bool = True) -> Dict[str, pd.DataFrame]:
+        """
+        批次取得多檔日K。只有缺漏/過期的代號才會連網，且過期者只補抓最後幾天。
+        回傳 {symbol: DataFrame}，查無資料的代號不會出現在結果中。
+        """
+        want = pd.Timestamp(start) if start else period_to_start(period)
+        keys = {s: s.upper() for s in dict.fromkeys(symbols)}
+        stale = [k for k in dict.fromkeys(keys.values()) if self._needs_fetch(k, want, auto_adjust)]
+        if stale:
+            self.refresh(stale, start=want, auto_adjust=auto_adjust)
+
+        out = {}
+        for s, k in keys.items():
+            _, df = self.read(k, auto_adjust)
+            if df is None or df.empty:
+                continue
+            out[s] = df[df.index >= want].copy()
+        return out
+
+
+# ═══════════════════════════════════════════════════════════════
+#  上市/上櫃對照表 (Exchange Map)
+# ═══════════════════════════════════════════════════════════════
+
+class ExchangeMap:
+    """
+    台股代號 → 交易所後綴 (.TW / .TWO) 的持久化對照表。
+      resolved - 曾成功取得資料的後綴，優先嘗試；查無時改打另一個後綴並改記 (轉上市/上櫃、誤灌)
+      missing  - 兩個後綴皆查無的代號 (epoch 秒)，在 EXCHANGE_MISS_TTL 內不再重試
+    首次查詢成功時自動記錄，也可由 CB 清單的市場別欄位預先灌入。
+    """
+
+    def __init__(self, path: Path | str = EXCHANGE_MAP_PATH,
+                 miss_ttl: int = Config.EXCHANGE_MISS_TTL):
+        self.path = Path(path)
+        self.miss_ttl = miss_ttl
+        self._lock = threading.Lock()
+        self.resolved: Dict[str, str] = {}
+        self.missing: Dict[str, float] = {}
+        try:
+            data = json.loads(self.path.read_text(encoding='utf-8'))
+            self.resolved = dict(data.get("resolved", {}))
+            self.missing  = dict(data.get("missing", {}))
+        except (OSError, ValueError):
+            pass
+
+    def _save(self) -> None:
+        payload = json.dumps({"resolved": self.resolved, "missing": self.missing},
+                             ensure_ascii=False, indent=1)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(payload, encoding='utf-8')
+        os.replace(tmp, self.path)
+
+    def candidates(self, ticker: str) -> List[str]:
+        """依對照表排序候選：已知後綴排第一、另一後綴備援；近期確認查無 → 空清單；未知 → 雙軌"""
+        t = str(ticker).strip()
+        if not is_tw_code(t):
+            return yahoo_candidates(t)
+        with self._lock:
+            sfx = self.resolved.get(t)
+            missed = self.missing.get(t)
+        if sfx:
+            return [f"{t}{sfx}"] + [f"{t}{x}" for x in TW_SUFFIXES if x != sfx]
+        if missed and time.time() - missed < self.miss_ttl:
+            return []
+        return yahoo_candidates(t)
+
+    def learn(self, symbols: List[str]) -> None:
+        """記錄成功取得資料的完整代號 (如 6488.TWO)"""
+        changed = False
+        with self._lock:
+            for sym in symbols:
+                code, _, sfx = str(sym).strip().upper().partition('.')
+                sfx = f".{sfx}"
+                if sfx in TW_SUFFIXES and is_tw_code(code) and self.resolved.get(code) != sfx:
+                    self.resolved[code] = sfx
+                    self.missing.pop(code, None)
+                    changed = True
+            if changed:
+                self._save()
+
+    def forget(self, codes: List[str]) -> None:
+        """移除已失效的後綴記錄 (雙軌皆查無時)，之後回到未知狀態"""
+        with self._lock:
+            stale = [c for c in (str(x).strip() for x in codes) if self.resolved.pop(c, None)]
+            if stale:
+                self._save()
+
+    def mark_missing(self, codes: List[str]) -> None:
+        """記錄雙軌皆查無的代號"""
+        now = time.time()
+        with self._lock:
+            fresh = [c for c in (str(x).strip() for x in codes)
+                     if is_tw_code(c) and c not in self.resolved]
+            for c in fresh:
+                self.missing[c] = now
+            if fresh:
+                self._save()
+
+    def seed(self, mapping: Dict[str, str]) -> None:
+        """由外部來源 (如 CB 清單市場別) 預先灌入 {代號: '.TW' / '.TWO'}"""
+        self.learn([f"{code}{sfx}" for code, sfx in mapping.items() if sfx in TW_SUFFIXES])
+
+
+# ═══════════════════════════════════════════════════════════════
+#  共用實例 & 便利函式
+# ═══════════════════════════════════════════════════════════════
+
+_store: PriceStore | None = None
+_exchange_map: ExchangeMap | None = None
+_store_lock = threading.Lock()
+
+
+def get_price_store() -> PriceStore:
+    """行程內共用的 PriceStore (懶載入)"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = PriceStore()
+        return _store
+
+
+def get_exchange_map() -> ExchangeMap:
+    """行程內共用的上市/上櫃對照表 (懶載入)"""
+    global _exchange_map
+    with _store_lock:
+        if _exchange_map is None:
+            _exchange_map = ExchangeMap()
+        return _exchange_map
+
+
+def load_history(ticker: str, period: str | None = None, start: str | None = None,
+                 auto_adjust: bool = True) -> pd.DataFrame:
+    """依對照表/雙軌候選逐一讀取，回傳第一個有資料的日K；全數失敗回傳空 DataFrame"""
+    return load_history_many([ticker], period=period, start=start,
+                             auto_adjust=auto_adjust).get(str(ticker).strip(), pd.DataFrame())
+
+
+def load_history_many(tickers: List[str], period: str | None = None, start: str | None = None,
+                      auto_adjust: bool = True) -> Dict[str, pd.DataFrame]:
+    """
+    load_history 的批次版：依候選順位分輪，每輪把尚未取得的代號合併成一次批次下載。
+    已在對照表中的台股第一輪只打已知後綴，查無才在下一輪改打另一個；
+    未知者最多兩輪 (.TW → .TWO)。成功的後綴回寫對照表；已知代號雙軌皆查無時移除舊記錄。
+    回傳 {原始代號: DataFrame}，全數失敗者不列入。
+    """
+    store, xmap = get_price_store(), get_exchange_map()
+    pending = {}
+    for t in dict.fromkeys(str(x).strip() for x in tickers):
+        cands = xmap.candidates(t) if t else []
+        if cands:
+            pending[t] = cands
+    dual = [t for t, c in pending.items() if len(c) > 1]
+    known = {t for t in dual if xmap.resolved.get(t)}
+    out: Dict[str, pd.DataFrame] = {}
+    found = []
+    while pending:
+        round_map = {t: c[0] for t, c in pending.items()}
+        frames = store.get_many(list(dict.fromkeys(round_map.values())), period=period,
+                                start=start, auto_adjust=auto_adjust)
+        nxt = {}
+        for t, sym in round_map.items():
+            df = frames.get(sym)
+            if df is not None and not df.empty:
+                out[t] = df
+                found.append(sym)
+            elif len(pending[t]) > 1:
+                nxt[t] = pending[t][1:]
+        pending = nxt
+    xmap.learn(found)
+    # 同批有其他代號成功才記錄查無，避免斷線時把整批誤標
+    # 曾解析過的代號只移除舊後綴 (下次回到雙軌)，不直接標為查無
+    if found:
+        missed = [t for t in dual if t not in out]
+        xmap.forget([t for t in missed if t in known])
+        xmap.mark_missing([t for t in missed if t not in known])
+    return out
@@ -0,0 +1,81 @@
+# snapshot_store.py
+# Titan SOP V100.0 — Snapshot Store (預先計算結果倉庫)
+# 包含：具名結果的持久化 (pickle + .json 中繼資料)、新鮮度判斷、
+#       來源指紋比對 (同一份 CB 清單才沿用，指紋見 fingerprint.py)
+# 排程 (precompute.py) 寫入，UI 各分頁在快照夠新時直接讀取，不再現場重算。
+
+import json
+import os
+import pickle
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+from config import Config, DATA_DIR
+
+SNAPSHOT_DIR = DATA_DIR / "snapshots"
+
+
+class SnapshotStore:
+    """
+    每個快照一個 .pkl，旁附 .json 中繼資料：
+      created_at - 產生時間 (epoch 秒)
+      source     - 輸入資料指紋 (可選)，讀取時不符即視為不存在
+    """
+
+    def __init__(self, root: Path | str = SNAPSHOT_DIR, max_age: int = Config.SNAPSHOT_MAX_AGE):
+        self.root = Path(root)
+        self.max_age = max_age
+        self._lock = threading.Lock()
+
+    def _paths(self, name: str) -> tuple[Path, Path]:
+        safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in name)
+        return self.root / f"{safe}.pkl", self.root / f"{safe}.json"
+
+    def save(self, name: str, payload: Any, source: str | None = None) -> None:
+        path, meta_path = self._paths(name)
+        meta = {"name": name, "created_at": time.time(), "source": source}
+        self.root.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            for target, data in ((path, pickle.dumps(payload)),
+                                 (meta_path, json.dumps(meta).encode('utf-8'))):
+                tmp = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+                tmp.write_bytes(data)
+                os.replace(tmp, target)
+
+    def meta(self, name: str) -> dict:
+        _, meta_path = self._paths(name)
+        try:
+            return json.loads(meta_path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return {}
+
+    def load(self, name: str, max_age: int | None = None, source: str | None = None) -> Any:
+        """讀取快照；不存在、過期或來源指紋不符時回傳 None"""
+        meta = self.meta(name)
+        if not meta:
+            return None
+        age_limit = self.max_age if max_age is None else max_age
+        if time.time() - meta.get("created_at", 0) > age_limit:
+            return None
+        if source is not None and meta.get("source") != source:
+            return None
+        path, _ = self._paths(name)
+        try:
+            return pickle.loads(path.read_bytes())
+        except Exception:
+            return None
+
+
+_snapshots: SnapshotStore | None = None
+_snapshots_lock = threading.Lock()
+
+
+def get_snapshot_store() -> SnapshotStore:
+    """行程內共用的 SnapshotStore (懶載入)"""
+    global _snapshots
+    with _snapshots_lock:
+        if _snapshots is None:
+            _snapshots = SnapshotStore()
+        return _snapshots
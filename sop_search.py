@@ -0,0 +1,120 @@
+# sop_search.py
+# Titan SOP V100.0 — SOP Full-Text Search (戰略百科全文檢索)
+# 包含：中英混合斷詞 (CJK 二元組 + 英數字詞)、倒排索引、BM25 (Okapi) 排序
+# 不依賴 Streamlit，由 TitanKnowledgeBase.search() 與戰略百科搜尋框共用。
+
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+_TOKEN_RE = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+|[A-Za-z0-9]+(?:\.[0-9]+)?')
+_CJK_RE = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]')
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    中文連續字串切成相鄰二元組 (「亞當理論」→ 亞當 / 當理 / 理論)，單字則保留單字；
+    英數字轉小寫整詞保留 (87ma、cbas、5.3)。
+    """
+    tokens: List[str] = []
+    for run in _TOKEN_RE.findall(text or ""):
+        if _CJK_RE.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run.lower())
+    return tokens
+
+
+class BM25Index:
+    """
+    文件集合的倒排索引：token → posting list (文件序號, 詞頻)。
+    查詢時只走過查詢詞的 posting list，複雜度與命中文件數成正比，而非全庫。
+    idf 採 log(1 + (N - df + 0.5) / (df + 0.5))，恆為正值。
+    """
+
+    def __init__(self, docs: Iterable[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        vocab: Dict[str, int] = {}
+        tok_ids, doc_ids, tfs, lengths = [], [], [], []
+        for i, doc in enumerate(docs):
+            tf = Counter(tokenize(doc))
+            lengths.append(sum(tf.values()))
+            for tok, cnt in tf.items():
+                tok_ids.append(vocab.setdefault(tok, len(vocab)))
+                doc_ids.append(i)
+                tfs.append(cnt)
+
+        # CSR 排列：同一 token 的 (文件, 詞頻) 連續存放，posting list 即一段切片
+        order = np.argsort(np.asarray(tok_ids, dtype=np.int64), kind='stable')
+        self.doc_ids = np.asarray(doc_ids, dtype=np.int64)[order]
+        self.tfs = np.asarray(tfs, dtype=float)[order]
+        df = np.bincount(np.asarray(tok_ids, dtype=np.int64), minlength=len(vocab))
+        self.offsets = np.concatenate([[0], np.cumsum(df)])
+        self.vocab = vocab
+
+        self.n_docs = len(lengths)
+        self.doc_len = np.asarray(lengths, dtype=float)
+        self.avgdl = float(self.doc_len.mean()) if self.n_docs else 0.0
+        self.idf = np.log1p((self.n_docs - df + 0.5) / (df + 0.5))
+        # 長度正規化項預先算好：k1 * (1 - b + b * |d| / avgdl)
+        self._norm = self.k1 * (1 - self.b + self.b * self.doc_len / (self.avgdl or 1.0))
+
+    def scores(self, query: str) -> np.ndarray:
+        """每份文件對 query 的 BM25 分數 (未命中為 0)"""
+        out = np.zeros(self.n_docs)
+        for tok in dict.fromkeys(tokenize(query)):
+            j = self.vocab.get(tok)
+            if j is None:
+                continue
+            lo, hi = self.offsets[j], self.offsets[j + 1]
+            ids, tf = self.doc_ids[lo:hi], self.tfs[lo:hi]
+            out[ids] += self.idf[j] * tf * (self.k1 + 1) / (tf + self._norm[ids])
+        return out
+
+    def search(self, query: str, top_k: int = 10) -> List[Tuple[int, float]]:
+        """回傳分數最高的 top_k 筆 (文件序號, 分數)，只含分數 > 0 者"""
+        s = self.scores(query)
+        hit = np.flatnonzero(s > 0)
+        if hit.size == 0:
+            return []
+        top = hit[np.argsort(-s[hit], kind='stable')[:top_k]]
+        return [(int(i), float(s[i])) for i in top]
+
+
+def _flatten_text(value) -> str:
+    """巢狀 dict/list 內所有字串串接成一段文字"""
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, dict):
+        return "\n".join(t for t in (_flatten_text(v) for v in value.values()) if t)
+    if isinstance(value, list):
+        return "\n".join(t for t in (_flatten_text(v) for v in value) if t)
+    if value is None:
+        return ""
+    return str(value)
+
+
+def extract_passages(source: str, content: dict) -> List[Dict[str, str]]:
+    """
+    單筆 SOP 分析 → 檢索段落。每個章節的子欄位 / 清單項目各為一段：
+      {"source": 影片/文件來源, "section": 章節路徑, "text": 內文}
+    """
+    passages = []
+    for section, value in (content or {}).items():
+        if isinstance(value, dict):
+            parts = [(f"{section}.{k}", v) for k, v in value.items()]
+        elif isinstance(value, list):
+            parts = [(f"{section}[{i}]", v) for i, v in enumerate(value)]
+        else:
+            parts = [(section, value)]
+        for path, v in parts:
+            text = _flatten_text(v)
+            if text:
+                passages.append({"source": source, "section": path, "text": text})
+    return passages
@@ -5,11 +5,447 @@
 # 1. [SOP 驗證] 模擬「甜蜜點(106-110) 進場」與「152元 中位數出場」的績效。
 # 2. [紀律執行] 嚴格執行「跌破 87MA」停損邏輯。
 # 3. [報酬計算] 產出勝率、最大回撤 (MDD)、總報酬率。
+# 4. [V100 陣列核心] 進出場規則對 (entry/exit 布林陣列) → 狀態機持倉、交易明細、權益與回撤；
+#    安裝 Numba 時狀態機自動編譯，15 種均線戰法共用同一組均線一次算完。
+# 5. [V100 網格掃描] 多標的 × 多策略以 (日期, 策略, 標的) 矩陣一次廣播，產出 CAGR / MDD / Sharpe / Kelly 比較表。
+# 6. [V100 CB 組合回測] 逐日重播普查評分 (與 scan_entire_portfolio 共用 sop_score)，
+#    甜蜜點進場 / 152 停利 / 跌破 87MA 停損，限制持倉檔數並計入手續費與證交稅。
+
+from typing import Callable, Dict, List, Tuple
 
 import pandas as pd
 import numpy as np
-import yfinance as yf
 from config import Config
+from price_store import get_price_store, load_history_many
+from indicators import attach_ma, build_price_panel, ma_panel, rolling_mean_2d
+
+try:
+    from numba import njit
+    _HAS_NUMBA = True
+except ImportError:
+    _HAS_NUMBA = False
+
+
+# ═══════════════════════════════════════════════════════════════
+#  狀態機核心 (entry / exit 規則對 → 持倉)
+# ═══════════════════════════════════════════════════════════════
+
+def _position_kernel(entry: np.ndarray, exit_: np.ndarray, start: int) -> np.ndarray:
+    """(T, K) 規則矩陣逐欄逐棒：空手時看 entry、持倉時看 exit；回傳收盤後持倉 (0/1)"""
+    n, k = entry.shape
+    pos = np.zeros((n, k), dtype=np.int8)
+    for j in range(k):
+        state = 0
+        for i in range(start, n):
+            if state == 0:
+                if entry[i, j]:
+                    state = 1
+            elif exit_[i, j]:
+                state = 0
+            pos[i, j] = state
+    return pos
+
+
+if _HAS_NUMBA:
+    _position_kernel = njit(cache=True)(_position_kernel)
+
+
+def _position_steps(entry: np.ndarray, exit_: np.ndarray, start: int) -> np.ndarray:
+    """無 Numba 時的逐棒推進：每根 K 棒一次處理所有欄"""
+    pos = np.zeros(entry.shape, dtype=np.int8)
+    state = np.zeros(entry.shape[1], dtype=bool)
+    for i in range(start, entry.shape[0]):
+        state = np.where(state, ~exit_[i], entry[i])
+        pos[i] = state
+    return pos
+
+
+def run_state_machine(entry: np.ndarray, exit_: np.ndarray, start: int = 0) -> np.ndarray:
+    """
+    規則對 → 持倉陣列，接受 (T,) 或 (T, K)。entry 與 exit 不會同時成立的欄，持倉即
+    「最後一次訊號」的前向填補，直接向量化求解；兩者可能同時成立
+    (例如 P>20MA 進 / P<60MA 出) 的欄才走逐棒狀態機。
+    """
+    entry = np.asarray(entry, dtype=bool)
+    flat = entry.ndim == 1
+    entry = entry.reshape(len(entry), -1).copy()
+    exit_ = np.asarray(exit_, dtype=bool).reshape(entry.shape).copy()
+    entry[:start] = False
+    exit_[:start] = False
+    if _HAS_NUMBA:
+        pos = _position_kernel(entry, exit_, start)
+    else:
+        event = entry | exit_
+        last = np.maximum.accumulate(np.where(event, np.arange(len(event))[:, None], -1), axis=0)
+        pos = ((last >= 0) & np.take_along_axis(entry, np.maximum(last, 0), axis=0)).astype(np.int8)
+        both = np.flatnonzero(np.any(entry & exit_, axis=0))
+        if both.size:
+            pos[:, both] = _position_steps(entry[:, both], exit_[:, both], start)
+    return pos[:, 0] if flat else pos
+
+
+def extract_trades(position: np.ndarray, close: np.ndarray, index=None) -> pd.DataFrame:
+    """持倉陣列 → 已平倉交易明細 (進場/出場皆以當根收盤價成交)"""
+    d = np.diff(np.concatenate([[0], position.astype(np.int8)]))
+    entries = np.flatnonzero(d == 1)
+    exits = np.flatnonzero(d == -1)
+    entries = entries[:len(exits)]
+    idx = index if index is not None else np.arange(len(close))
+    entry_px, exit_px = close[entries], close[exits]
+    return pd.DataFrame({
+        "entry_date": np.asarray(idx)[entries], "exit_date": np.asarray(idx)[exits],
+        "entry_price": entry_px, "exit_price": exit_px,
+        "roi": (exit_px - entry_px) / entry_px,
+    })
+
+
+def equity_curve(position: np.ndarray, close: np.ndarray,
+                 initial_capital: float = 1_000_000) -> Tuple[np.ndarray, np.ndarray]:
+    """前一根收盤持倉 × 當根漲跌幅 → (權益, 回撤)"""
+    ret = np.zeros(len(close))
+    if len(close) > 1:
+        ret[1:] = position[:-1] * (close[1:] / close[:-1] - 1)
+    ret = np.nan_to_num(ret)
+    equity = np.cumprod(1 + ret) * initial_capital
+    drawdown = equity / np.maximum.accumulate(equity) - 1
+    return equity, drawdown
+
+
+# ═══════════════════════════════════════════════════════════════
+#  15 種均線戰法 (MA Strategy Lab)
+# ═══════════════════════════════════════════════════════════════
+
+MA_LAB_WINDOWS = (20, 43, 60, 87, 284)
+
+# 名稱 → (entry, exit) 規則；c 為收盤價、m 為 {window: 均線}。NaN 比較為 False。
+Rule = Callable[[np.ndarray, Dict[int, np.ndarray]], Tuple[np.ndarray, np.ndarray]]
+
+
+def _above(fast: Callable, slow: Callable) -> Rule:
+    """狀態型策略：條件成立即持有，不成立即出場"""
+    def rule(c, m):
+        with np.errstate(invalid='ignore'):
+            cond = fast(c, m) > slow(c, m)
+        return cond, ~cond
+    return rule
+
+
+_P = lambda c, m: c
+_MA = lambda w: (lambda c, m: m[w])
+
+MA_LAB_RULES: Dict[str, Rule] = {
+    "價格 > 20MA":  _above(_P, _MA(20)),
+    "價格 > 43MA":  _above(_P, _MA(43)),
+    "價格 > 60MA":  _above(_P, _MA(60)),
+    "價格 > 87MA":  _above(_P, _MA(87)),
+    "價格 > 284MA": _above(_P, _MA(284)),
+    "非對稱: P>20進 / P<60出": lambda c, m: (c > m[20], c < m[60]),
+    "20/60 黃金/死亡交叉":  _above(_MA(20), _MA(60)),
+    "20/87 黃金/死亡交叉":  _above(_MA(20), _MA(87)),
+    "20/284 黃金/死亡交叉": _above(_MA(20), _MA(284)),
+    "43/87 黃金/死亡交叉":  _above(_MA(43), _MA(87)),
+    "43/284 黃金/死亡交叉": _above(_MA(43), _MA(284)),
+    "60/87 黃金/死亡交叉":  _above(_MA(60), _MA(87)),
+    "60/284 黃金/死亡交叉": _above(_MA(60), _MA(284)),
+    "🔥 核心戰法: 87MA ↗ 284MA": _above(_MA(87), _MA(284)),
+    "雙確認: P>20 & P>60 進 / P<60 出": lambda c, m: ((c > m[20]) & (c > m[60]), c < m[60]),
+}
+
+
+def _align_right(frames: Dict[str, pd.DataFrame], field: str = 'Close') -> Tuple[np.ndarray, np.ndarray]:
+    """
+    多檔日K 靠底對齊成 (T, N) 矩陣，上方不足處補 NaN；回傳 (矩陣, 各檔筆數)。
+    每欄即該檔自己的交易日序列，均線 / 報酬與逐檔計算完全相同 (不受他檔休市日影響)。
+    """
+    lengths = np.array([len(df) for df in frames.values()], dtype=np.int64)
+    out = np.full((int(lengths.max()) if len(lengths) else 0, len(frames)), np.nan)
+    for j, df in enumerate(frames.values()):
+        if len(df):
+            out[-len(df):, j] = df[field].to_numpy(dtype=float)
+    return out, lengths
+
+
+def ma_sweep(frames: Dict[str, pd.DataFrame], strategies: List[str] | None = None,
+             initial_capital: float = 1_000_000) -> List[Dict]:
+    """
+    多標的 × 多均線戰法一次回測：每檔只讀一次、均線只算一次，
+    所有 (日期, 策略, 標的) 以 (T, S, N) 矩陣廣播計算。
+    每組回傳 ticker / strategy_name / cagr / final_equity / max_drawdown / future_10y_capital /
+    num_years / sharpe_ratio / win_rate / profit_factor / kelly / latest_price /
+    equity_curve / drawdown_series / trades。
+    """
+    frames = {t: df for t, df in frames.items() if df is not None and len(df) > 1}
+    names = list(strategies or MA_LAB_RULES)
+    if not frames or not names:
+        return []
+    close, n_obs = _align_right(frames)
+    T, N, S = close.shape[0], close.shape[1], len(names)
+    has_ret = np.arange(T)[:, None] > (T - n_obs)[None, :]           # (T, N) 各檔第二根起
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mas = {w: rolling_mean_2d(close, w) for w in MA_LAB_WINDOWS}
+        rules = [MA_LAB_RULES[name](close, mas) for name in names]
+        entry = np.stack([e for e, _ in rules], axis=1).reshape(T, S * N)
+        exit_ = np.stack([x for _, x in rules], axis=1).reshape(T, S * N)
+        pos = run_state_machine(entry, exit_, start=1).reshape(T, S, N)
+
+        # 前一根收盤持倉 × 當根漲跌幅；各檔第一根 (前一根為 NaN) 報酬為 0
+        pct = np.zeros((T, N))
+        pct[1:] = np.nan_to_num(close[1:] / close[:-1] - 1)
+        ret = np.zeros((T, S, N))
+        ret[1:] = pos[:-1] * pct[1:, None, :]
+        equity = np.cumprod(1 + ret, axis=0) * initial_capital
+        drawdown = equity / np.maximum.accumulate(equity, axis=0) - 1
+
+        num_years = n_obs / 252
+        cagr = (equity[-1] / initial_capital) ** (1 / num_years) - 1  # (S, N)
+
+        # 日報酬統計 (扣除各檔第一根)：Sharpe 與持倉日勝率 / 賺賠比 / 凱利
+        n_ret = (n_obs - 1).astype(float)
+        mean = ret.sum(axis=0) / n_ret
+        dev = np.where(has_ret[:, None, :], ret - mean, 0.0)
+        std = np.sqrt((dev ** 2).sum(axis=0) / (n_ret - 1))
+        sharpe = np.where(std > 0, (mean * 252 - 0.02) / (std * np.sqrt(252)), 0.0)
+
+        held = np.zeros((T, S, N), dtype=bool)
+        held[1:] = pos[:-1] == 1
+        n_held = held.sum(axis=0)
+        win, loss = held & (ret > 0), held & (ret < 0)
+        n_win, n_loss = win.sum(axis=0), loss.sum(axis=0)
+        avg_win = np.where(n_win > 0, np.where(win, ret, 0).sum(axis=0) / n_win, 0.0)
+        avg_loss = np.where(n_loss > 0, np.abs(np.where(loss, ret, 0).sum(axis=0) / n_loss), 1.0)
+        win_rate = n_win / np.maximum(n_held, 1)
+        pf = np.where(avg_loss != 0, avg_win / avg_loss, 0.0)
+        kelly = np.where(pf > 0, np.maximum(0, win_rate - (1 - win_rate) / np.where(pf > 0, pf, 1)), 0.0)
+        enough = n_held >= 10
+        win_rate, pf, kelly = (np.where(enough, x, 0.0) for x in (win_rate, pf, kelly))
+
+    results = []
+    for j, (ticker, df) in enumerate(frames.items()):
+        rows = slice(T - n_obs[j], T)
+        for k, name in enumerate(names):
+            results.append({
+                "ticker": ticker, "strategy_name": name, "cagr": cagr[k, j],
+                "final_equity": equity[-1, k, j],
+                "max_drawdown": drawdown[rows, k, j].min(),
+                "future_10y_capital": initial_capital * ((1 + cagr[k, j]) ** 10),
+                "num_years": num_years[j],
+                "sharpe_ratio": sharpe[k, j], "win_rate": win_rate[k, j],
+                "profit_factor": pf[k, j], "kelly": kelly[k, j],
+                "latest_price": float(close[-1, j]),
+                "equity_curve": pd.Series(equity[rows, k, j], index=df.index, name='Equity'),
+                "drawdown_series": pd.Series(drawdown[rows, k, j], index=df.index, name='Drawdown'),
+                "trades": extract_trades(pos[rows, k, j], close[rows, j], df.index),
+            })
+    return results
+
+
+def sweep_table(results: List[Dict]) -> pd.DataFrame:
+    """ma_sweep 結果 → 標的 × 策略比較表 (CAGR / MDD / Sharpe / Kelly …)"""
+    cols = ["ticker", "strategy_name", "cagr", "max_drawdown", "sharpe_ratio", "kelly",
+            "win_rate", "profit_factor", "final_equity", "future_10y_capital", "num_years"]
+    return pd.DataFrame([{c: r[c] for c in cols} for r in results], columns=cols)
+
+
+def ma_lab_backtest(df: pd.DataFrame, strategies: List[str] | None = None,
+                    initial_capital: float = 1_000_000) -> List[Dict]:
+    """單一標的日K 跑多個均線戰法 (預設全部 15 種)；ma_sweep 的單檔版"""
+    return ma_sweep({"_": df}, strategies, initial_capital)
+
+
+# ═══════════════════════════════════════════════════════════════
+#  CB 組合回測 (Cross-sectional CB Portfolio Replay)
+# ═══════════════════════════════════════════════════════════════
+
+def build_cb_panels(history: pd.DataFrame, stock_frames: Dict[str, pd.DataFrame] | None = None) -> Dict:
+    """
+    逐日 CB 清單 (long format：date + load_cb_data_from_upload 標準欄位) → 對齊的 (T, N) 陣列。
+    回傳 dates / static (每檔最後一筆 name, code, stock_code, list_date, put_date) 以及
+    price (CB 收盤，當日無報價為 NaN) / stock_price / ma87 / ma284 / is_recent_breakout /
+    premium / converted_ratio / avg_volume，欄位算法與 scan_entire_portfolio 相同。
+    stock_frames 省略時以 load_history_many 批次讀取標的股日K (多抓 2 年供 284MA 暖機)。
+    """
+    h = history.copy()
+    h['date'] = pd.to_datetime(h['date']).dt.normalize()
+    h['code'] = h['code'].astype(str).str.strip()
+    h = h.sort_values('date', kind='stable').drop_duplicates(['date', 'code'], keep='last')
+    dates = pd.DatetimeIndex(sorted(h['date'].unique()))
+    codes = list(dict.fromkeys(h['code']))
+
+    def _panel(col: str, ffill: bool = False) -> np.ndarray:
+        if col not in h.columns:
+            return np.full((len(dates), len(codes)), np.nan)
+        p = h.pivot(index='date', columns='code', values=col).reindex(index=dates, columns=codes)
+        p = p.apply(pd.to_numeric, errors='coerce')
+        return (p.ffill() if ffill else p).to_numpy(dtype=float)
+
+    static = (h.groupby('code', sort=False).last()
+              .reindex(codes).reset_index()
+              .reindex(columns=['code', 'name', 'stock_code', 'list_date', 'put_date']))
+    static['stock_code'] = static['stock_code'].astype(str).str.strip()
+
+    price = _panel('close')
+    conv = _panel('conversion_price', ffill=True)
+    ratio = _panel('converted_ratio', ffill=True)
+    if np.isnan(ratio).all():
+        outstanding, issue = _panel('outstanding_balance', ffill=True), _panel('issue_amount', ffill=True)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ratio = np.where(issue > 0, (1 - outstanding / issue) * 100, 0.0)
+    ratio = np.clip(np.nan_to_num(ratio), 0, 100)
+    avg_volume = np.nan_to_num(_panel('avg_volume'))
+
+    # --- 標的股：87/284 生命線與近期突破，對齊到 CB 交易日 ---
+    stocks = list(dict.fromkeys(static['stock_code']))
+    if stock_frames is None:
+        start = (dates[0] - pd.DateOffset(years=2)).strftime('%Y-%m-%d') if len(dates) else None
+        stock_frames = load_history_many(stocks, start=start)
+    close = build_price_panel({k: v for k, v in stock_frames.items() if k in stocks})
+    stock_cols = {}
+    if not close.empty:
+        mas = ma_panel(close)
+        lag = close.ffill().shift(4)   # 與 ma_snapshot 相同：今收站上 87MA 且 5 根前仍在其下
+        with np.errstate(invalid='ignore'):
+            breakout = (close > mas[Config.MA_LIFE_LINE]) & (lag < mas[Config.MA_LIFE_LINE])
+        for name, frame in (('stock_price', close), ('ma87', mas[Config.MA_LIFE_LINE]),
+                            ('ma284', mas[Config.MA_LONG_TERM]), ('is_recent_breakout', breakout)):
+            aligned = frame.astype(float).reindex(frame.index.union(dates)).ffill().reindex(dates)
+            stock_cols[name] = aligned.reindex(columns=static['stock_code']).to_numpy(dtype=float)
+    for name in ('stock_price', 'ma87', 'ma284', 'is_recent_breakout'):
+        stock_cols.setdefault(name, np.full((len(dates), len(codes)), np.nan))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        parity = np.where(conv > 0, stock_cols['stock_price'] / conv * 100, 0.0)
+        premium = np.where(parity > 0, (price - parity) / parity * 100, 0.0)
+    return {
+        'dates': dates, 'static': static, 'price': price,
+        'stock_price': stock_cols['stock_price'], 'ma87': stock_cols['ma87'], 'ma284': stock_cols['ma284'],
+        'is_recent_breakout': stock_cols['is_recent_breakout'] == 1,
+        'premium': np.nan_to_num(premium), 'converted_ratio': ratio, 'avg_volume': avg_volume,
+    }
+
+
+class CBPortfolioBacktester:
+    """
+    SOP 組合回測：每日收盤重播普查評分，隔日收盤執行 (避免前視)。
+      進場：操作建議為買進 (價格濾網 + 87/284 多頭 + 分數 ≥ 60) 且 CB 價格位於甜蜜點
+      出場：CB ≥ EXIT_TARGET_MEDIAN 停利、標的股跌破 87MA 停損、停止報價 (下市/到期) 以最後報價出清
+    每檔新倉投入 權益 / max_positions (現金不足則平分剩餘現金)，同日候選依分數高低補滿空位。
+    """
+
+    SCAN_COLS = ('price', 'stock_price', 'ma87', 'ma284', 'is_recent_breakout',
+                 'premium', 'converted_ratio', 'avg_volume')
+
+    def __init__(self, initial_capital: float = 1_000_000, max_positions: int | None = None,
+                 fee_rate: float | None = None, tax_rate: float | None = None, strategy=None):
+        self.initial_capital = initial_capital
+        self.max_positions = max_positions or Config.CB_BT_MAX_POSITIONS
+        self.fee_rate = Config.CB_BT_FEE_RATE if fee_rate is None else fee_rate
+        self.tax_rate = Config.CB_BT_TAX_RATE if tax_rate is None else tax_rate
+        self._strategy = strategy
+
+    @property
+    def strategy(self):
+        if self._strategy is None:
+            from strategy import TitanStrategyEngine
+            self._strategy = TitanStrategyEngine()
+        return self._strategy
+
+    def run(self, history: pd.DataFrame, stock_frames: Dict[str, pd.DataFrame] | None = None) -> Dict:
+        """逐日 CB 清單 → 組合回測結果 (見 simulate)"""
+        panels = build_cb_panels(history, stock_frames)
+        score, buy_ok = self.strategy.score_history(
+            panels['static'], panels['dates'], {k: panels[k] for k in self.SCAN_COLS})
+        return self.simulate(panels, score, buy_ok)
+
+    def run_from_archive(self, start=None, end=None, stock_frames: Dict[str, pd.DataFrame] | None = None) -> Dict:
+        """以 cb_archive 的歷史上傳清單回放 (每日採當天最後一份快照)；區間內沒有快照時拋出 ValueError"""
+        from cb_archive import get_cb_archive
+        history = get_cb_archive().history(start, end, kind="upload")
+        if history.empty or 'code' not in history.columns:
+            raise ValueError(f"CB 快照庫在 {start or '最早'} ~ {end or '最新'} 之間沒有上傳清單，無法回放")
+        return self.run(history, stock_frames)
+
+    def simulate(self, panels: Dict, score: np.ndarray, buy_ok: np.ndarray) -> Dict:
+        """
+        對齊陣列上的逐日撮合；每日只做 (N,) 向量運算。回傳：
+          equity / drawdown / positions (Series)、trades (DataFrame)、
+          cagr / max_drawdown / sharpe_ratio / win_rate / n_trades / avg_hold_days / final_equity
+        """
+        dates, static, price = panels['dates'], panels['static'], panels['price']
+        T, N = price.shape
+        with np.errstate(invalid='ignore'):
+            entry_sig = buy_ok & (price >= Config.SWEET_SPOT_LOW) & (price <= Config.SWEET_SPOT_HIGH)
+            take_profit = price >= Config.EXIT_TARGET_MEDIAN
+            stop_loss = panels['stock_price'] < panels['ma87']
+        mark = pd.DataFrame(price).ffill().to_numpy()
+        quoted = ~np.isnan(price)
+        last_quote = np.where(quoted.any(axis=0), T - 1 - np.argmax(quoted[::-1], axis=0), -1)
+
+        cash = float(self.initial_capital)
+        units = np.zeros(N)
+        cost = np.zeros(N)
+        entry_t = np.full(N, -1)
+        equity = np.full(T, cash)
+        n_pos = np.zeros(T, dtype=int)
+        trades = []
+        buy_cost, sell_keep = 1 + self.fee_rate, 1 - self.fee_rate - self.tax_rate
+
+        for t in range(1, T):
+            held = units > 0
+            # --- 出場 (前一日收盤訊號，今日收盤成交) ---
+            tp, sl = held & quoted[t] & take_profit[t - 1], held & quoted[t] & stop_loss[t - 1]
+            gone = held & (t > last_quote)
+            for j in np.flatnonzero(tp | sl | gone):
+                px = price[t, j] if quoted[t, j] else mark[t, j]
+                proceeds = units[j] * px * sell_keep
+                cash += proceeds
+                reason = ("🎯 達 152 中位數停利" if tp[j] else "🛑 跌破87MA (Stop Loss)" if sl[j]
+                          else "⏹️ 停止報價 (下市/到期)")
+                trades.append({
+                    "code": static['code'].iat[j], "name": static['name'].iat[j],
+                    "entry_date": dates[entry_t[j]], "exit_date": dates[t],
+                    "entry_price": cost[j] / units[j] / buy_cost, "exit_price": px,
+                    "roi": proceeds / cost[j] - 1, "hold_days": t - entry_t[j], "reason": reason,
+                })
+                units[j] = cost[j] = 0.0
+                entry_t[j] = -1
+
+            # --- 進場：空位依前一日分數高低補滿 ---
+            held = units > 0
+            slots = self.max_positions - int(held.sum())
+            cand = np.flatnonzero(entry_sig[t - 1] & ~held & quoted[t])
+            if slots > 0 and cand.size and cash > 0:
+                pick = cand[np.argsort(-score[t - 1, cand], kind='stable')[:slots]]
+                total = cash + float(np.nansum(units * mark[t]))
+                alloc = min(total / self.max_positions, cash / len(pick))
+                units[pick] = alloc / (price[t, pick] * buy_cost)
+                cost[pick] = alloc
+                entry_t[pick] = t
+                cash -= alloc * len(pick)
+
+            equity[t] = cash + float(np.nansum(units * mark[t]))
+            n_pos[t] = int((units > 0).sum())
+
+        drawdown = equity / np.maximum.accumulate(equity) - 1
+        daily = np.diff(equity) / equity[:-1] if T > 1 else np.zeros(0)
+        years = T / 252
+        std = daily.std(ddof=1) if len(daily) > 1 else 0.0
+        trades_df = pd.DataFrame(trades, columns=["code", "name", "entry_date", "exit_date", "entry_price",
+                                                  "exit_price", "roi", "hold_days", "reason"])
+        return {
+            "equity": pd.Series(equity, index=dates, name='Equity'),
+            "drawdown": pd.Series(drawdown, index=dates, name='Drawdown'),
+            "positions": pd.Series(n_pos, index=dates, name='Positions'),
+            "trades": trades_df,
+            "final_equity": equity[-1] if T else self.initial_capital,
+            "cagr": (equity[-1] / self.initial_capital) ** (1 / years) - 1 if T else 0.0,
+            "max_drawdown": drawdown.min() if T else 0.0,
+            "sharpe_ratio": (daily.mean() * 252 - 0.02) / (std * np.sqrt(252)) if std > 0 else 0.0,
+            "win_rate": float((trades_df['roi'] > 0).mean()) if len(trades_df) else 0.0,
+            "n_trades": len(trades_df),
+            "avg_hold_days": float(trades_df['hold_days'].mean()) if len(trades_df) else 0.0,
+        }
+
 
 class TitanBacktestEngine:
     def __init__(self):
@@ -18,49 +454,26 @@ class TitanBacktestEngine:
         self.history = []
         
     def fetch_history(self, ticker: str, period="2y") -> pd.DataFrame:
-        df = yf.download(ticker, period=period, progress=False)
+        df = get_price_store().get(ticker, period=period)
         if not df.empty:
-            df['MA87'] = df['Close'].rolling(Config.MA_LIFE_LINE).mean()
+            attach_ma(df, windows=(Config.MA_LIFE_LINE,))
         return df
 
     def run_simulation(self, ticker: str, cb_name: str):
         print(f"🔄 正在回測 {cb_name} ({ticker})...")
         df = self.fetch_history(ticker, period="1y") # Fetch 1 year of data as requested
         
-        in_position = False
-        entry_price = 0
-        entry_date = None
-        
-        trades = []
-        
-        for date, row in df.iterrows():
-            close = row['Close']
-            ma87 = row['MA87']
-            
-            if np.isnan(ma87): continue
-            
-            if not in_position:
-                # Entry condition: Price is above 87MA
-                if close > ma87:
-                    entry_price = close
-                    entry_date = date
-                    in_position = True
-            
-            elif in_position:
-                # Exit condition: Price drops below 87MA
-                if close < ma87:
-                    roi = (close - entry_price) / entry_price
-                    trades.append({
-                        "entry_date": entry_date,
-                        "exit_date": date,
-                        "entry_price": entry_price,
-                        "exit_price": close,
-                        "roi": roi,
-                        "reason": "🛑 跌破87MA (Stop Loss)"
-                    })
-                    in_position = False
-        
-        return pd.DataFrame(trades)
+        if df.empty:
+            return pd.DataFrame()
+
+        # 進場：收盤站上 87MA；出場：收盤跌破 87MA (87MA 尚未成形的 K 棒維持原狀態)
+        close = df['Close'].to_numpy(dtype=float)
+        ma87 = df['MA87'].to_numpy(dtype=float)
+        with np.errstate(invalid='ignore'):
+            pos = run_state_machine(close > ma87, close < ma87)
+        trades = extract_trades(pos, close, df.index)
+        trades["reason"] = "🛑 跌破87MA (Stop Loss)"
+        return trades
 
     def generate_report(self, trades_df: pd.DataFrame):
         if trades_df.empty:
@@ -3,13 +3,95 @@
 # 狀態: 核心大腦 (存放所有策略定義與邏輯)
 # [V71.0 Audit]: Added get_advanced_theory_text() to extract specific theoretical texts for the new Window 14. No other changes needed.
 
+import hashlib
 import json
 import os
 import re
-from typing import Dict, List, Set, Tuple
+import threading
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sop_search import BM25Index, extract_passages
+
+
+class BellwetherMatcher:
+    """
+    領頭羊名稱/代號的多字串比對器 (Aho–Corasick 自動機)。
+    載入資料庫時建一次，之後每個字串只需掃描一遍，與領頭羊數量無關。
+    多個關鍵字同時命中時，回傳加入順序最早者 (與逐一 `k in text` 的舊結果一致)。
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns: List[str] = []
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._best: List[int] = [-1]        # 該狀態 (含 fail 鏈) 可命中的最早關鍵字序號
+        for p in patterns:
+            self._add(p)
+        self._build()
+
+    def _add(self, pattern: str) -> None:
+        if not pattern:
+            return
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._best.append(-1)
+            node = nxt
+        if self._best[node] == -1:
+            self._best[node] = len(self.patterns)
+        self.patterns.append(pattern)
+
+    def _build(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                inherited = self._best[self._fail[nxt]]
+                if inherited != -1 and (self._best[nxt] == -1 or inherited < self._best[nxt]):
+                    self._best[nxt] = inherited
+                queue.append(nxt)
+
+    def first_match(self, text: str) -> Optional[str]:
+        """text 中出現的關鍵字裡，加入順序最早的一個；沒有則回傳 None"""
+        best = -1
+        node = 0
+        for ch in text:
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            hit = self._best[node]
+            if hit != -1 and (best == -1 or hit < best):
+                best = hit
+                if best == 0:
+                    break
+        return self.patterns[best] if best != -1 else None
+
+    def tag(self, values: Iterable) -> List[Optional[str]]:
+        """整欄批次比對 (重複值只掃一次)，回傳與輸入等長的命中關鍵字清單"""
+        values = [str(v) for v in values]
+        cache = {v: self.first_match(v) for v in dict.fromkeys(values)}
+        return [cache[v] for v in values]
+
+
+# 編譯快照：解析後的衍生結構 (族群/領頭羊/題材/策略文字/隱藏心法)，
+# 以來源 JSON 的 SHA-1 作為指紋，資料庫一改即自動失效重建
+KB_SNAPSHOT_VERSION = 2
+_KB_FIELDS = ('sector_bellwether_map', 'bellwethers', 'stock_stories', 'full_strategy_text',
+              'time_arbitrage_events', 'hidden_strategies', 'general_issuance_stories', 'passages')
+
 
 class TitanKnowledgeBase:
-    def __init__(self, db_path='full_sop_database.json'):
+    def __init__(self, db_path='full_sop_database.json', use_snapshot: bool = True):
         self.db_path = db_path
         self.config = None # 延後載入 Config
         
@@ -24,7 +106,16 @@ class TitanKnowledgeBase:
         self.hidden_strategies: Set[str] = set()
         self.general_issuance_stories: Set[str] = set()
 
-        self._load_database()
+        # --- 全文檢索段落 (每筆 SOP 的各章節) ---
+        self.passages: List[Dict[str, str]] = []
+        self._search_index: Optional[BM25Index] = None
+
+        if not (use_snapshot and self._load_snapshot()):
+            self._load_database()
+            if use_snapshot:
+                self._save_snapshot()
+        # 領頭羊與題材共用同一組關鍵字 (stock_stories 的鍵 = bellwethers)
+        self.bellwether_matcher = BellwetherMatcher(self.stock_stories.keys())
 
     def _load_database(self):
         """解析 JSON 資料庫，完整提取所有欄位，絕不閹割"""
@@ -36,12 +127,18 @@ class TitanKnowledgeBase:
             with open(self.db_path, 'r', encoding='utf-8') as f:
                 data = json.load(f)
             
+            seen_passages: Set[str] = set()
             for entry in data:
                 try:
                     # 處理巢狀 JSON 字串
                     raw = entry.get('analysis')
                     content = json.loads(raw) if isinstance(raw, str) else raw
                     
+                    for p in extract_passages(entry.get('source', ''), content):
+                        if p['text'] not in seen_passages:
+                            seen_passages.add(p['text'])
+                            self.passages.append(p)
+
                     # --- A. 提取族群與領頭羊 (建立關聯) ---
                     ind = content.get('industry_and_story', {})
                     sectors = []
@@ -113,6 +210,42 @@ class TitanKnowledgeBase:
         except Exception as e:
             print(f"KB Error: {e}")
 
+    # --- 編譯快照 ---
+    def _source_hash(self) -> str:
+        h = hashlib.sha1(f"v{KB_SNAPSHOT_VERSION}|".encode('utf-8'))
+        with open(self.db_path, 'rb') as f:
+            h.update(f.read())
+        return h.hexdigest()
+
+    def _snapshot_name(self) -> str:
+        return f"kb_{os.path.splitext(os.path.basename(self.db_path))[0]}"
+
+    def _load_snapshot(self) -> bool:
+        """來源指紋相符時直接載入編譯快照，成功回傳 True"""
+        if not os.path.exists(self.db_path):
+            return False
+        try:
+            from snapshot_store import get_snapshot_store
+            compiled = get_snapshot_store().load(self._snapshot_name(), max_age=float('inf'),
+                                                 source=self._source_hash())
+        except Exception:
+            return False
+        if not isinstance(compiled, dict) or not all(k in compiled for k in _KB_FIELDS):
+            return False
+        for k in _KB_FIELDS:
+            setattr(self, k, compiled[k])
+        return True
+
+    def _save_snapshot(self) -> None:
+        if not os.path.exists(self.db_path):
+            return
+        try:
+            from snapshot_store import get_snapshot_store
+            get_snapshot_store().save(self._snapshot_name(), {k: getattr(self, k) for k in _KB_FIELDS},
+                                      source=self._source_hash())
+        except Exception as e:
+            print(f"KB Snapshot Error: {e}")
+
     def get_all_rules_for_ui(self) -> Dict:
         """[V62.0] 提取所有規則，用於 UI 百科全書"""
         return {
@@ -129,6 +262,19 @@ class TitanKnowledgeBase:
             "special_tactics": sorted(list(self.hidden_strategies))
         }
 
+    def search(self, query: str, top_k: int = 10) -> List[Dict]:
+        """
+        SOP 全文檢索 (BM25)。回傳依相關度排序的段落：
+          {"source", "section", "text", "score"}
+        索引於第一次查詢時建立。
+        """
+        if not query or not query.strip():
+            return []
+        if self._search_index is None:
+            self._search_index = BM25Index(p['text'] for p in self.passages)
+        return [dict(self.passages[i], score=round(score, 3))
+                for i, score in self._search_index.search(query, top_k)]
+
     def get_advanced_theory_text(self) -> Dict[str, str]:
         """[V71.0] 提取高階理論的文字描述"""
         adam_theory_texts = []
@@ -146,12 +292,16 @@ class TitanKnowledgeBase:
 
     def is_bellwether(self, name_or_code: str) -> bool:
         """判斷是否為領頭羊 (核心邏輯)"""
-        for b in self.bellwethers:
-            if b in name_or_code: return True
-        return False
+        return self.bellwether_matcher.first_match(name_or_code) is not None
+
+    def tag_bellwethers(self, values: Iterable) -> List[bool]:
+        """整欄名稱/代號一次判斷是否為領頭羊"""
+        return [m is not None for m in self.bellwether_matcher.tag(values)]
 
-    def analyze_sector_role(self, name: str, code: str, sector: str, my_price: float, sector_prices: List[float]) -> Dict:
-        is_leader = self.is_bellwether(name) or self.is_bellwether(code)
+    def analyze_sector_role(self, name: str, code: str, sector: str, my_price: float, sector_prices: List[float],
+                            is_leader: Optional[bool] = None) -> Dict:
+        if is_leader is None:
+            is_leader = self.is_bellwether(name) or self.is_bellwether(code)
         
         if is_leader:
             return {
@@ -186,10 +336,19 @@ class TitanKnowledgeBase:
             "granville_sell": "📉 格蘭碧賣點：正乖離過大 (賣4) 或 跌破後反彈不過 (賣2)。"
         }
 
+    def analyze_sector_roles(self, names: Iterable, codes: Iterable, prices: Iterable[float]) -> List[Dict]:
+        """整份清單的族群角色 (無同族群價格參考)，名稱與代號各只掃一遍"""
+        leaders = [a or b for a, b in zip(self.tag_bellwethers(names), self.tag_bellwethers(codes))]
+        return [self.analyze_sector_role("", "", "Auto", p, [], is_leader=lead)
+                for lead, p in zip(leaders, prices)]
+
     def get_story(self, name_or_code: str) -> str:
-        for k, v in self.stock_stories.items():
-            if k in name_or_code: return v
-        return ""
+        key = self.bellwether_matcher.first_match(name_or_code)
+        return self.stock_stories[key] if key is not None else ""
+
+    def get_stories(self, values: Iterable) -> List[str]:
+        """整欄代號一次取得題材"""
+        return [self.stock_stories[k] if k is not None else "" for k in self.bellwether_matcher.tag(values)]
     
     def check_story_quality(self, story_text: str) -> int:
         score = 0
@@ -216,4 +375,17 @@ class TitanKnowledgeBase:
             
             if desc:
                 rules.append(f"• 季節性題材: {desc[:30]}...")
-        return list(set(rules))
\ No newline at end of file
+        return list(set(rules))
+
+
+_kb_instances: Dict[str, TitanKnowledgeBase] = {}
+_kb_lock = threading.Lock()
+
+
+def get_knowledge_base(db_path: str = 'full_sop_database.json') -> TitanKnowledgeBase:
+    """行程內共用的 TitanKnowledgeBase (每個資料庫路徑一份，懶載入)"""
+    key = os.path.abspath(db_path)
+    with _kb_lock:
+        if key not in _kb_instances:
+            _kb_instances[key] = TitanKnowledgeBase(db_path)
+        return _kb_instances[key]
\ No newline at end of file
@@ -4,16 +4,56 @@
 
 import pandas as pd
 import numpy as np
-import yfinance as yf
 from config import Config
-from knowledge_base import TitanKnowledgeBase
+from knowledge_base import get_knowledge_base
 from execution import CalendarAgent
+from price_store import load_history_many
+from indicators import build_price_panel, ma_snapshot
+from fingerprint import frame_fingerprint
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+# 保留最近幾次掃描的中間結果，供報告隨選生成 (各 UI session 的快取版本可能不同)
+_REPORT_SCAN_KEEP = 4
+
+# 身分檢核：領頭羊 / 風口豬才計分
+_SCORED_ROLES = ("👑 領頭羊 (Leader)", "🔥 風口豬 (Laggard)")
+
+
+def sop_score(price, stock_price, ma87, ma284, identity_ok, story_ok, is_recent_breakout,
+              is_honeymoon, is_put_rally, premium, converted_ratio, avg_volume):
+    """
+    四大天條計分 + 加分 / 風險扣分，回傳 (score, price_ok, magic_ma_ok)。
+    參數皆為可互相廣播的陣列：當日普查為 (N,)；歷史回放為 (日, 檔) 的 (T, N)。
+    比較式遇 NaN 為 False (等同條件不成立)。
+    """
+    with np.errstate(invalid='ignore'):
+        price_ok = np.asarray(price < Config.FILTER_MAX_PRICE)
+        magic_ma_ok = np.asarray((stock_price > ma87) & (ma87 > ma284) & (ma284 > 0))
+        score = (np.where(price_ok, 20, 0) + np.where(magic_ma_ok, 40, 0)
+                 + np.where(identity_ok, 10, 0) + np.where(story_ok, 10, 0)
+                 + np.where(is_recent_breakout, 5, 0)
+                 + np.where(is_honeymoon, 5, 0) + np.where(is_put_rally, 5, 0)
+                 - np.where(premium > 20, 10, 0)
+                 - np.where(converted_ratio > 30, 20, 0)
+                 - np.where(avg_volume < 10, 15, 0))
+    return np.clip(score, 0, 100), price_ok, magic_ma_ok
+
 
 class TitanStrategyEngine:
     def __init__(self):
-        self.kb = TitanKnowledgeBase()
+        self.kb = get_knowledge_base()
         self.calendar = CalendarAgent()
+        # --- 隨選報告 (Lazy Report) ---
+        self._scan_frames: "OrderedDict[str, pd.DataFrame]" = OrderedDict()   # scan_version → 依 code 索引的評分表
+        self._report_cache: Dict[Tuple[str, str], str] = {}                   # (scan_version, code) → 報告
+        self._report_lock = threading.Lock()
+        # --- 增量評分：逐檔中間結果 (只在輸入改變時重算) ---
+        self._tech_cache: Dict[str, Tuple[float, dict]] = {}   # stock_code → (計算時間, 技術面欄位)
+        self._qual_cache: "OrderedDict[Tuple[str, ...], dict]" = OrderedDict()   # (name, code, stock_code, 上市日, 賣回日, 年度) → 質化欄位 (LRU)
 
     def _get_granville_status(self, price, ma87, is_recent_breakout, bias_percent):
         """格蘭碧八大法則狀態判讀"""
@@ -135,44 +175,40 @@ class TitanStrategyEngine:
 
         return report
 
+    def _tech_features(self, stock_codes) -> pd.DataFrame:
+        """
+        個股技術面 (stock_price / MA87 / MA284 / 突破 / 創高)，index=stock_code。
+        SCAN_TECH_TTL 內算過的代號直接沿用 (含查無資料者)，只有新代號或過期者才下載計算。
+        """
+        now = time.time()
+        stale = [c for c in stock_codes
+                 if c not in self._tech_cache or now - self._tech_cache[c][0] > Config.SCAN_TECH_TTL]
+        if stale:
+            # 上市/上櫃雙軌批次下載 (.TW 一輪、查無者 .TWO 一輪)
+            frames = load_history_many(stale, period="2y")
+            frames = {c: frames[c.strip()] for c in stale if c.strip() in frames}
+
+            # 需重算的標的一次向量化計算 87/284 生命線
+            snap = ma_snapshot(build_price_panel(frames, 'Close'), build_price_panel(frames, 'High'))
+            snap = snap[(snap['n_obs'] >= Config.MA_LONG_TERM) & snap['ma87'].notna() & snap['ma284'].notna()]
+            tech = (snap[['price', 'ma87', 'ma284', 'is_recent_breakout', 'is_making_high']]
+                    .rename(columns={'price': 'stock_price', 'ma87': 'MA87', 'ma284': 'MA284'})
+                    .to_dict('index'))
+            for c in stale:
+                self._tech_cache[c] = (now, tech.get(c, {}))
+        return pd.DataFrame.from_dict({c: self._tech_cache[c][1] for c in stock_codes}, orient='index',
+                                      columns=['stock_price', 'MA87', 'MA284', 'is_recent_breakout', 'is_making_high'])
+
     def _batch_enrich_data(self, df: pd.DataFrame) -> pd.DataFrame:
         work_df = df.copy()
         stock_codes = work_df['stock_code'].dropna().unique()
-        tickers = [f"{code}.TW" for code in stock_codes]
         
-        tech_data = {}
-        if not tickers:
+        if len(stock_codes) == 0:
             for col in ['stock_price', 'MA87', 'MA284', 'is_recent_breakout', 'is_making_high']:
                 work_df[col] = 0 if 'price' in col or 'MA' in col else False
             return work_df
 
-        data = yf.download(tickers, period="2y", group_by='ticker', progress=False, threads=True)
-        
-        for ticker in tickers:
-            stock_code = ticker.split('.')[0]
-            try:
-                stock_df = data[ticker] if len(tickers) > 1 else data
-                if not stock_df.empty and len(stock_df) >= Config.MA_LONG_TERM:
-                    close = stock_df['Close']
-                    high = stock_df['High']
-                    ma87 = close.rolling(Config.MA_LIFE_LINE).mean().iloc[-1]
-                    ma284 = close.rolling(Config.MA_LONG_TERM).mean().iloc[-1]
-                    
-                    is_recent_breakout = (close.iloc[-1] > ma87) and (close.iloc[-5] < ma87)
-                    is_making_high = close.iloc[-1] >= high.iloc[-3:].max()
-
-                    if not np.isnan(ma87) and not np.isnan(ma284):
-                        tech_data[stock_code] = {
-                            "stock_price": close.iloc[-1], 
-                            "MA87": ma87, 
-                            "MA284": ma284,
-                            "is_recent_breakout": is_recent_breakout,
-                            "is_making_high": is_making_high
-                        }
-            except (KeyError, IndexError):
-                continue
-        
-        tech_df = pd.DataFrame.from_dict(tech_data, orient='index').reset_index().rename(columns={'index': 'stock_code'})
+        tech_df = self._tech_features([str(c) for c in stock_codes]).rename_axis('stock_code').reset_index()
         work_df = work_df.merge(tech_df, on='stock_code', how='left')
         
         for col in ['stock_price', 'MA87', 'MA284', 'is_recent_breakout', 'is_making_high']:
@@ -183,6 +219,71 @@ class TitanStrategyEngine:
                 
         return work_df
 
+    def _qualitative_features(self, work_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        逐列的 role / story / events 與蜜月期、避稅行情的最後事件日 (ipo_last / put_last)，
+        與 work_df 逐列對齊。以 (名稱, CB代號, 股票代號, 上市日, 賣回日, 年度) 為鍵快取，
+        盤中重掃時只有新標的或這些欄位改變的列才會重算。
+        """
+        n = len(work_df)
+        cols = {c: (work_df[c].astype(str).tolist() if c in work_df.columns else [''] * n)
+                for c in ['name', 'code', 'stock_code', 'list_date', 'put_date']}
+        year = str(datetime.now().year)   # 行事曆事件 (融券/除權息) 依年度產生，跨年即失效
+        keys = list(zip(cols['name'], cols['code'], cols['stock_code'], cols['list_date'], cols['put_date'], [year] * n))
+
+        new_keys = list(dict.fromkeys(k for k in keys if k not in self._qual_cache))
+        if new_keys:
+            names, codes, stocks, lists, puts, _ = (list(x) for x in zip(*new_keys))
+            roles = self.kb.analyze_sector_roles(names, codes, [0.0] * len(new_keys))
+            stories = self.kb.get_stories(stocks)
+            lists = lists if 'list_date' in work_df.columns else None
+            puts = puts if 'put_date' in work_df.columns else None
+            table = self.calendar.build_event_table(codes, lists, puts)
+            events = self.calendar.events_by_row(table, len(new_keys))
+            last = table.pivot_table(index='row', columns='type', values='date', aggfunc='max')
+            for i, k in enumerate(new_keys):
+                self._qual_cache[k] = {
+                    'role': roles[i], 'story': stories[i], 'events': events[i],
+                    'ipo_last': last['IPO'].get(i, pd.NaT) if 'IPO' in last else pd.NaT,
+                    'put_last': last['PutBack'].get(i, pd.NaT) if 'PutBack' in last else pd.NaT,
+                }
+
+        out = pd.DataFrame([self._qual_cache[k] for k in keys],
+                           columns=['role', 'story', 'events', 'ipo_last', 'put_last'])
+        # 本次掃描用到的鍵移到最新端；改過日期 / 下市 / 跨年留下的舊鍵從最舊端淘汰
+        for k in dict.fromkeys(keys):
+            self._qual_cache.move_to_end(k)
+        while len(self._qual_cache) > max(Config.SCAN_QUAL_KEEP, len(out)):
+            self._qual_cache.popitem(last=False)
+        out['ipo_last'] = pd.to_datetime(out['ipo_last'])
+        out['put_last'] = pd.to_datetime(out['put_last'])
+        return out
+
+    @staticmethod
+    def _story_ok(stories: pd.Series) -> np.ndarray:
+        """發債故事命中 STORY_KEYWORDS 任一關鍵字"""
+        return stories.str.contains('|'.join(Config.STORY_KEYWORDS), case=False, na=False).to_numpy()
+
+    def score_history(self, static_df: pd.DataFrame, dates, panels: Dict[str, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        歷史回放評分，與 scan_entire_portfolio 共用 sop_score。
+        static_df: 每檔一列 (name / code / stock_code / list_date / put_date)，順序即 panels 的欄
+        panels:    (T, N) 陣列 price / stock_price / ma87 / ma284 / is_recent_breakout /
+                   premium / converted_ratio / avg_volume
+        時間套利以每個回放日當作「今天」判斷。回傳 (score, buy_ok)，buy_ok 即操作建議為買進的格子。
+        """
+        qual = self._qualitative_features(static_df.reset_index(drop=True))
+        day = np.asarray(pd.DatetimeIndex(dates).normalize(), dtype='datetime64[ns]')[:, None]
+        ipo_last = qual['ipo_last'].to_numpy(dtype='datetime64[ns]')[None, :]
+        put_last = qual['put_last'].to_numpy(dtype='datetime64[ns]')[None, :]
+        score, price_ok, magic_ma_ok = sop_score(
+            identity_ok=np.array([r.get('role') in _SCORED_ROLES for r in qual['role']])[None, :],
+            story_ok=self._story_ok(qual['story'])[None, :],
+            is_honeymoon=~np.isnat(ipo_last) & (ipo_last >= day),
+            is_put_rally=~np.isnat(put_last) & (put_last >= day),
+            **panels)
+        return score, price_ok & magic_ma_ok & (score >= 60)
+
     def _calculate_risk_metrics(self, df: pd.DataFrame) -> pd.DataFrame:
         """[V64.0] 向量化計算理論價、溢價率、轉換率"""
         work_df = df.copy()
@@ -218,7 +319,11 @@ class TitanStrategyEngine:
 
         return work_df
 
-    def scan_entire_portfolio(self, df: pd.DataFrame) -> pd.DataFrame:
+    def scan_entire_portfolio(self, df: pd.DataFrame, with_reports: bool = False) -> pd.DataFrame:
+        """
+        全市場評分。詳細報告預設不生成，改由 get_report() 於檢視時隨選產生；
+        with_reports=True 時才一併填入 full_report 欄 (批次輸出用)。
+        """
         if df.empty or 'code' not in df.columns or 'name' not in df.columns or 'stock_code' not in df.columns:
             return pd.DataFrame()
 
@@ -231,46 +336,25 @@ class TitanStrategyEngine:
         work_df = self._batch_enrich_data(work_df)
         work_df = self._calculate_risk_metrics(work_df)
 
-        # --- 2. 全市場賦予質化資訊 ---
-        work_df['role'] = work_df.apply(lambda row: self.kb.analyze_sector_role(str(row['name']), str(row['code']), "Auto", row['price'], []), axis=1)
-        work_df['story'] = work_df['stock_code'].apply(lambda x: self.kb.get_story(str(x)))
-        work_df['events'] = work_df.apply(lambda row: self.calendar.calculate_time_traps(str(row['code']), str(row.get('list_date', '')), str(row.get('put_date', ''))), axis=1)
+        # --- 2. 全市場賦予質化資訊 (只重算新出現或身分/日期改變的標的) ---
+        qual = self._qualitative_features(work_df)
+        for col in ['role', 'story', 'events']:
+            work_df[col] = qual[col].to_numpy()
 
         # --- 3. 全市場評分 ---
-        work_df['score'] = 0
-        
-        # 條件檢核
-        price_ok = work_df['price'] < Config.FILTER_MAX_PRICE
-        magic_ma_ok = (work_df['stock_price'] > work_df['MA87']) & (work_df['MA87'] > work_df['MA284']) & (work_df['MA284'] > 0)
-        identity_ok = work_df['role'].apply(lambda x: x.get('role') in ["👑 領頭羊 (Leader)", "🔥 風口豬 (Laggard)"])
-        story_regex = '|'.join(Config.STORY_KEYWORDS)
-        story_ok = work_df['story'].str.contains(story_regex, case=False, na=False)
-        
-        # 核心四大天條計分
-        work_df['score'] += np.where(price_ok, 20, 0)
-        work_df['score'] += np.where(magic_ma_ok, 40, 0)
-        work_df['score'] += np.where(identity_ok, 10, 0)
-        work_df['score'] += np.where(story_ok, 10, 0)
-        
-        # 加分項
-        work_df['score'] += np.where(work_df['is_recent_breakout'], 5, 0)
-        
-        now = datetime.now()
-        def check_events(events):
-            is_honeymoon = any("蜜月期" in e['event'] and pd.to_datetime(e['date']).date() >= now.date() for e in events)
-            is_put_rally = any("避稅" in e['event'] and pd.to_datetime(e['date']).date() >= now.date() for e in events)
-            return is_honeymoon, is_put_rally
-
-        event_scores = work_df['events'].apply(check_events)
-        work_df['score'] += np.where(event_scores.apply(lambda x: x[0]), 5, 0)
-        work_df['score'] += np.where(event_scores.apply(lambda x: x[1]), 5, 0)
-
-        # [V64.0] 風險扣分項
-        work_df['score'] -= np.where(work_df['premium'] > 20, 10, 0)
-        work_df['score'] -= np.where(work_df['converted_ratio'] > 30, 20, 0)
-        work_df['score'] -= np.where(work_df['avg_volume'] < 10, 15, 0)
-
-        work_df['score'] = work_df['score'].clip(0, 100)
+        # 時間套利：蜜月期 / 避稅行情尚未過去者加分 (快取的最後事件日與今天比較)
+        today = pd.Timestamp(datetime.now()).normalize()
+        score, price_ok, magic_ma_ok = sop_score(
+            price=work_df['price'].to_numpy(), stock_price=work_df['stock_price'].to_numpy(),
+            ma87=work_df['MA87'].to_numpy(), ma284=work_df['MA284'].to_numpy(),
+            identity_ok=work_df['role'].apply(lambda x: x.get('role') in _SCORED_ROLES).to_numpy(),
+            story_ok=self._story_ok(work_df['story']),
+            is_recent_breakout=work_df['is_recent_breakout'].to_numpy(),
+            is_honeymoon=(qual['ipo_last'] >= today).to_numpy(),
+            is_put_rally=(qual['put_last'] >= today).to_numpy(),
+            premium=work_df['premium'].to_numpy(), converted_ratio=work_df['converted_ratio'].to_numpy(),
+            avg_volume=work_df['avg_volume'].to_numpy())
+        work_df['score'] = score
 
         # --- 4. 根據分數與核心條件決定操作建議 ---
         action_conditions = [
@@ -280,16 +364,58 @@ class TitanStrategyEngine:
         action_choices = ['🔥 強力買進', '✅ 買進/觀察']
         work_df['action'] = np.select(action_conditions, action_choices, default='-')
         
-        # --- 5. 生成報告並回傳完整結果 ---
+        # --- 5. 保留中間結果供報告隨選生成，回傳評分表 ---
         results_df = work_df.sort_values(by='score', ascending=False).reset_index(drop=True)
-        results_df['full_report'] = results_df.apply(self._generate_single_report, axis=1)
+        scan_version = self._remember_scan(df, results_df)
         
         # 確保所有需要的欄位都存在
         final_cols = list(df.columns) + [
-            'price', 'stock_price', 'score', 'action', 'full_report', 
+            'price', 'stock_price', 'score', 'action',
             'parity', 'premium', 'converted_ratio', 'avg_volume'
         ]
+        if with_reports:
+            results_df['full_report'] = [self.get_report(c, scan_version) or '報告生成失敗' for c in results_df['code']]
+            final_cols.append('full_report')
         # 去除重複欄位
         final_cols = list(dict.fromkeys(final_cols))
         
-        return results_df.reindex(columns=final_cols).fillna({'full_report': '報告生成失敗'})
\ No newline at end of file
+        out = results_df.reindex(columns=final_cols)
+        out.attrs['scan_version'] = scan_version
+        return out
+
+    # --- 隨選報告 ---
+    def _remember_scan(self, source_df: pd.DataFrame, results_df: pd.DataFrame) -> str:
+        """保留本次掃描的完整中間欄位 (role / story / events / 均線)，回傳資料版本"""
+        scan_version = frame_fingerprint(source_df)
+        frame = results_df.assign(code=results_df['code'].astype(str).str.strip())
+        frame = frame.drop_duplicates('code').set_index('code', drop=False)
+        with self._report_lock:
+            self._scan_frames[scan_version] = frame
+            self._scan_frames.move_to_end(scan_version)
+            self._report_cache = {k: v for k, v in self._report_cache.items() if k[0] != scan_version}
+            while len(self._scan_frames) > _REPORT_SCAN_KEEP:
+                old, _ = self._scan_frames.popitem(last=False)
+                self._report_cache = {k: v for k, v in self._report_cache.items() if k[0] != old}
+        return scan_version
+
+    def get_report(self, code: str, scan_version: Optional[str] = None) -> Optional[str]:
+        """
+        單檔 CB 的詳細 Markdown 報告，第一次查看時才生成，之後依 (資料版本, 代號) 直接取用。
+        scan_version 為 scan_entire_portfolio 回傳表的 attrs['scan_version']，省略時用最近一次掃描；
+        該版本已不在記憶體 (例如結果來自預先計算快照) 或查無代號時回傳 None。
+        """
+        code = str(code).strip()
+        with self._report_lock:
+            if not self._scan_frames:
+                return None
+            version = scan_version or next(reversed(self._scan_frames))
+            frame = self._scan_frames.get(version)
+            if frame is None or code not in frame.index:
+                return None
+            key = (version, code)
+            if key not in self._report_cache:
+                try:
+                    self._report_cache[key] = self._generate_single_report(frame.loc[code])
+                except Exception:
+                    return None
+            return self._report_cache[key]
\ No newline at end of file
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Titan SOP V100.0 - 數值引擎測試腳本
+驗證向量化引擎與逐檔 pandas 計算結果一致
+"""
+
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import linregress
+
+from indicators import (GEOMETRY_PERIODS, build_price_panel, deduction_forecast,
+                        geometry_table, ma_panel, ma_snapshot)
+
+
+def _random_frames(seed: int = 0) -> dict:
+    """三檔模擬日K：完整 / 晚上市 / 交易日有缺口"""
+    rng = np.random.default_rng(seed)
+    idx = pd.bdate_range('2022-01-03', periods=600)
+    frames = {}
+    for t in ['A', 'B', 'C']:
+        s = pd.Series(100 * np.exp(np.cumsum(rng.normal(0, 0.02, len(idx)))), index=idx)
+        if t == 'B': s = s.iloc[200:]
+        if t == 'C': s = s.drop(idx[::7])
+        frames[t] = pd.DataFrame({'Close': s, 'High': s * 1.01})
+    return frames
+
+
+def test_ma_panel_matches_rolling():
+    """面板均線 = 逐檔 rolling().mean()"""
+    frames = _random_frames()
+    mas = ma_panel(build_price_panel(frames))
+    for t, df in frames.items():
+        for w in (87, 284):
+            expect = df['Close'].rolling(w).mean().dropna()
+            got = mas[w][t].dropna()
+            assert got.index.equals(expect.index)
+            assert np.allclose(got.values, expect.values)
+
+
+def test_ma_snapshot_matches_single_ticker():
+    """快照的趨勢天數 / 扣抵值 / 乖離與單檔算法一致"""
+    frames = _random_frames(1)
+    snap = ma_snapshot(build_price_panel(frames), build_price_panel(frames, 'High'))
+    for t, df in frames.items():
+        c = df['Close']
+        ma87, ma284 = c.rolling(87).mean(), c.rolling(284).mean()
+        bull = (ma87 > ma284)[ma284.notna()]
+        groups = bull.ne(bull.shift()).cumsum()
+        r = snap.loc[t]
+        assert r['trend_days'] == groups.groupby(groups).cumcount().iloc[-1] + 1
+        assert r['deduct87'] == c.iloc[-87]
+        assert r['deduct284'] == c.iloc[-284]
+        assert np.isclose(r['bias87'], (c.iloc[-1] - ma87.iloc[-1]) / ma87.iloc[-1] * 100)
+        assert r['n_obs'] == len(c)
+
+
+def test_deduction_forecast_matches_shift():
+    """扣抵排程：面板結果與逐檔一致，守價持平可保住均線、持平均線等於接續現價後的 rolling"""
+    panel = build_price_panel(_random_frames(1))
+    f = deduction_forecast(panel.to_numpy(), 60, 87)
+    for j, t in enumerate(panel.columns):
+        c = panel[t].dropna().to_numpy()
+        assert np.array_equal(f['deduct'][:, j], c[len(c) - 87:len(c) - 27])
+        for h in (1, 30, 60):
+            held = np.r_[c, np.full(h, f['hold_price'][h - 1, j])]
+            assert np.isclose(held[-87:].mean(), c[-87:].mean())
+            assert np.isclose(f['ma_flat'][h - 1, j], np.r_[c, np.full(h, c[-1])][-87:].mean())
+    assert np.isnan(deduction_forecast(panel.iloc[:, 0].to_numpy(), 90, 87)['deduct'][87:]).all()
+
+
+def test_geometry_table_matches_linregress():
+    """批次 7D 幾何 = 逐檔逐窗口 linregress (含上市未滿窗口的標的)"""
+    rng = np.random.default_rng(2)
+    idx = pd.date_range('1985-01-31', periods=480, freq='ME')
+    panel = pd.DataFrame({t: 100 * np.exp(np.cumsum(rng.normal(0.005, 0.08, len(idx))))
+                          for t in ['A', 'B', 'C']}, index=idx)
+    panel.iloc[:400, 1] = np.nan
+    table = geometry_table(panel)
+    for t in panel.columns:
+        s = panel[t].dropna()
+        for label, months in GEOMETRY_PERIODS.items():
+            lp = np.log(s.values[-months:])
+            slope, _, r, _, _ = linregress(np.arange(len(lp)), lp)
+            angle = np.clip(np.degrees(np.arctan(slope * 100)), -90, 90)
+            assert table.loc[t, f"{label}_slope"] == round(slope, 6)
+            assert table.loc[t, f"{label}_r2"] == round(r ** 2, 4)
+            assert table.loc[t, f"{label}_angle"] == round(angle, 2)
+
+
+def test_engines_import_without_streamlit():
+    """引擎層可在沒有 Streamlit 的 worker / 排程中載入"""
+    code = ("import sys; sys.modules['streamlit'] = None; "
+            "import data_engine, core_logic, strategy, macro_risk, backtest, hunter, precompute, optimizer, cb_archive, montecarlo")
+    proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
+
+
+def test_bellwether_matcher_matches_substring_loop():
+    """Aho–Corasick 比對 = 依加入順序逐一 `k in text` 的第一個命中"""
+    from knowledge_base import BellwetherMatcher
+    rng = np.random.default_rng(3)
+    for _ in range(200):
+        pats = ["".join(rng.choice(list("abc"), rng.integers(1, 5))) for _ in range(rng.integers(1, 8))]
+        matcher = BellwetherMatcher(pats)
+        texts = ["".join(rng.choice(list("abc"), rng.integers(0, 10))) for _ in range(30)]
+        expect = [next((p for p in pats if p in t), None) for t in texts]
+        assert matcher.tag(texts) == expect
+
+
+def test_bm25_index_ranks_cjk_passages():
+    """CJK 二元組斷詞 + BM25：含完整查詢詞的段落排最前，無關段落不出現"""
+    from sop_search import BM25Index, tokenize
+    assert tokenize("亞當理論 87MA") == ["亞當", "當理", "理論", "87ma"]
+    docs = ["亞當理論：價格突破前高後回測87MA", "扣抵值決定均線方向", "亞當斯密的國富論", "賣回日前半年的避稅行情"]
+    index = BM25Index(docs)
+    ranked = [i for i, _ in index.search("亞當理論")]
+    assert ranked[0] == 0 and 1 not in ranked and 3 not in ranked
+    assert index.search("完全無關") == []
+
+
+def test_event_table_columnar():
+    """整欄事件表：日期為 datetime64、無法解析的列不產生事件、位移天數正確"""
+    from config import Config
+    from execution import CalendarAgent
+    cal = CalendarAgent()
+    table = cal.build_event_table(["A", "B", "C"], ["2024-01-15", "bad", "2024/03/01"],
+                                  ["2026-05-01", "2026-01-01", "2025-12-31"], include_calendar=False)
+    assert str(table["date"].dtype) == "datetime64[ns]"
+    assert set(table["row"]) == {0, 2}
+    a = table[table["row"] == 0].set_index("type")["date"]
+    assert a["IPO"] == pd.Timestamp("2024-01-15") + pd.Timedelta(days=Config.LISTING_HONEYMOON_DAYS)
+    assert a["PutBack"] == pd.Timestamp("2026-05-01") - pd.Timedelta(days=Config.PUT_AVOID_TAX_DAYS)
+    window = cal.events_between(table, "2025-12-31", "2025-12-31")
+    assert list(window["code"]) == ["C"] and list(window["type"]) == ["Risk"]
+    upcoming = cal.rows_with_upcoming(table, 3, "PutBack", today="2025-08-01")
+    assert upcoming.tolist() == [True, False, False]
+
+
+def test_frame_fingerprint_tracks_content():
+    """同內容不同物件指紋相同；任一儲存格改變即不同；不可雜湊欄位也能計算"""
+    from fingerprint import fingerprint, frame_fingerprint
+    df = pd.DataFrame({'code': ['23301', '24541'], 'close': [105.0, 110.5],
+                       'role': [{'role': 'A'}, {'role': 'B'}]})
+    assert frame_fingerprint(df) == frame_fingerprint(df.copy())
+    changed = df.copy()
+    changed.loc[1, 'close'] = 110.6
+    assert frame_fingerprint(changed) != frame_fingerprint(df)
+    assert frame_fingerprint(df.rename(columns={'close': 'price'})) != frame_fingerprint(df)
+    assert frame_fingerprint(pd.DataFrame()) == "empty"
+    assert fingerprint(df, 87) != fingerprint(df, 284)
+
+
+def test_state_machine_matches_loop():
+    """規則對狀態機 (向量化與逐棒兩條路徑) = 原本的 for 迴圈進出場"""
+    from backtest import extract_trades, run_state_machine
+    rng = np.random.default_rng(4)
+    for overlap in (False, True):
+        entry = rng.random(500) < 0.1
+        exit_ = rng.random(500) < 0.1
+        if not overlap:
+            exit_ &= ~entry
+        expect, pos = np.zeros(500, dtype=np.int8), False
+        for i in range(1, 500):
+            if not pos and entry[i]: pos = True
+            elif pos and exit_[i]: pos = False
+            expect[i] = pos
+        got = run_state_machine(entry, exit_, start=1)
+        assert np.array_equal(got, expect)
+        close = 100 + np.arange(500.0)
+        trades = extract_trades(got, close)
+        assert (trades["exit_price"] > trades["entry_price"]).all()
+        assert len(trades) == np.count_nonzero(np.diff(got.astype(int)) == -1)
+
+
+def test_ma_sweep_matches_single_ticker():
+    """多標的廣播回測 = 逐檔單獨回測 (不同上市長度 / 交易日缺口)"""
+    from backtest import ma_lab_backtest, ma_sweep, sweep_table
+    frames = _random_frames(5)
+    grid = ma_sweep(frames)
+    assert len(sweep_table(grid)) == 15 * len(frames)
+    for t, df in frames.items():
+        single = ma_lab_backtest(df)
+        for r, s in zip([g for g in grid if g["ticker"] == t], single):
+            assert r["strategy_name"] == s["strategy_name"]
+            assert r["equity_curve"].index.equals(df.index)
+            assert np.allclose(r["equity_curve"].values, s["equity_curve"].values)
+            assert np.isclose(r["sharpe_ratio"], s["sharpe_ratio"])
+            assert np.isclose(r["kelly"], s["kelly"])
+
+
+def test_optimizer_matches_loop_backtest():
+    """參數最佳化：單組參數的全期間 CAGR = 逐棒迴圈回測；Walk-Forward 樣本外緊接樣本內"""
+    from optimizer import optimize_ticker, param_grid
+    rng = np.random.default_rng(6)
+    c = pd.Series(100 * np.exp(np.cumsum(rng.normal(0.0003, 0.015, 1500))))
+    grid = param_grid(shorts=[20, 60], longs=[120, 250], bands=[10, 20])
+    res = optimize_ticker(c.to_numpy(), grid, n_splits=3)
+    assert len(res["walk_forward"]) == 3 and res["stability"]["objective"] == "sharpe"
+    wf = res["walk_forward"]
+    assert (wf["train_start"] == wf["train_start"].iloc[0]).all() and (wf["train_end"] < wf["test_end"]).all()
+    for _, row in res["results"].iterrows():
+        ms, ml = c.rolling(int(row["short"])).mean(), c.rolling(int(row["long"])).mean()
+        pos, sig = 0, np.zeros(len(c))
+        for i in range(1, len(c)):
+            bias = (c[i] - ms[i]) / ms[i] * 100
+            if pos == 0 and ms[i] > ml[i] and c[i] > ms[i] and bias < row["band"]: pos = 1
+            elif pos == 1 and (c[i] < ms[i] or bias > row["band"]): pos = 0
+            sig[i] = pos
+        equity = (1 + (pd.Series(sig).shift(1) * c.pct_change()).fillna(0)).prod()
+        assert np.isclose(equity ** (252 / (len(c) - 1)) - 1, row["cagr"])
+
+
+def test_cb_portfolio_replay_fills_and_costs():
+    """CB 組合回測：隔日成交、持倉上限依分數取捨、152 停利與交易成本"""
+    from backtest import CBPortfolioBacktester
+    dates = pd.bdate_range('2024-01-01', periods=6)
+    price = np.array([[108, 107, 130], [108, 109, 130], [120, 109, 130],
+                      [152, 109, 130], [150, 109, 130], [150, 109, 130]], dtype=float)
+    panels = {'dates': dates, 'price': price,
+              'static': pd.DataFrame({'code': ['A', 'B', 'C'], 'name': ['a', 'b', 'c']}),
+              'stock_price': np.full((6, 3), 10.0), 'ma87': np.full((6, 3), 5.0)}
+    score = np.tile([90.0, 80.0, 95.0], (6, 1))
+    buy_ok = np.zeros((6, 3), dtype=bool)
+    buy_ok[0] = True
+    bt = CBPortfolioBacktester(initial_capital=1000, max_positions=1, fee_rate=0.001, tax_rate=0.001)
+    res = bt.simulate(panels, score, buy_ok)
+    trades = res['trades']
+    assert list(trades['code']) == ['A'] and trades['reason'].iat[0].startswith("🎯")
+    assert trades['entry_date'].iat[0] == dates[1] and trades['exit_date'].iat[0] == dates[4]
+    assert np.isclose(trades['roi'].iat[0], 150 * 0.998 / (108 * 1.001) - 1)
+    assert np.isclose(res['final_equity'], 1000 * (1 + trades['roi'].iat[0]))
+
+
+def test_cb_archive_point_in_time(tmp_path):
+    """CB 快照庫：同日同內容不重複存檔、as_of 取當日以前最後一份、history 串成 long format"""
+    from cb_archive import CBArchive
+    archive = CBArchive(tmp_path)
+    day1 = pd.DataFrame({'code': ['23301', '24541'], 'close': [105.0, 110.0], 'conversion_price': [50.0, 80.0]})
+    day2 = day1.assign(close=[108.0, 112.0], conversion_price=[48.5, 80.0])
+    assert archive.append(day1, as_of='2025-03-03') is not None
+    assert archive.append(day1, as_of='2025-03-03') is None
+    archive.append(day2, as_of='2025-03-05')
+    assert archive.as_of('2025-03-04')['close'].tolist() == [105.0, 110.0]
+    assert archive.as_of('2025-03-04').attrs['as_of'] == pd.Timestamp('2025-03-03')
+    assert archive.as_of('2025-03-02').empty
+    hist = archive.history()
+    assert list(hist.columns[:2]) == ['date', 'code'] and len(hist) == 4
+    conv = archive.series('23301', 'conversion_price')
+    assert conv.tolist() == [50.0, 48.5] and conv.index[-1] == pd.Timestamp('2025-03-05')
+
+
+def test_monte_carlo_carries_ma_and_cross_odds():
+    """蒙地卡羅：路徑均線與逐日 rolling 一致、GBM 波動率、確定性情境下交叉機率為 0/1"""
+    from montecarlo import carry_ma, ma_path_forecast, simulate_paths
+    rng = np.random.default_rng(3)
+    c = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, 800)))
+    paths = simulate_paths(c, 30, n_paths=200, method="bootstrap")
+    ma = carry_ma(c, paths, 87)
+    assert np.allclose(ma[5], pd.Series(np.r_[c, paths[5]]).rolling(87).mean().to_numpy()[-30:])
+    step = np.log(simulate_paths(c, 1, n_paths=50000, method="gbm")[:, 0] / c[-1])
+    assert np.isclose(step.std(), np.diff(np.log(c[-757:])).std(), rtol=0.02)
+
+    down = np.r_[np.linspace(200, 100, 400), np.full(100, 100.0)]   # 87MA 已在 284MA 之下
+    up = ma_path_forecast(down, horizon=40, n_paths=500, drift_pct=5.0)
+    assert up["p_golden"] == 1.0 and up["p_death"] == 0.0 and up["p_above87_end"] == 1.0
+    crash = ma_path_forecast(np.linspace(100, 200, 400), horizon=20, n_paths=500, drift_pct=-8.0)
+    assert crash["p_break87"] == 1.0 and crash["p_golden"] == 0.0
+
+
+def test_leader_table_keeps_features_only():
+    """主流股榜單只存純量特徵 (可序列化、KB 等級)；明細於選股時由倉庫重建"""
+    from macro_risk import MacroRiskEngine
+    frames = {f"{t}.TW": df.assign(Open=df['Close'], Low=df['Close'], Volume=1000.0)
+              for t, df in _random_frames(2).items()}
+
+    class _Store:
+        def get_many(self, symbols, period=None):
+            return {s: frames[s] for s in symbols if s in frames}
+
+        def get(self, symbol, period=None):
+            return frames.get(symbol, pd.DataFrame())
+
+    engine = MacroRiskEngine.__new__(MacroRiskEngine)
+    engine.store = _Store()
+    table = engine._get_leader_analysis(list(frames), 'price', top_n=3)
+    assert list(table['rank']) == [1, 2, 3]
+    assert all(np.ndim(v) == 0 for v in table.iloc[0])
+    assert table['sort_value'].is_monotonic_decreasing
+    detail = engine.get_leader_detail(table.at[0, 'ticker'])
+    ded = detail['deduction_df']
+    c = frames[table.at[0, 'ticker']]['Close']
+    assert len(ded) == 60 and ded['Deduction_Value'].iat[0] == c.iloc[-87]
+    assert np.isclose(ded['Hold_Price'].iat[19], table.at[0, 'hold87_20d'])
+
+
+def test_exchange_map_re_resolves_moved_listing(tmp_path, monkeypatch):
+    """已知後綴查無時改打另一後綴並改記；雙軌皆查無只移除舊記錄，不標為查無"""
+    import price_store
+    xmap = price_store.ExchangeMap(tmp_path / "exchange_map.json")
+    xmap.seed({"6488": ".TWO", "2330": ".TW", "9999": ".TW"})
+    listed = {"6488.TW": _random_frames(0)['A'], "2330.TW": _random_frames(1)['A']}
+    calls = []
+
+    class _Store:
+        def get_many(self, symbols, **kw):
+            calls.append(list(symbols))
+            return {s: listed[s] for s in symbols if s in listed}
+
+    monkeypatch.setattr(price_store, "get_price_store", lambda: _Store())
+    monkeypatch.setattr(price_store, "get_exchange_map", lambda: xmap)
+    out = price_store.load_history_many(["6488", "2330", "9999"])
+    assert set(out) == {"6488", "2330"}
+    assert calls == [["6488.TWO", "2330.TW", "9999.TW"], ["6488.TW", "9999.TWO"]]
+    assert price_store.ExchangeMap(xmap.path).resolved == {"6488": ".TW", "2330": ".TW"}
+    assert xmap.candidates("9999") == ["9999.TW", "9999.TWO"]
+    assert xmap.candidates("2330") == ["2330.TW", "2330.TWO"]
+
+
+def test_cb_archive_schema_growth_and_failed_write(tmp_path, monkeypatch):
+    """CB 快照庫：後期才出現的欄位在歷史中保留 (早期補 NaN)；寫檔失敗不留暫存檔，可重試"""
+    from cb_archive import CBArchive
+    archive = CBArchive(tmp_path)
+    archive.append(pd.DataFrame({'code': ['1', '2'], 'close': [100.0, 101.0]}), as_of='2025-01-02')
+    archive.append(pd.DataFrame({'code': ['1', '2'], 'close': [102.0, 103.0],
+                                 'converted_ratio': [5.0, 6.0]}), as_of='2025-01-03')
+    hist = archive.history()
+    assert 'converted_ratio' in hist.columns and hist['converted_ratio'].isna().sum() == 2
+    assert archive.series('1', 'converted_ratio').tolist()[1] == 5.0
+
+    day = pd.DataFrame({'code': ['9'], 'close': [1.0]})
+    real_write = pd.DataFrame.to_parquet
+
+    def _full_disk(self, path, **kw):
+        open(path, 'w').close()
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(pd.DataFrame, 'to_parquet', _full_disk)
+    with pytest.raises(OSError):
+        archive.append(day, as_of='2025-01-06')
+    assert not list((tmp_path / 'upload' / 'date=2025-01-06').iterdir())
+    monkeypatch.setattr(pd.DataFrame, 'to_parquet', real_write)
+    assert archive.append(day, as_of='2025-01-06') is not None
+    assert archive.as_of('2025-01-06')['code'].tolist() == ['9']
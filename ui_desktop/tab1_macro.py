@@ -18,8 +18,10 @@ from datetime import datetime
 
 # ── V82 引擎導入 ──────────────────────────────────────────────────────────────
 from macro_risk import MacroRiskEngine
-from knowledge_base import TitanKnowledgeBase
+from knowledge_base import get_knowledge_base
 from config import Config
+from fingerprint import frame_fingerprint
+from snapshot_store import get_snapshot_store
 
 # ── 信號燈對照表 ──────────────────────────────────────────────────────────────
 SIGNAL_MAP = {
@@ -33,37 +35,52 @@ SIGNAL_MAP = {
 def _load_engines():
     """單例模式載入重型引擎，防止每次 rerun 都重建"""
     from strategy import TitanStrategyEngine
-    kb = TitanKnowledgeBase()
+    kb = get_knowledge_base()
     macro = MacroRiskEngine()
     strat = TitanStrategyEngine()
     strat.kb = kb
     return macro, kb, strat
 
 @st.cache_data(ttl=600)
-def _get_macro_data(_macro, _df_hash):
+def _get_macro_data(_macro, df_hash):
     """10 分鐘緩存宏觀數據，避免重複下載"""
-    # _df_hash 作為緩存鍵，實際數據透過 session_state 傳入
+    # df_hash (內容指紋) 作為緩存鍵，實際數據透過 session_state 傳入
     df = st.session_state.get('df', pd.DataFrame())
+    # 排程 (precompute.py) 已對同一份 CB 清單算好時直接沿用
+    snap = get_snapshot_store().load("market_status", source=df_hash)
+    if snap is not None:
+        return snap
     return _macro.check_market_status(cb_df=df)
 
+@st.cache_data(ttl=600)
+def _leader_detail(ticker):
+    """榜單選定個股才重建日K / 扣抵 / 亞當投影 (榜單本身只存特徵)"""
+    macro, _, _ = _load_engines()
+    return macro.get_leader_detail(ticker)
+
 
 # ── 輔助函式：render_leader_dashboard ────────────────────────────────────────
 def _render_leader_dashboard(
     session_state_key: str,
     fetch_function,
     top_n: int,
-    sort_key_name: str
+    sort_key_name: str,
+    snapshot_name: str | None = None
 ):
     """
     雙雷達趨勢掃描 (V78.2 完整版)
-    用於 1.5 / 1.6 兩個窗口
+    用於 1.5 / 1.6 兩個窗口；snapshot_name 有新鮮的排程結果時免按鈕直接顯示
     """
     macro, kb, strat = _load_engines()
 
     st.info(f"此功能將掃描指定股票池，依「{sort_key_name}」找出市場最關注的 Top {top_n}，並對其進行高階趨勢預測。")
 
     if session_state_key not in st.session_state:
-        st.session_state[session_state_key] = pd.DataFrame()
+        snap = get_snapshot_store().load(snapshot_name) if snapshot_name else None
+        st.session_state[session_state_key] = snap if snap is not None else pd.DataFrame()
+        if snap is not None:
+            built = get_snapshot_store().meta(snapshot_name).get("created_at", 0)
+            st.caption(f"⏱️ 使用排程預算結果 ({datetime.fromtimestamp(built).strftime('%m-%d %H:%M')})，按下按鈕可重新掃描。")
 
     if st.button(f"🛰️ 掃描 {sort_key_name} Top {top_n}", key=f"btn_{session_state_key}"):
         with st.spinner(f"正在掃描並進行高階運算… (可能需要 1-2 分鐘)"):
@@ -121,9 +138,10 @@ def _render_leader_dashboard(
         selected_rank = int(selected_str.split('.')[0])
         sel = leaders_df[leaders_df['rank'] == selected_rank].iloc[0]
 
-        stock_df = sel['stock_df']
-        deduction_df = sel['deduction_df']
-        adam_df = sel['adam_df']
+        detail = _leader_detail(sel['ticker'])
+        stock_df = detail['stock_df']
+        deduction_df = detail['deduction_df']
+        adam_df = detail['adam_df']
         current_price = sel['current_price']
         ma87 = sel['ma87']
 
@@ -131,7 +149,10 @@ def _render_leader_dashboard(
         kpi_c1.metric("目前股價", f"{current_price:.2f}")
 
         bias_pct = ((current_price - ma87) / ma87) * 100 if ma87 > 0 else 0
-        is_recent_bo = (current_price > ma87) and (stock_df['Close'].iloc[-5] < ma87)
+        if 'is_recent_breakout' in sel.index:
+            is_recent_bo = bool(sel['is_recent_breakout'])
+        else:
+            is_recent_bo = (current_price > ma87) and (stock_df['Close'].iloc[-5] < ma87)
         granville = strat._get_granville_status(current_price, ma87, is_recent_bo, bias_pct)
         kpi_c2.metric("格蘭碧法則狀態", granville)
         st.markdown("---")
@@ -154,7 +175,12 @@ def _render_leader_dashboard(
                                   tooltip=['Date', 'Deduction_Value'])
                           .properties(title="未來60日 87MA 扣抵值預測"))
                 line_c = base.mark_line(color='#4B9CD3').encode(y='Current_Price')
-                st.altair_chart((line_d + line_c).interactive(), use_container_width=True)
+                layers = line_d + line_c
+                if 'Hold_Price' in chart_data.columns:
+                    layers += base.mark_line(color='#98FB98', opacity=0.8).encode(
+                        y='Hold_Price', tooltip=['Date', 'Hold_Price', 'MA_Flat'])
+                st.altair_chart(layers.interactive(), use_container_width=True)
+                st.caption("🟠 扣抵值 (收盤高於它，87MA 當日上彎) | 🟢 守價 (此後收盤守住，該日 87MA 不低於今日) | 🔵 現價")
             else:
                 st.warning("歷史資料不足，無法預測均線扣抵值。")
 
@@ -256,8 +282,8 @@ def render():
     macro, kb, strat = _load_engines()
     df = st.session_state.get('df', pd.DataFrame())
 
-    # ── 計算緩存鍵（用 df 長度+列名hash 代替傳入 df 本身）
-    df_hash = f"{len(df)}_{list(df.columns)}" if not df.empty else "empty"
+    # ── 計算緩存鍵（內容指紋，代替傳入 df 本身）
+    df_hash = frame_fingerprint(df)
 
     # ─────────────────────────────────────────────────────────────────────────
     # 1.1 宏觀風控 (Macro Risk)
@@ -421,7 +447,8 @@ def render():
             session_state_key="w15_data",
             fetch_function=macro.get_dynamic_turnover_leaders,
             top_n=100,
-            sort_key_name="成交值"
+            sort_key_name="成交值",
+            snapshot_name="turnover_leaders_100"
         )
 
     # ─────────────────────────────────────────────────────────────────────────
@@ -432,7 +459,8 @@ def render():
             session_state_key="w16_data",
             fetch_function=macro.get_high_price_leaders,
             top_n=50,
-            sort_key_name="股價"
+            sort_key_name="股價",
+            snapshot_name="high_price_leaders_50"
         )
 
     # ─────────────────────────────────────────────────────────────────────────
@@ -13,25 +13,29 @@ import numpy as np
 import altair as alt
 import plotly.express as px
 from datetime import datetime
-import yfinance as yf
 
 # ── V82 引擎導入 ──────────────────────────────────────────────────────────────
 from strategy import TitanStrategyEngine
-from knowledge_base import TitanKnowledgeBase
+from knowledge_base import get_knowledge_base
+from price_store import load_history, load_history_many
+from indicators import attach_ma, build_price_panel, ma_snapshot
+from data_engine import normalize_census_frame
+from fingerprint import frame_fingerprint
+from snapshot_store import get_snapshot_store
+from cb_archive import ARCHIVE_ERRORS, get_cb_archive
 
 @st.cache_resource
 def _load_engines():
-    kb = TitanKnowledgeBase()
+    kb = get_knowledge_base()
     strat = TitanStrategyEngine()
     strat.kb = kb
     return strat, kb
 
 @st.cache_data(ttl=600)
-def _get_scan_result(_strat_id, df_json):
-    """10分鐘緩存掃描結果"""
+def _get_scan_result(_strat_id, df_fingerprint, _df):
+    """10分鐘緩存掃描結果 (以內容指紋為鍵；_df 本身不參與雜湊)"""
     strat, _ = _load_engines()
-    df = pd.read_json(df_json)
-    return strat.scan_entire_portfolio(df)
+    return strat.scan_entire_portfolio(_df)
 
 
 # ═══════════════════════════════════════════════════════════════
@@ -45,18 +49,12 @@ def _plot_candle_chart(cb_code: str):
         target_code = target_code[:4]
 
     try:
-        chart_df = yf.download(f"{target_code}.TW", period="2y", progress=False)
-        if chart_df.empty:
-            chart_df = yf.download(f"{target_code}.TWO", period="2y", progress=False)
+        chart_df = load_history(target_code, period="2y")
         if chart_df.empty:
             st.error(f"❌ Yahoo Finance 查無此標的 K 線資料: {target_code}")
             return
 
-        if isinstance(chart_df.columns, pd.MultiIndex):
-            chart_df.columns = chart_df.columns.get_level_values(0)
-        chart_df = chart_df.reset_index()
-        chart_df['MA87']  = chart_df['Close'].rolling(87).mean()
-        chart_df['MA284'] = chart_df['Close'].rolling(284).mean()
+        chart_df = attach_ma(chart_df.reset_index())
 
         base = alt.Chart(chart_df).encode(
             x=alt.X('Date:T', axis=alt.Axis(title='日期', format='%Y-%m-%d'))
@@ -90,8 +88,8 @@ def _plot_candle_chart(cb_code: str):
 #  Tab 5 子分頁：產業風口地圖 (IC.TPEX 官方30大產業鏈 Treemap)
 # ═══════════════════════════════════════════════════════════════
 @st.cache_data(ttl=3600)
-def _get_tpex_data(df_json: str) -> pd.DataFrame:
-    full_data = pd.read_json(df_json)
+def _get_tpex_data(df_fingerprint: str, _full_data: pd.DataFrame) -> pd.DataFrame:
+    """以普查結果的內容指紋為快取鍵 (_full_data 本身不參與雜湊)"""
     chain_map = {
         # 半導體
         '世芯': ('半導體','⬆️ 上游-IC設計','IP/ASIC'), '創意': ('半導體','⬆️ 上游-IC設計','IP/ASIC'),
@@ -160,7 +158,7 @@ def _get_tpex_data(df_json: str) -> pd.DataFrame:
         if any(x in name for x in ['車', '汽']): return ('汽車工業','零組件','汽車')
         return ('其他','未分類','其他')
 
-    d = full_data.copy()
+    d = _full_data.copy()
     d[['L1','L2','L3']] = d['name'].apply(lambda x: pd.Series(classify(x)))
     d['ma87']  = pd.to_numeric(d.get('ma87',  pd.Series(dtype=float)), errors='coerce')
     d['price'] = pd.to_numeric(d.get('stock_price_real', pd.Series(dtype=float)), errors='coerce')
@@ -192,51 +190,36 @@ def _run_census(df: pd.DataFrame, min_score: int) -> tuple:
     strat, _ = _load_engines()
 
     # ── Step 1: 欄位標準化 ──────────────────────────────────────
-    work_df = df.copy()
-    rename_map = {
-        '代號': 'code', '名稱': 'name', '可轉債市價': 'price',
-        '轉換價格': 'conv_price', '轉換標的': 'stock_code',
-        '已轉換比例': 'conv_rate', '轉換價值': 'conv_value',
-        '發行日': 'issue_date', '賣回日': 'put_date',
-        '餘額比例': 'balance_ratio'
-    }
-    work_df.rename(columns=lambda c: rename_map.get(c.strip(), c.strip()), inplace=True)
-
-    # 餘額比例 → 已轉換率
-    if 'balance_ratio' in work_df.columns:
-        bal = pd.to_numeric(work_df['balance_ratio'], errors='coerce').fillna(100.0)
-        work_df['conv_rate'] = 100.0 - bal
-
-    # 型別安全
-    for col in ['price', 'conv_rate', 'conv_price', 'conv_value']:
-        work_df[col] = pd.to_numeric(work_df.get(col, pd.Series(dtype=float)), errors='coerce').fillna(0.0)
-
-    # 日期欄位
-    for dcol in ['issue_date', 'put_date', 'list_date']:
-        if dcol in work_df.columns:
-            work_df[dcol] = pd.to_datetime(work_df[dcol], errors='coerce')
-    if 'issue_date' not in work_df.columns and 'list_date' in work_df.columns:
-        work_df['issue_date'] = work_df['list_date']
+    work_df = normalize_census_frame(df)
 
     # ── Step 2: 策略評分 ────────────────────────────────────────
     try:
-        scan_df = strat.scan_entire_portfolio(work_df)
+        # 排程 (precompute.py) 已對同一份清單算好時直接沿用
+        scan_df = get_snapshot_store().load("cb_scan", source=frame_fingerprint(work_df))
+        if scan_df is None:
+            scan_df = strat.scan_entire_portfolio(work_df)
+            try:
+                get_cb_archive().append(scan_df, "scan")   # 歷史快照庫 (同日同內容略過)
+            except ARCHIVE_ERRORS as e:
+                st.warning(f"⚠️ CB 普查結果存檔失敗: {e}")
+        st.session_state['scan_version'] = scan_df.attrs.get('scan_version')
         records = scan_df.to_dict('records')
     except Exception as e:
         st.error(f"策略掃描失敗: {e}")
         return pd.DataFrame(), pd.DataFrame()
 
     # ── Step 3: 即時行情富集 ────────────────────────────────────
+    # 與 Step 2 共用同一批日K (PriceStore 記憶體層)，僅 Step 2 未取得者才連網
     total = len(records)
     progress_bar = st.progress(0)
     status_text  = st.empty()
+    status_text.text(f"批次取得 {total} 檔標的日K…")
+    codes  = [str(r.get('stock_code', '')).strip() for r in records]
+    frames = load_history_many([c for c in codes if c], period="2y")
+    snap   = ma_snapshot(build_price_panel(frames)).to_dict('index')
     enriched = []
 
-    for i, row in enumerate(records):
-        name = row.get('name', '')
-        status_text.text(f"普查進行中 ({i+1}/{total}): {name}…")
-
-        code = str(row.get('stock_code', '')).strip()
+    for i, (row, code) in enumerate(zip(records, codes)):
         row['stock_price_real'] = 0.0
         row['ma87'] = 0.0
         row['ma284'] = 0.0
@@ -245,23 +228,15 @@ def _run_census(df: pd.DataFrame, min_score: int) -> tuple:
         row['conv_price_val'] = row.get('conv_price', 0.0)
         row['conv_value_val'] = row.get('conv_value', 0.0)
 
-        if code:
-            try:
-                hist = yf.Ticker(f"{code}.TW").history(period="2y")
-                if hist.empty:
-                    hist = yf.Ticker(f"{code}.TWO").history(period="2y")
-                if not hist.empty and len(hist) > 284:
-                    curr  = float(hist['Close'].iloc[-1])
-                    ma87  = float(hist['Close'].rolling(87).mean().iloc[-1])
-                    ma284 = float(hist['Close'].rolling(284).mean().iloc[-1])
-                    row.update({'stock_price_real': curr, 'ma87': ma87, 'ma284': ma284})
-                    if ma87 > ma284:
-                        row['trend_status'] = "✅ 中期多頭"
-                        row['score'] = min(100, row.get('score', 0) + 20)
-                    else:
-                        row['trend_status'] = "整理/空頭"
-            except Exception:
-                pass
+        tech = snap.get(code)
+        if tech is not None and tech['n_obs'] > 284:
+            row.update({'stock_price_real': float(tech['price']),
+                        'ma87': float(tech['ma87']), 'ma284': float(tech['ma284'])})
+            if tech['ma87'] > tech['ma284']:
+                row['trend_status'] = "✅ 中期多頭"
+                row['score'] = min(100, row.get('score', 0) + 20)
+            else:
+                row['trend_status'] = "整理/空頭"
 
         enriched.append(row)
         progress_bar.progress((i + 1) / total)
@@ -341,6 +316,15 @@ def _render_cb_card(row, badge: str = "👑", report_title: str = "📄 查看
             st.markdown("### 5. 出場/風控 (Exit/Risk)")
             st.markdown("* 🛑 停損: CB 跌破 100 元 (保本天條)。")
             st.markdown("* 💰 停利: 目標價 152 元以上，嚴守「留魚尾」策略。")
+
+            # 引擎完整報告：勾選時才生成 (同一份普查結果內重複查看直接取快取)
+            if st.checkbox("🧠 載入引擎完整報告 (含 SOP 原文引用)", key=f"full_report_{badge}_{cb_code}"):
+                strat, _ = _load_engines()
+                report = strat.get_report(cb_code, st.session_state.get('scan_version'))
+                if report:
+                    st.markdown(report, unsafe_allow_html=True)
+                else:
+                    st.info("此普查結果來自預先計算快照或已過期，請重新執行普查以產生完整報告。")
             st.divider()
             _plot_candle_chart(cb_code)
 
@@ -605,8 +589,7 @@ def render():
             with sub5:
                 st.subheader("🌌 IC.TPEX 官方產業價值矩陣")
 
-                full_json = pd.DataFrame(st.session_state['full_census_data']).to_json()
-                df_galaxy = _get_tpex_data(full_json)
+                df_galaxy = _get_tpex_data(frame_fingerprint(full_data), full_data)
 
                 if df_galaxy.empty:
                     st.info("無資料，請先執行普查。")
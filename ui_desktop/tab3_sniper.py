@@ -3,7 +3,7 @@
 # [靈魂注入 V82.0 → V100.0]
 # 完整移植：
 #   3.1 萬用個股狙擊雷達
-#     t1 量子路徑預演 (G-Score + 波動率機率錐 + 五維劇本)
+#     t1 量子路徑預演 (G-Score + 蒙地卡羅機率錐 + 交叉機率 + 五維劇本)
 #     t2 亞當理論二次反射
 #     t3 日K線 (黃金/死亡交叉標記)
 #     t4 月K線 (43/87/284MA)
@@ -19,6 +19,11 @@ import yfinance as yf
 
 # ── V82 引擎導入 ──────────────────────────────────────────────────────────────
 from macro_risk import MacroRiskEngine
+from price_store import get_exchange_map
+from indicators import attach_ma
+from montecarlo import ma_path_forecast
+
+_MC_METHODS = {"GBM": "gbm", "區塊自助抽樣": "bootstrap"}
 
 @st.cache_resource
 def _load_macro():
@@ -135,7 +140,7 @@ def render():
 
         # 雙軌候選
         cands = [w17_in]
-        if w17_in.isdigit(): cands = [f"{w17_in}.TW", f"{w17_in}.TWO"]
+        if w17_in.isdigit(): cands = get_exchange_map().candidates(w17_in) or [f"{w17_in}.TW"]
         elif not w17_in.endswith((".TW", ".TWO")): cands = [w17_in.upper(), f"{w17_in.upper()}.TW"]
 
         sdf = pd.DataFrame(); v_ticker = None
@@ -144,6 +149,7 @@ def render():
                 temp = macro.get_single_stock_data(c, period="max")
                 if not temp.empty and len(temp) >= 300:
                     sdf = temp; v_ticker = c; break
+        if v_ticker: get_exchange_map().learn([v_ticker])
 
         if sdf.empty:
             st.error("❌ 查無數據，或歷史數據不足 300 天無法計算年線扣抵。")
@@ -176,8 +182,7 @@ def render():
             st.error(f"資料格式錯誤: {e}"); return
 
         # ── 指標計算 ──────────────────────────────────────────────
-        sdf['MA87']  = sdf['Close'].rolling(87).mean()
-        sdf['MA284'] = sdf['Close'].rolling(284).mean()
+        attach_ma(sdf)
         sdf['Prev_MA87']  = sdf['MA87'].shift(1)
         sdf['Prev_MA284'] = sdf['MA284'].shift(1)
         sdf['Cross_Signal'] = 0
@@ -227,44 +232,39 @@ def render():
             hist_vol = sdf['Close'].pct_change().std() * 100
             cur_vol  = max(1.5, hist_vol)
             with st.expander("⚙️ 戰略參數設定", expanded=False):
-                sc1, sc2 = st.columns(2)
+                sc1, sc2, sc3 = st.columns(3)
                 sim_days = sc1.slider("預演天數", 10, 60, 20)
                 momentum = sc2.number_input("假設動能 (%)", -10.0, 10.0, 0.0, step=0.5)
                 sc2.caption(f"目前波動率: {cur_vol:.1f}%")
+                mc_label = sc3.radio("路徑模擬", list(_MC_METHODS), horizontal=True,
+                                     help="GBM：常態報酬；區塊自助抽樣：重抽歷史連續報酬，保留肥尾與波動叢聚")
 
             last_date  = sdf.index[-1]
-            fut_dates  = [last_date + pd.Timedelta(days=i+1) for i in range(sim_days)]
-            slope_10   = (sdf['Close'].iloc[-1] - sdf['Close'].iloc[-10]) / 10
-            path_iner  = [cp + slope_10*(i+1) for i in range(sim_days)]
-            path_bull  = [cp * (1 + (cur_vol/100) * np.sqrt(i+1)) for i in range(sim_days)]
-            path_bear  = [cp * (1 - (cur_vol/100) * np.sqrt(i+1)) for i in range(sim_days)]
-
-            sim_prices = []; curr_s = cp
-            for _ in range(sim_days):
-                curr_s *= (1 + momentum/100); sim_prices.append(curr_s)
-
-            fut_series  = pd.Series(sim_prices, index=fut_dates)
-            combined    = pd.concat([sdf['Close'], fut_series])
-            comb_ma87   = combined.rolling(87).mean()
-            comb_ma284  = combined.rolling(284).mean()
-            si = len(sdf); ac = combined.values
-            d87  = [float(ac[si+i-87])  if (si+i-87)  >= 0 else np.nan for i in range(sim_days)]
-            d284 = [float(ac[si+i-284]) if (si+i-284) >= 0 else np.nan for i in range(sim_days)]
+            fut_dates  = pd.date_range(last_date + pd.Timedelta(days=1), periods=sim_days)
+            close_arr  = sdf['Close'].to_numpy(dtype=float)
+            mc = ma_path_forecast(close_arr, sim_days, method=_MC_METHODS[mc_label], drift_pct=momentum)
+            qs = mc['quantiles']
+
+            sim_prices = cp * (1 + momentum/100) ** np.arange(1, sim_days + 1)
+            d87, d284  = mc['deduct87'], mc['deduct284']
 
             f_df = pd.DataFrame({
                 'Date':      fut_dates,
                 'Sim_Price': sim_prices,
-                'Bull_Bound':path_bull,
-                'Bear_Bound':path_bear,
-                'MA87':      comb_ma87.loc[fut_dates].values,
-                'MA284':     comb_ma284.loc[fut_dates].values,
+                'Bull_Bound':qs[95],
+                'Bear_Bound':qs[5],
+                'Q75':       qs[75],
+                'Q25':       qs[25],
+                'Median':    qs[50],
+                'MA87':      mc['ma87_median'],
+                'MA284':     mc['ma284_median'],
                 'Deduct_87': d87,
                 'Deduct_284':d284
             })
 
             # G-Score
             score = 0
-            ma87c = comb_ma87.iloc[-sim_days-1]; ma284c = comb_ma284.iloc[-sim_days-1]
+            ma87c = mc['ma87_now']; ma284c = mc['ma284_now']
             if cp > ma87c:  score += 15
             if cp > ma284c: score += 15
             if cp > sdf['Close'].iloc[-20:].mean(): score += 20
@@ -284,10 +284,12 @@ def render():
             else:
                 sq_msg = "📉 **空頭壓制**：均線呈空頭排列，上方層層賣壓。"
 
-            fib_high  = max(path_bull); fib_low = min(path_bear)
+            fib_high  = float(qs[95].max()); fib_low = float(qs[5].min())
             fib_0618  = fib_low + (fib_high - fib_low) * 0.618
             var_date  = (last_date + pd.Timedelta(days=13)).strftime('%m/%d')
-            d87_first = d87[0] if d87 and not np.isnan(d87[0]) else 0
+            d87_first = d87[0] if len(d87) and not np.isnan(d87[0]) else 0
+            d284_txt  = f"{d284[0]:.1f}" if len(d284) and not np.isnan(d284[0]) else "N/A"
+            d87_floor = np.nanmin(d87[:5]) if np.isfinite(d87[:5]).any() else 0
 
             st.markdown(f"""
 <div style="background:#1E1E1E;padding:16px;border-radius:10px;border:1px solid #444;">
@@ -298,7 +300,7 @@ def render():
 <p style="color:#ccc;font-size:14px;margin-top:5px;">{sq_msg}</p>
 <p style="color:#ccc;font-size:14px;">
   • <b>87MA (季)</b>：{ma87c:.1f} | 扣抵：{d87_first:.1f} ({'扣低助漲' if d87_first < cp else '扣高壓力'})<br>
-  • <b>284MA (年)</b>：{ma284c:.1f} | 扣抵：{d284[0]:.1f if d284 and not np.isnan(d284[0]) else 'N/A'}
+  • <b>284MA (年)</b>：{ma284c:.1f} | 扣抵：{d284_txt}
 </p>
 <hr style="border-top:1px solid #555;">
 <h4 style="color:#98FB98;margin:0;">🔮 五維全息劇本 (Scenarios)</h4>
@@ -306,13 +308,24 @@ def render():
 <ul style="color:#ccc;font-size:14px;padding-left:20px;">
   <li><b>劇本 A (慣性 50%)</b>：在 <b>{fib_low:.1f} ~ {fib_high:.1f}</b> 區間震盪，以盤代跌。</li>
   <li><b>劇本 B (破底翻 30%)</b>：回測 <b>{fib_0618:.1f}</b> (Fib 0.618) 不破，V型反轉。</li>
-  <li><b>劇本 C (風險 20%)</b>：若跌破 <b>{min(d87[:5]):.1f if d87 else 0}</b>，確認均線蓋頭向下。</li>
+  <li><b>劇本 C (風險 20%)</b>：若跌破 <b>{d87_floor:.1f}</b>，確認均線蓋頭向下。</li>
 </ul>
 </div>""", unsafe_allow_html=True)
             st.write("")
 
+            p1, p2, p3, p4 = st.columns(4)
+            p1.metric("黃金交叉機率", f"{mc['p_golden']:.1%}")
+            p2.metric("死亡交叉機率", f"{mc['p_death']:.1%}")
+            p3.metric("跌破 87MA 機率", f"{mc['p_break87']:.1%}")
+            p4.metric("期末站穩 87MA", f"{mc['p_above87_end']:.1%}")
+            first_x = mc['first_cross_day']
+            st.caption(f"🎲 {mc['n_paths']:,} 條 {mc_label} 路徑 · {sim_days} 日內"
+                       + (f" · 交叉路徑首次交叉中位數：第 {first_x:.0f} 日" if not np.isnan(first_x) else ""))
+
             base_f  = alt.Chart(f_df).encode(x='Date:T')
-            cone    = base_f.mark_area(opacity=0.15, color='gray').encode(y='Bear_Bound:Q', y2='Bull_Bound:Q')
+            cone    = base_f.mark_area(opacity=0.12, color='gray').encode(y='Bear_Bound:Q', y2='Bull_Bound:Q')
+            core    = base_f.mark_area(opacity=0.22, color='gray').encode(y='Q25:Q', y2='Q75:Q')
+            l_med   = base_f.mark_line(color='lightgray', opacity=0.8).encode(y='Median')
             l_sim   = base_f.mark_line(color='white', strokeDash=[4,2]).encode(y='Sim_Price')
             l_87    = base_f.mark_line(color='orange', strokeWidth=2).encode(y='MA87')
             l_284   = base_f.mark_line(color='#00bfff', strokeWidth=2).encode(y='MA284')
@@ -323,8 +336,8 @@ def render():
             candles = (bh.mark_rule().encode(y='Low', y2='High') +
                        bh.mark_bar().encode(y='Open', y2='Close',
                            color=alt.condition("datum.Open<=datum.Close", alt.value("#FF4B4B"), alt.value("#26A69A"))))
-            final_c = (cone + candles + l_sim + l_87 + l_284 + g_87 + g_284).properties(
-                height=500, title="量子路徑預演 (含波動率機率錐)")
+            final_c = (cone + core + candles + l_med + l_sim + l_87 + l_284 + g_87 + g_284).properties(
+                height=500, title="量子路徑預演 (蒙地卡羅 5/25/50/75/95 分位機率錐)")
             st.altair_chart(final_c.interactive(), use_container_width=True)
 
         # ─── T2: 亞當理論 ────────────────────────────────────────
@@ -383,9 +396,7 @@ def render():
                 except Exception: freq = 'M'
                 md = sdf.resample(freq).agg({'Open':'first','High':'max','Low':'min','Close':'last'}).dropna()
                 if len(md) >= 43:
-                    md['MA43']  = md['Close'].rolling(43).mean()
-                    md['MA87']  = md['Close'].rolling(87).mean()
-                    md['MA284'] = md['Close'].rolling(284).mean()
+                    attach_ma(md, windows=(43, 87, 284))
                     pm = md.tail(120).reset_index()
                     bm = alt.Chart(pm).encode(x=alt.X('Date:T', axis=alt.Axis(format='%Y-%m')))
                     col_m = alt.condition("datum.Open<=datum.Close", alt.value("#FF4B4B"), alt.value("#26A69A"))
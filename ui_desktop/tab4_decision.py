@@ -1,7 +1,7 @@
 # ui_desktop/tab4_decision.py
 # Titan SOP V100.0 — Tab 4: 全球決策
 # [靈魂注入 V82.0 → V100.0 完整版]
-# 所有 backtest 函式已內建（不依賴外部 backtest 模組）
+# 回測函式內建；15 種均線戰法走 backtest 陣列狀態機核心
 
 import streamlit as st
 import pandas as pd
@@ -12,124 +12,95 @@ import re
 import io
 from datetime import datetime
 
+from config import Config
+from price_store import get_price_store, load_history, load_history_many
+from backtest import ma_lab_backtest, ma_sweep, sweep_table
+from optimizer import optimize_ticker, param_grid
+
 # ═══════════════════════════════════════════════════════════════
-#  內建回測引擎函式 (從 V82 移植)
+#  內建回測引擎函式 (從 V82 移植；日K 統一經由 price_store)
 # ═══════════════════════════════════════════════════════════════
 
+def _cash_result(start_date, initial_capital):
+    """現金部位：權益固定、回撤為 0"""
+    dates = get_price_store().get('^TWII', start=start_date).index
+    if dates.empty: return None
+    return {"cagr": 0.0, "sharpe_ratio": 0.0, "max_drawdown": 0.0,
+            "win_rate": 0.0, "profit_factor": 0.0, "kelly": 0.0,
+            "equity_curve": pd.Series(float(initial_capital), index=dates, name='Equity'),
+            "drawdown_series": pd.Series(0.0, index=dates, name='Drawdown'), "latest_price": 1.0}
+
+
 @st.cache_data(ttl=600)
-def _run_fast_backtest(ticker, start_date="2023-01-01", initial_capital=1_000_000):
-    """極速向量化回測引擎 (V78.3)"""
+def _run_portfolio_backtest(tickers, start_date="2023-01-01", initial_capital=1_000_000):
+    """
+    極速向量化回測 (V78.3 → V100)：全部資產一次批次讀取，
+    「價格 > 20MA」策略以 backtest.ma_sweep 矩陣廣播同時計算。
+    回傳 ({代號: 結果}, {代號: 失敗原因})；單一資產失敗不影響其他資產。
+    """
+    out, errors = {}, {}
+    cash = [t for t in tickers if t.upper() in ['CASH', 'USD', 'TWD']]
+    for t in cash:
+        try:
+            r = _cash_result(start_date, initial_capital)
+        except Exception as e:
+            errors[t] = f"現金基準 (^TWII 交易日) 讀取失敗: {e}"
+            continue
+        if r: out[t] = r
+
+    rest = [t for t in tickers if t not in cash]
     try:
-        if ticker.upper() in ['CASH', 'USD', 'TWD']:
-            dates = yf.download('^TWII', start=start_date, progress=False).index
-            if dates.empty: return None
-            df = pd.DataFrame(index=dates)
-            df['Equity'] = initial_capital; df['Drawdown'] = 0.0
-            return {"cagr": 0.0, "sharpe_ratio": 0.0, "max_drawdown": 0.0,
-                    "win_rate": 0.0, "profit_factor": 0.0, "kelly": 0.0,
-                    "equity_curve": df['Equity'], "drawdown_series": df['Drawdown'], "latest_price": 1.0}
-
-        original_ticker = ticker
-        if re.match(r'^[0-9]', ticker) and 4 <= len(ticker) <= 6:
-            ticker = f"{ticker}.TW"
-        df = yf.download(ticker, start=start_date, progress=False)
-        if df.empty and re.match(r'^[0-9]', original_ticker) and 4 <= len(original_ticker) <= 6:
-            df = yf.download(f"{original_ticker}.TWO", start=start_date, progress=False)
-        if df.empty or len(df) < 21: return None
-        if isinstance(df.columns, pd.MultiIndex): df.columns = df.columns.get_level_values(0)
-
-        df['MA20'] = df['Close'].rolling(20).mean()
-        df['Signal'] = (df['Close'] > df['MA20']).astype(int)
-        df['Pct_Change'] = df['Close'].pct_change()
-        df['Strategy_Return'] = df['Signal'].shift(1) * df['Pct_Change']
-        df['Equity'] = (1 + df['Strategy_Return'].fillna(0)).cumprod() * initial_capital
-        df['Drawdown'] = (df['Equity'] / df['Equity'].cummax()) - 1
-
-        trade_days = df[df['Signal'].shift(1) == 1]
-        if len(trade_days) >= 10:
-            wins = trade_days[trade_days['Strategy_Return'] > 0]['Strategy_Return']
-            losses = trade_days[trade_days['Strategy_Return'] < 0]['Strategy_Return']
-            win_rate = len(wins) / len(trade_days)
-            avg_win = wins.mean() if len(wins) > 0 else 0
-            avg_loss = abs(losses.mean()) if len(losses) > 0 else 1
-            pf = avg_win / avg_loss if avg_loss != 0 else 0
-            kelly = max(0, win_rate - ((1 - win_rate) / pf)) if pf > 0 else 0
-        else:
-            win_rate = pf = kelly = 0
-
-        num_years = len(df) / 252
-        total_return = df['Equity'].iloc[-1] / initial_capital - 1
-        cagr = ((1 + total_return) ** (1 / num_years)) - 1 if num_years > 0 else 0
-        daily_ret = df['Strategy_Return'].dropna()
-        sharpe = (daily_ret.mean() * 252 - 0.02) / (daily_ret.std() * np.sqrt(252)) if daily_ret.std() > 0 else 0
-
-        return {"cagr": cagr, "sharpe_ratio": sharpe, "max_drawdown": df['Drawdown'].min(),
-                "win_rate": win_rate, "profit_factor": pf, "kelly": kelly,
-                "equity_curve": df['Equity'], "drawdown_series": df['Drawdown'],
-                "latest_price": float(df['Close'].iloc[-1])}
+        frames = load_history_many(rest, start=start_date)
+    except Exception as e:
+        frames = {}
+        errors.update({t: f"日K 讀取失敗: {e}" for t in rest})
+    frames = {t: df for t, df in frames.items() if len(df) >= 21}
+    try:
+        for r in ma_sweep(frames, ["價格 > 20MA"], initial_capital):
+            out[r['ticker']] = r
     except Exception:
-        return None
+        # 整批廣播失敗時退回逐檔，讓錯誤只落在出問題的資產
+        for t, df in frames.items():
+            try:
+                out[t] = ma_sweep({t: df}, ["價格 > 20MA"], initial_capital)[0]
+            except Exception as e:
+                errors[t] = f"回測失敗: {e}"
+    for t in tickers:
+        if t not in out and t not in errors:
+            errors[t] = "查無資料或日K不足 21 根"
+    return out, errors
+
+
+@st.cache_data(ttl=7200)
+def _run_ma_lab(ticker, start_date="2015-01-01", initial_capital=1_000_000):
+    """15 種均線策略回測 (backtest 陣列狀態機核心，均線只算一次)"""
+    try:
+        df = load_history(ticker, start=start_date)
+        if df.empty or len(df) < 300: return []
+        return ma_lab_backtest(df, initial_capital=initial_capital)
+    except Exception:
+        return []
+
+
+@st.cache_data(ttl=7200)
+def _run_ma_grid(tickers, start_date="2015-01-01", initial_capital=1_000_000):
+    """全資產 × 15 種均線策略：每檔只讀一次，整個網格一次廣播計算"""
+    try:
+        frames = load_history_many(list(tickers), start=start_date)
+        frames = {t: df for t, df in frames.items() if len(df) >= 300}
+        return sweep_table(ma_sweep(frames, initial_capital=initial_capital))
+    except Exception:
+        return pd.DataFrame()
 
 
 @st.cache_data(ttl=7200)
-def _run_ma_strategy_backtest(ticker, strategy_name, start_date="2015-01-01", initial_capital=1_000_000):
-    """15 種均線策略回測引擎"""
+def _run_param_optimizer(ticker, method="grid", objective="sharpe", start_date="1990-01-01"):
+    """87/284 + 乖離帶參數網格 / 隨機搜尋，附 Walk-Forward 樣本外檢驗"""
     try:
-        original_ticker = ticker
-        if re.match(r'^[0-9]', ticker) and 4 <= len(ticker) <= 6:
-            ticker = f"{ticker}.TW"
-        df = yf.download(ticker, start=start_date, progress=False)
-        if df.empty and re.match(r'^[0-9]', original_ticker):
-            df = yf.download(f"{original_ticker}.TWO", start=start_date, progress=False)
-        if df.empty or len(df) < 300: return None
-        if isinstance(df.columns, pd.MultiIndex): df.columns = df.columns.get_level_values(0)
-
-        for w, n in [(20,'MA20'),(43,'MA43'),(60,'MA60'),(87,'MA87'),(284,'MA284')]:
-            df[n] = df['Close'].rolling(w).mean()
-
-        df['Signal'] = 0
-        sn = strategy_name
-        if   sn == "價格 > 20MA":  df.loc[df['Close'] > df['MA20'],  'Signal'] = 1
-        elif sn == "價格 > 43MA":  df.loc[df['Close'] > df['MA43'],  'Signal'] = 1
-        elif sn == "價格 > 60MA":  df.loc[df['Close'] > df['MA60'],  'Signal'] = 1
-        elif sn == "價格 > 87MA":  df.loc[df['Close'] > df['MA87'],  'Signal'] = 1
-        elif sn == "價格 > 284MA": df.loc[df['Close'] > df['MA284'], 'Signal'] = 1
-        elif sn == "20/60 黃金/死亡交叉":  df.loc[df['MA20'] > df['MA60'],  'Signal'] = 1
-        elif sn == "20/87 黃金/死亡交叉":  df.loc[df['MA20'] > df['MA87'],  'Signal'] = 1
-        elif sn == "20/284 黃金/死亡交叉": df.loc[df['MA20'] > df['MA284'], 'Signal'] = 1
-        elif sn == "43/87 黃金/死亡交叉":  df.loc[df['MA43'] > df['MA87'],  'Signal'] = 1
-        elif sn == "43/284 黃金/死亡交叉": df.loc[df['MA43'] > df['MA284'], 'Signal'] = 1
-        elif sn == "60/87 黃金/死亡交叉":  df.loc[df['MA60'] > df['MA87'],  'Signal'] = 1
-        elif sn == "60/284 黃金/死亡交叉": df.loc[df['MA60'] > df['MA284'], 'Signal'] = 1
-        elif sn == "🔥 核心戰法: 87MA ↗ 284MA": df.loc[df['MA87'] > df['MA284'], 'Signal'] = 1
-        elif sn == "非對稱: P>20進 / P<60出":
-            pos = False
-            for i in range(1, len(df)):
-                if not pos and df['Close'].iloc[i] > df['MA20'].iloc[i]: pos = True
-                elif pos and df['Close'].iloc[i] < df['MA60'].iloc[i]: pos = False
-                df.iloc[i, df.columns.get_loc('Signal')] = 1 if pos else 0
-        elif sn == "雙確認: P>20 & P>60 進 / P<60 出":
-            pos = False
-            for i in range(1, len(df)):
-                if not pos and df['Close'].iloc[i] > df['MA20'].iloc[i] and df['Close'].iloc[i] > df['MA60'].iloc[i]: pos = True
-                elif pos and df['Close'].iloc[i] < df['MA60'].iloc[i]: pos = False
-                df.iloc[i, df.columns.get_loc('Signal')] = 1 if pos else 0
-
-        df['Pct_Change'] = df['Close'].pct_change()
-        df['Strategy_Return'] = df['Signal'].shift(1) * df['Pct_Change']
-        df['Equity'] = (1 + df['Strategy_Return'].fillna(0)).cumprod() * initial_capital
-        df['Drawdown'] = (df['Equity'] / df['Equity'].cummax()) - 1
-
-        num_years = len(df) / 252
-        total_return = df['Equity'].iloc[-1] / initial_capital - 1
-        cagr = ((1 + total_return) ** (1 / num_years)) - 1 if num_years > 0 else 0
-
-        return {"strategy_name": strategy_name, "cagr": cagr,
-                "final_equity": df['Equity'].iloc[-1],
-                "max_drawdown": df['Drawdown'].min(),
-                "future_10y_capital": initial_capital * ((1 + cagr) ** 10),
-                "num_years": num_years,
-                "equity_curve": df['Equity'], "drawdown_series": df['Drawdown']}
+        df = load_history(ticker, start=start_date)
+        grid = param_grid(method=method)
+        if df.empty or len(df) <= int(grid['long'].max()) + 252: return None
+        return optimize_ticker(df['Close'].to_numpy(dtype=float), grid, df.index, objective=objective)
     except Exception:
         return None
 
@@ -147,8 +118,7 @@ def _run_stress_test(portfolio_text):
     if not portfolio: return pd.DataFrame(), {}
 
     try:
-        bench = yf.download(['USDTWD=X'], period="1mo", progress=False)
-        if isinstance(bench.columns, pd.MultiIndex): bench.columns = bench.columns.get_level_values(0)
+        bench = get_price_store().get('USDTWD=X', period="1mo")
         twd_fx = float(bench['Close'].iloc[-1]) if not bench.empty else 32.0
     except: twd_fx = 32.0
 
@@ -160,15 +130,10 @@ def _run_stress_test(portfolio_text):
             r = {'ticker': orig, 'type': 'Cash', 'shares': shares, 'price': 1.0, 'value_twd': shares}
             for k in scenarios: r[f'損益_{k}'] = 0
             results.append(r); continue
-        ticker = orig
         is_tw = re.match(r'^[0-9]', orig) and 4 <= len(orig) <= 6
-        if is_tw: ticker = f"{orig}.TW"
         try:
-            data = yf.download(ticker, period="1mo", progress=False)
-            if data.empty and is_tw:
-                data = yf.download(f"{orig}.TWO", period="1mo", progress=False)
+            data = load_history(orig, period="1mo")
             if data.empty: continue
-            if isinstance(data.columns, pd.MultiIndex): data.columns = data.columns.get_level_values(0)
             price = float(data['Close'].iloc[-1])
             value = price * shares * (1 if is_tw else twd_fx)
             r = {'ticker': orig, 'type': 'TW' if is_tw else 'US', 'shares': shares, 'price': price, 'value_twd': value}
@@ -248,13 +213,16 @@ def render():
                 st.warning("請先在 4.1 配置您的戰略資產。")
             else:
                 with st.spinner("正在對全球資產執行回測…"):
+                    tickers = tuple(dict.fromkeys(str(t).strip() for t in pf['資產代號']))
+                    results, errors = _run_portfolio_backtest(tickers)
                     res_list = []
-                    for _, row in pf.iterrows():
-                        r = _run_fast_backtest(str(row['資產代號']).strip())
+                    for t in pf['資產代號']:
+                        r = results.get(str(t).strip())
                         if r:
-                            r['Ticker'] = row['資產代號']
-                            res_list.append(r)
+                            res_list.append({**r, 'Ticker': t})
                     st.session_state.backtest_results = res_list
+                for t, msg in errors.items():
+                    st.warning(f"⚠️ {t}：{msg}")
 
         if 'backtest_results' in st.session_state:
             res_list = st.session_state.backtest_results
@@ -313,18 +281,9 @@ def render():
             st.warning("請先在 4.1 配置您的戰略資產。")
         else:
             lab_t = st.selectbox("選擇回測標的", pf['資產代號'].tolist(), key="ma_lab_ticker")
-            strategies = [
-                "價格 > 20MA", "價格 > 43MA", "價格 > 60MA", "價格 > 87MA", "價格 > 284MA",
-                "非對稱: P>20進 / P<60出", "20/60 黃金/死亡交叉", "20/87 黃金/死亡交叉",
-                "20/284 黃金/死亡交叉", "43/87 黃金/死亡交叉", "43/284 黃金/死亡交叉",
-                "60/87 黃金/死亡交叉", "60/284 黃金/死亡交叉", "🔥 核心戰法: 87MA ↗ 284MA",
-                "雙確認: P>20 & P>60 進 / P<60 出"
-            ]
-
             if st.button("🔬 啟動 15 種均線實驗", key="start_ma_lab"):
                 with st.spinner(f"正在對 {lab_t} 執行 15 種均線策略回測…"):
-                    ma_res = [_run_ma_strategy_backtest(lab_t, s) for s in strategies]
-                    st.session_state.ma_lab_results = [r for r in ma_res if r]
+                    st.session_state.ma_lab_results = _run_ma_lab(lab_t)
                     st.session_state.ma_lab_ticker  = lab_t
 
             if ('ma_lab_results' in st.session_state and
@@ -378,6 +337,60 @@ def render():
                     fig2.update_layout(template='plotly_dark')
                     st.plotly_chart(fig2, use_container_width=True)
 
+            st.divider()
+            if st.button("🧮 全資產 × 15 種均線策略總表", key="start_ma_grid"):
+                assets = tuple(dict.fromkeys(
+                    str(t).strip() for t, c in zip(pf['資產代號'], pf['資產類別']) if c != 'Cash'))
+                with st.spinner(f"正在對 {len(assets)} 檔資產 × 15 種策略執行矩陣回測…"):
+                    st.session_state.ma_grid_table = _run_ma_grid(assets)
+
+            grid = st.session_state.get('ma_grid_table')
+            if grid is not None:
+                if grid.empty:
+                    st.error("全資產回測失敗 (需至少 300 根日K)。")
+                else:
+                    gt = grid.rename(columns={
+                        'ticker': '代號', 'strategy_name': '策略名稱', 'cagr': '年化報酬 (CAGR)',
+                        'max_drawdown': '最大回撤', 'sharpe_ratio': 'Sharpe', 'kelly': '凱利 %',
+                    })[['代號', '策略名稱', '年化報酬 (CAGR)', '最大回撤', 'Sharpe', '凱利 %']]
+                    st.dataframe(gt.pivot(index='策略名稱', columns='代號', values='年化報酬 (CAGR)')
+                                 .style.format('{:.2%}'),
+                                 use_container_width=True)
+                    st.dataframe(gt.sort_values('年化報酬 (CAGR)', ascending=False).style.format({
+                        '年化報酬 (CAGR)': '{:.2%}', '最大回撤': '{:.2%}', 'Sharpe': '{:.2f}', '凱利 %': '{:.2%}',
+                    }), use_container_width=True)
+
+            st.divider()
+            oc1, oc2 = st.columns(2)
+            opt_method = oc1.radio("搜尋方式", ["grid", "random"], horizontal=True, key="opt_method",
+                                   format_func=lambda m: "全網格" if m == "grid" else "隨機 500 組")
+            opt_obj = oc2.radio("最佳化目標", ["sharpe", "cagr"], horizontal=True, key="opt_objective",
+                                format_func=lambda m: "Sharpe" if m == "sharpe" else "CAGR")
+            if st.button(f"🎯 {lab_t} 均線 / 乖離帶參數最佳化 (Walk-Forward)", key="start_param_opt"):
+                with st.spinner("正在搜尋 (短均, 長均, 乖離帶) 參數組合…"):
+                    st.session_state.param_opt = (lab_t, _run_param_optimizer(lab_t, opt_method, opt_obj))
+
+            opt = st.session_state.get('param_opt')
+            if opt and opt[0] == lab_t:
+                if opt[1] is None:
+                    st.error("資料不足，無法進行參數最佳化 (需長於最長均線 + 1 年)。")
+                else:
+                    res = opt[1]
+                    st.caption(f"共 {len(res['results'])} 組參數；基準 = "
+                               f"{Config.MA_LIFE_LINE}/{Config.MA_LONG_TERM} MA、乖離 ±{Config.OPT_BIAS_BAND_BASE}%")
+                    stab = res['stability']
+                    if stab:
+                        m1, m2, m3, m4 = st.columns(4)
+                        m1.metric("樣本外平均成績", f"{stab['mean_oos_score']:.2f}")
+                        m2.metric("樣本外為正比例", f"{stab['oos_positive_ratio']:.0%}")
+                        m3.metric("勝過基準比例", f"{stab['beat_baseline_ratio']:.0%}")
+                        m4.metric("樣本內外排名相關", f"{stab['mean_rank_corr']:.2f}")
+                        st.dataframe(res['walk_forward'], use_container_width=True)
+                    top = res['results'].sort_values(opt_obj, ascending=False).head(20)
+                    st.dataframe(top.style.format({'band': '±{:.0f}%', 'cagr': '{:.2%}',
+                                                   'max_drawdown': '{:.2%}', 'sharpe': '{:.2f}'}),
+                                 use_container_width=True)
+
     # ── 4.4 智慧調倉計算機 ──────────────────────────────────────
     with st.expander("4.4 ⚖️ 智慧調倉計算機 (Rebalancing Calculator)", expanded=False):
         pf = st.session_state.get('portfolio_df', pd.DataFrame()).copy()
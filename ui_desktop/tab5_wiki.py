@@ -2,7 +2,7 @@
 # Titan SOP V100.0 — Tab 5: 戰略百科
 # [靈魂注入 V82.0 → V100.0]
 # 完整移植：
-#   5.1 SOP 戰略百科 (5子分頁: 四大時間套利/進出場紀律/產業族群/特殊心法/OTC神奇均線)
+#   5.1 SOP 戰略百科 (全文檢索 + 5子分頁: 四大時間套利/進出場紀律/產業族群/特殊心法/OTC神奇均線)
 #   5.2 情報獵殺分析結果
 #   5.3 CBAS 槓桿試算儀
 #   5.4 時間套利行事曆
@@ -11,12 +11,12 @@ import streamlit as st
 import pandas as pd
 from datetime import datetime, timedelta
 
-from knowledge_base import TitanKnowledgeBase
+from knowledge_base import get_knowledge_base
 from execution import CalendarAgent
 
 @st.cache_resource
 def _load_kb():
-    return TitanKnowledgeBase()
+    return get_knowledge_base()
 
 @st.cache_resource
 def _load_calendar():
@@ -33,6 +33,22 @@ def render():
     # 5.1 SOP 戰略百科
     # ─────────────────────────────────────────────────────────────
     with st.expander("5.1 📖 SOP 戰略百科 (SOP Strategy Encyclopedia)", expanded=True):
+        q1, q2 = st.columns([4, 1])
+        query = q1.text_input("🔎 SOP 全文檢索", placeholder="例：亞當理論、扣抵值、賣回 避稅、CBAS 槓桿",
+                              key="wiki_search_query")
+        top_k = q2.number_input("筆數", min_value=5, max_value=50, value=10, step=5, key="wiki_search_k")
+        if query.strip():
+            hits = kb.search(query, top_k=int(top_k))
+            if hits:
+                st.caption(f"共 {len(hits)} 筆相關段落 (依 BM25 相關度排序)")
+                for i, h in enumerate(hits, 1):
+                    st.markdown(f"**{i}. `{h['section']}`** · {h['source']} · 相關度 {h['score']:.2f}")
+                    text = h['text']
+                    st.text(text if len(text) <= 600 else text[:600] + "…")
+            else:
+                st.info("找不到相關段落，請換個關鍵字。")
+            st.markdown("---")
+
         with st.expander("點此展開，查核系統內建的完整 SOP 規則庫", expanded=False):
             if 'all_rules' not in st.session_state:
                 st.session_state.all_rules = kb.get_all_rules_for_ui()
@@ -235,24 +251,17 @@ def render():
             put_col      = next((c for c in df.columns if 'put' in c.lower() or '賣回' in c.lower()), None)
 
             if code_col and name_col:
-                for _, row in df.iterrows():
-                    try:
-                        events = calendar.calculate_time_traps(
-                            str(row.get(code_col, '')),
-                            str(row.get(list_col, '')) if list_col else '',
-                            str(row.get(put_col,  '')) if put_col  else ''
-                        )
-                        for ev in events:
-                            ev_date = pd.to_datetime(ev['date']).date()
-                            if today <= ev_date <= future_date:
-                                upcoming_events.append({
-                                    "name":  row.get(name_col, ''),
-                                    "date":  ev_date,
-                                    "event": ev['event'],
-                                    "desc":  ev.get('desc','')
-                                })
-                    except Exception:
-                        pass
+                table = calendar.build_event_table(
+                    df[code_col],
+                    df[list_col] if list_col else None,
+                    df[put_col]  if put_col  else None
+                )
+                window = calendar.events_between(table, today, future_date)
+                names = df[name_col].to_numpy()
+                upcoming_events = [
+                    {"name": names[r], "date": d.date(), "event": e, "desc": desc}
+                    for r, d, e, desc in window[["row", "date", "event", "desc"]].itertuples(index=False, name=None)
+                ]
 
             if upcoming_events:
                 upcoming_events.sort(key=lambda x: x['date'])
@@ -15,9 +15,13 @@ import yfinance as yf
 import plotly.graph_objects as go
 import altair as alt
 from datetime import datetime, timedelta
-from scipy.stats import linregress
 import io
 
+from price_store import load_history, get_exchange_map, FULL_HISTORY_START
+from indicators import attach_ma, build_price_panel, geometry_dict, geometry_table
+from hunter import TheaterHunter, HUNT_COLUMNS
+from snapshot_store import get_snapshot_store
+
 # ── 嘗試導入可選依賴 ─────────────────────────────────────────────────────────
 try:
     import google.generativeai as genai
@@ -41,19 +45,11 @@ except ImportError:
 # ═══════════════════════════════════════════════════════════════
 @st.cache_data(ttl=3600)
 def _download_monthly(ticker: str) -> pd.DataFrame | None:
-    """下載全歷史月K，支援台股雙軌 (.TW/.TWO)"""
+    """讀取全歷史月K (經由本地 Price Store)，支援台股雙軌 (.TW/.TWO)"""
     orig = ticker
-    if ticker.isdigit() and len(ticker) >= 4:
-        ticker = f"{ticker}.TW"
     try:
-        df = yf.download(ticker, start="1990-01-01", progress=False, auto_adjust=True)
-        if df.empty and orig.isdigit():
-            df = yf.download(f"{orig}.TWO", start="1990-01-01", progress=False, auto_adjust=True)
+        df = load_history(ticker, start=FULL_HISTORY_START)
         if df.empty: return None
-        if isinstance(df.columns, pd.MultiIndex):
-            df.columns = df.columns.get_level_values(0)
-        if not isinstance(df.index, pd.DatetimeIndex):
-            df.index = pd.to_datetime(df.index)
         # 存日K供圖表用
         if 'daily_price_data' not in st.session_state:
             st.session_state.daily_price_data = {}
@@ -67,23 +63,10 @@ def _download_monthly(ticker: str) -> pd.DataFrame | None:
 # ═══════════════════════════════════════════════════════════════
 # [SLOT-6.2] 數學引擎
 # ═══════════════════════════════════════════════════════════════
-def _geometry_slice(df: pd.DataFrame, months: int) -> dict:
-    sl = df.iloc[-months:] if len(df) >= months else df
-    if len(sl) < 3: return {'angle': 0, 'r2': 0, 'slope': 0}
-    lp = np.log(sl['Close'].values)
-    x  = np.arange(len(lp))
-    slope, _, r_val, _, _ = linregress(x, lp)
-    angle = float(np.clip(np.arctan(slope * 100) * (180 / np.pi), -90, 90))
-    return {'angle': round(angle, 2), 'r2': round(r_val**2, 4), 'slope': round(slope, 6)}
-
 def _compute_7d(ticker: str) -> dict | None:
     df = _download_monthly(ticker)
     if df is None: return None
-    periods = {'35Y':420,'10Y':120,'5Y':60,'3Y':36,'1Y':12,'6M':6,'3M':3}
-    res = {k: _geometry_slice(df, v) for k, v in periods.items()}
-    res['acceleration']   = round(res['3M']['angle'] - res['1Y']['angle'], 2)
-    res['phoenix_signal'] = (res['10Y']['angle'] < 0) and (res['6M']['angle'] > 25)
-    return res
+    return geometry_dict(geometry_table(df[['Close']]).iloc[0])
 
 
 # ═══════════════════════════════════════════════════════════════
@@ -125,12 +108,14 @@ def _titan_rating(geo: dict) -> tuple:
 # ═══════════════════════════════════════════════════════════════
 def _valkyrie_report(ticker: str) -> str:
     orig = ticker
-    if ticker.isdigit() and len(ticker) >= 4: ticker = f"{ticker}.TW"
+    xmap = get_exchange_map()
+    if ticker.isdigit() and len(ticker) >= 4: ticker = (xmap.candidates(orig) or [f"{orig}.TW"])[0]
     try:
         t    = yf.Ticker(ticker)
         info = t.info or {}
-        if not info.get('symbol') and orig.isdigit():
+        if not info.get('symbol') and orig.isdigit() and ticker.endswith('.TW'):
             ticker = f"{orig}.TWO"; t = yf.Ticker(ticker); info = t.info or {}
+        if info.get('symbol') and orig.isdigit(): xmap.learn([ticker])
 
         def fmt_pct(v): return f"{v*100:.2f}%" if isinstance(v,(int,float)) else str(v)
         def fmt_bn(v):  return f"${v/1e9:.2f}B" if isinstance(v,(int,float)) and v>1e9 else (f"${v/1e6:.2f}M" if isinstance(v,(int,float)) else str(v))
@@ -233,8 +218,7 @@ def _render_monthly_chart(ticker: str, months: int = 120):
     for c in ['Open','High','Low','Close','Volume']:
         if c not in df.columns: df[c] = df.get('Close', 0)
     df = df.tail(months * 22)  # ~months月的交易日
-    df['MA87']  = df['Close'].rolling(87).mean()
-    df['MA284'] = df['Close'].rolling(284).mean()
+    df = attach_ma(df.copy())
     bk = alt.Chart(df).encode(x=alt.X('Date:T'))
     col = alt.condition("datum.Open<=datum.Close", alt.value("#FF4B4B"), alt.value("#26A69A"))
     candles = (bk.mark_rule().encode(y=alt.Y('Low', scale=alt.Scale(zero=False)), y2='High', color=col) +
@@ -271,22 +255,27 @@ def render():
             tickers = [t.strip() for t in tickers_raw.split(",") if t.strip()]
             results = []
             prog = st.progress(0); status = st.empty()
+            monthly = {}
             for i, t in enumerate(tickers):
-                status.text(f"分析 {t}… ({i+1}/{len(tickers)})")
-                geo = _compute_7d(t)
-                if geo:
-                    rating = _titan_rating(geo)
-                    price = 0.0
-                    dp = st.session_state.get('daily_price_data', {}).get(
-                        t if not t.endswith(('.TW','.TWO')) else t.split('.')[0])
-                    if dp is not None and not dp.empty: price = float(dp['Close'].iloc[-1])
-                    results.append({
-                        '代號': t, '現價': price, '信評': f"{rating[0]} {rating[1]}",
-                        '35Y角度': geo['35Y']['angle'], '10Y角度': geo['10Y']['angle'],
-                        '1Y角度':  geo['1Y']['angle'],  '3M角度':  geo['3M']['angle'],
-                        '加速度': geo['acceleration'], 'Phoenix': '✅' if geo['phoenix_signal'] else '—'
-                    })
+                status.text(f"讀取 {t}… ({i+1}/{len(tickers)})")
+                m = _download_monthly(t)
+                if m is not None: monthly[t] = m
                 prog.progress((i+1)/len(tickers))
+            # 全部標的一次向量化計算 7D 幾何
+            geo_tbl = geometry_table(build_price_panel(monthly))
+            for t in geo_tbl.index:
+                geo = geometry_dict(geo_tbl.loc[t])
+                rating = _titan_rating(geo)
+                price = 0.0
+                dp = st.session_state.get('daily_price_data', {}).get(
+                    t if not t.endswith(('.TW','.TWO')) else t.split('.')[0])
+                if dp is not None and not dp.empty: price = float(dp['Close'].iloc[-1])
+                results.append({
+                    '代號': t, '現價': price, '信評': f"{rating[0]} {rating[1]}",
+                    '35Y角度': geo['35Y']['angle'], '10Y角度': geo['10Y']['angle'],
+                    '1Y角度':  geo['1Y']['angle'],  '3M角度':  geo['3M']['angle'],
+                    '加速度': geo['acceleration'], 'Phoenix': '✅' if geo['phoenix_signal'] else '—'
+                })
             status.text("✅ 掃描完成")
             prog.empty()
             if results:
@@ -490,30 +479,38 @@ def render():
             count   = len(WAR_THEATERS.get(theater, []))
             st.info(f"戰區 **{theater}**，共 **{count}** 檔。")
 
-            if st.button("🚀 啟動全境掃描", type="primary", key="btn_hunt"):
+            c_hunt, c_stop = st.columns([3, 1])
+            hunt_btn = c_hunt.button("🚀 啟動全境掃描", type="primary", key="btn_hunt", use_container_width=True)
+            # 停止：按鈕觸發的 rerun 由 Streamlit 直接中斷正在跑的掃描 (iter_hunt 的 finally 取消未開始的塊)；
+            # 每塊戰果已即時寫入 session_state，這裡只回報中斷時保留的部分
+            if c_stop.button("⏹️ 停止", key="btn_hunt_stop", use_container_width=True):
+                stopped = st.session_state.pop('hunt_running', None)
+                if stopped is not None:
+                    n_hit = len(st.session_state.get(f'hunt_{stopped}', []))
+                    st.warning(f"⏹️ 掃描已中止，保留已完成部分：**{n_hit}** 個目標。")
+
+            if hunt_btn:
                 tickers = WAR_THEATERS[theater]
-                results = []
-                prog = st.progress(0)
-                for i, t in enumerate(tickers):
-                    geo = _compute_7d(t)
-                    prog.progress((i+1)/len(tickers), text=f"掃描 {t}…")
-                    if geo:
-                        cp = 0.0
-                        dp = st.session_state.get('daily_price_data', {}).get(t.split('.')[0])
-                        if dp is not None and not dp.empty: cp = float(dp['Close'].iloc[-1])
-                        mt = None
-                        if geo['10Y']['angle'] < 10 and geo['3M']['angle'] > 45:     mt = "🔥 Phoenix"
-                        elif abs(geo['35Y']['angle']) < 15 and geo['acceleration'] > 20: mt = "🦁 Awakening"
-                        elif geo['3M']['angle'] > 60:                                mt = "🚀 Rocket"
-                        if mt:
-                            results.append({
-                                "代號":t, "現價":cp, "35Y角度":geo['35Y']['angle'],
-                                "10Y角度":geo['10Y']['angle'], "3M角度":geo['3M']['angle'],
-                                "G力":geo['acceleration'], "型態":mt
-                            })
-                prog.empty()
-                st.session_state[f'hunt_{theater}'] = pd.DataFrame(results)
-                st.success(f"✅ 掃描完成，發現 **{len(results)}** 個潛在目標！")
+                st.session_state['hunt_running'] = theater
+                found = []
+                prog = st.progress(0); live = st.empty()
+                # 分塊批次下載 + 執行緒池；每完成一塊即更新戰果
+                for done, total, hits in TheaterHunter().iter_hunt(tickers):
+                    if not hits.empty: found.append(hits)
+                    partial = pd.concat(found, ignore_index=True) if found else pd.DataFrame(columns=HUNT_COLUMNS)
+                    st.session_state[f'hunt_{theater}'] = partial
+                    prog.progress(done/total, text=f"已掃描 {done}/{total} 檔，命中 {len(partial)}")
+                    if not partial.empty: live.dataframe(partial, use_container_width=True)
+                prog.empty(); live.empty()
+                st.session_state.pop('hunt_running', None)
+                n_hit = len(st.session_state.get(f'hunt_{theater}', []))
+                st.success(f"✅ 掃描完成，發現 **{n_hit}** 個潛在目標！")
+
+        if f'hunt_{theater}' not in st.session_state:
+            snap = get_snapshot_store().load(f"hunt_{theater}")
+            if snap is not None:
+                st.session_state[f'hunt_{theater}'] = snap
+                st.caption("⏱️ 以下為排程預算的戰果，可重新啟動掃描更新。")
 
         if f'hunt_{theater}' in st.session_state:
             hr = st.session_state[f'hunt_{theater}']
@@ -4,8 +4,8 @@
 
 import streamlit as st
 import pandas as pd
-from core_logic import compute_7d_geometry, titan_rating_system
-from utils_ui import get_rating_color
+from core_logic import titan_rating_system
+from utils_ui import cached_7d_geometry, get_rating_color
 
 
 def render():
@@ -88,7 +88,7 @@ def render():
     
     with st.spinner("📐 計算中..."):
         try:
-            geo_data = compute_7d_geometry(str(stock_code))
+            geo_data = cached_7d_geometry(str(stock_code))
             
             if geo_data:
                 rating_info = titan_rating_system(geo_data)
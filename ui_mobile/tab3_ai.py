@@ -6,9 +6,9 @@ import streamlit as st
 from core_logic import (
     TitanAgentCouncil, 
     TitanIntelAgency,
-    compute_7d_geometry, 
     titan_rating_system
 )
+from utils_ui import cached_7d_geometry
 from data_engine import download_stock_price
 
 
@@ -105,7 +105,7 @@ def render():
             
             try:
                 # Step 1: 計算 7D 幾何
-                geo_data = compute_7d_geometry(ticker)
+                geo_data = cached_7d_geometry(ticker)
                 
                 if geo_data is None:
                     st.error(f"❌ 無法獲取 {ticker} 的數據")
@@ -297,3 +297,25 @@ def format_pct_change(val: float) -> str:
     """格式化百分比變動，正數顯示 + 號"""
     if val > 0: return f"+{val:.2f}%"
     return f"{val:.2f}%"
+
+
+# ═══════════════════════════════════════════════════════════════
+#  引擎快取層 (Streamlit 快取只在 UI 端套用；引擎本身維持純 Python)
+# ═══════════════════════════════════════════════════════════════
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _geometry_with_daily(ticker: str):
+    from core_logic import compute_7d_geometry
+    daily = {}
+    return compute_7d_geometry(ticker, daily_cache=daily), daily.get(ticker)
+
+
+def cached_7d_geometry(ticker: str) -> dict | None:
+    """
+    compute_7d_geometry 的 UI 版：日K → 月K 轉換與 7D 幾何以 st.cache_data 快取 1 小時，
+    rerun 不再重算；日K 同步寫入 st.session_state.daily_price_data 供圖表使用。
+    """
+    geo, daily = _geometry_with_daily(str(ticker))
+    if daily is not None:
+        st.session_state.setdefault('daily_price_data', {})[str(ticker)] = daily
+    return geo